@@ -1,7 +1,201 @@
-from flask import render_template, request, redirect, url_for, flash
-
-from db import get_db
-from security import role_required
+import base64
+import json
+
+from flask import (
+    render_template, request, redirect, url_for, flash, abort, current_app, Response,
+    stream_with_context,
+)
+
+from archive import history_source
+from bulk_import import ImportReport, get_job, recent_jobs, start_import
+from counters import dashboard_counts
+from db import get_db, pool_stats
+from export import FORMATS as EXPORT_FORMATS, export_chunks, filename as export_filename, iso_date
+from metrics import get_registry
+from slow_queries import aggregate, read_entries
+from passwords import HashingBusy, hash_password
+from reference import reference_data
+from search import DOCTOR_MATCH_IDS, PATIENT_MATCH_IDS, fts_query
+from security import invalidate_identity, role_required
+from streaming import rows_for_template, stream_page
+
+
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+
+
+def _page_size():
+    try:
+        size = int(request.args.get("per_page", DEFAULT_PAGE_SIZE))
+    except ValueError:
+        size = DEFAULT_PAGE_SIZE
+    return max(1, min(size, MAX_PAGE_SIZE))
+
+
+def _encode_cursor(*values):
+    raw = json.dumps(values, separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def _decode_cursor(token, *types):
+    """
+    Return the cursor values, or None for a missing or malformed cursor.
+    `types` gives the expected type of each position, e.g. (str, int).
+    """
+    if not token:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4))
+        values = json.loads(raw)
+    except (ValueError, TypeError):
+        return None
+    if not isinstance(values, list) or len(values) != len(types):
+        return None
+    for value, expected in zip(values, types):
+        # bool is an int subclass; JSON true/false is never a valid key.
+        if not isinstance(value, expected) or isinstance(value, bool):
+            return None
+    return values
+
+
+def _fetch_page(cur, query, where, params, order_by, limit):
+    """
+    Run a keyset-paginated query. Fetches one extra row to find out whether
+    another page exists and returns (rows, has_more).
+    """
+    if where:
+        query += " WHERE " + " AND ".join(where)
+    query += f" ORDER BY {order_by} LIMIT ?"
+    cur.execute(query, params + [limit + 1])
+    rows = cur.fetchall()
+    return rows[:limit], len(rows) > limit
+
+
+def doctors_page(cur, q="", after=None, limit=DEFAULT_PAGE_SIZE):
+    """One page of doctors ordered by (name, id), starting after `after`."""
+    where, params = [], []
+    match = fts_query(q)
+    if match:
+        where.append(f"dp.id IN ({DOCTOR_MATCH_IDS})")
+        params.append(match)
+    cursor = _decode_cursor(after, str, int)
+    if cursor:
+        where.append("(dp.name, dp.id) > (?, ?)")
+        params += cursor
+    rows, has_more = _fetch_page(
+        cur,
+        """
+        SELECT dp.id,
+               dp.name,
+               dp.specialization,
+               dp.phone,
+               dp.department_id,
+               u.email,
+               u.status,
+               u.id AS user_id
+        FROM doctor_profiles dp
+        JOIN users u ON dp.user_id = u.id
+        """,
+        where,
+        params,
+        "dp.name, dp.id",
+        limit,
+    )
+    next_cursor = _encode_cursor(rows[-1]["name"], rows[-1]["id"]) if has_more else None
+    return rows, next_cursor
+
+
+def patients_page(cur, q="", after=None, limit=DEFAULT_PAGE_SIZE):
+    """One page of patients ordered by (name, id), starting after `after`."""
+    where, params = [], []
+    match = fts_query(q)
+    if match:
+        try:
+            pid = int(q)
+        except ValueError:
+            pid = -1
+        where.append(f"p.id IN ({PATIENT_MATCH_IDS} UNION ALL SELECT ?)")
+        params += [match, pid]
+    cursor = _decode_cursor(after, str, int)
+    if cursor:
+        where.append("(p.name, p.id) > (?, ?)")
+        params += cursor
+    rows, has_more = _fetch_page(
+        cur,
+        """
+        SELECT p.id,
+               p.name,
+               p.age,
+               p.gender,
+               p.phone,
+               p.address,
+               u.email,
+               u.status,
+               u.id AS user_id
+        FROM patient_profiles p
+        JOIN users u ON p.user_id = u.id
+        """,
+        where,
+        params,
+        "p.name, p.id",
+        limit,
+    )
+    next_cursor = _encode_cursor(rows[-1]["name"], rows[-1]["id"]) if has_more else None
+    return rows, next_cursor
+
+
+def appointments_page(cur, status="", after=None, limit=DEFAULT_PAGE_SIZE):
+    """One page of appointments, newest first by (date, time, id)."""
+    where, params = [], []
+    if status:
+        where.append("a.status = ?")
+        params.append(status)
+    cursor = _decode_cursor(after, str, str, int)
+    if cursor:
+        where.append("(a.date, a.time, a.id) < (?, ?, ?)")
+        params += cursor
+    rows, has_more = _fetch_page(
+        cur,
+        """
+        SELECT a.id,
+               a.date,
+               a.time,
+               a.status,
+               a.created_at,
+               d.name AS doctor_name,
+               p.name AS patient_name
+        FROM appointments a
+        JOIN doctor_profiles d ON a.doctor_id = d.id
+        JOIN patient_profiles p ON a.patient_id = p.id
+        """,
+        where,
+        params,
+        "a.date DESC, a.time DESC, a.id DESC",
+        limit,
+    )
+    next_cursor = (
+        _encode_cursor(rows[-1]["date"], rows[-1]["time"], rows[-1]["id"]) if has_more else None
+    )
+    return rows, next_cursor
+
+
+def _dashboard_filters():
+    return {
+        "doc_q": request.args.get("doc_q", "").strip(),
+        "pat_q": request.args.get("pat_q", "").strip(),
+        "status": request.args.get("status", "").strip(),
+    }
+
+
+def _load_panel(cur, panel, filters, limit):
+    if panel == "doctors":
+        return doctors_page(cur, filters["doc_q"], request.args.get("doc_after"), limit)
+    if panel == "patients":
+        return patients_page(cur, filters["pat_q"], request.args.get("pat_after"), limit)
+    return appointments_page(cur, filters["status"], request.args.get("appt_after"), limit)
+
+
+DASHBOARD_PANELS = ("doctors", "patients", "appointments")
 
 
 def init_admin_routes(app):
@@ -11,157 +205,43 @@ def init_admin_routes(app):
         conn = get_db()
         cur = conn.cursor()
 
-        cur.execute("SELECT COUNT(*) AS c FROM doctor_profiles")
-        doctor_count = cur.fetchone()["c"]
-
-        cur.execute("SELECT COUNT(*) AS c FROM patient_profiles")
-        patient_count = cur.fetchone()["c"]
-
-        cur.execute("SELECT COUNT(*) AS c FROM appointments")
-        appointment_count = cur.fetchone()["c"]
+        counts = dashboard_counts(cur, reference_data().departments)
 
-        doc_q = request.args.get("doc_q", "").strip()
-        pat_q = request.args.get("pat_q", "").strip()
-        appt_status = request.args.get("status", "").strip()
-
-        if doc_q:
-            like = f"%{doc_q}%"
-            cur.execute(
-                """
-                SELECT dp.id,
-                       dp.name,
-                       dp.specialization,
-                       dp.phone,
-                       dp.department_id,
-                       d.name AS department_name,
-                       u.email,
-                       u.status,
-                       u.id AS user_id
-                FROM doctor_profiles dp
-                JOIN users u ON dp.user_id = u.id
-                LEFT JOIN departments d ON dp.department_id = d.id
-                WHERE dp.name LIKE ?
-                   OR dp.specialization LIKE ?
-                   OR d.name LIKE ?
-                ORDER BY dp.name
-                """,
-                (like, like, like),
-            )
-        else:
-            cur.execute(
-                """
-                SELECT dp.id,
-                       dp.name,
-                       dp.specialization,
-                       dp.phone,
-                       dp.department_id,
-                       d.name AS department_name,
-                       u.email,
-                       u.status,
-                       u.id AS user_id
-                FROM doctor_profiles dp
-                JOIN users u ON dp.user_id = u.id
-                LEFT JOIN departments d ON dp.department_id = d.id
-                ORDER BY dp.name
-                """,
-            )
-        doctors = cur.fetchall()
-
-        if pat_q:
-            like = f"%{pat_q}%"
-            try:
-                pid = int(pat_q)
-            except ValueError:
-                pid = -1
-            cur.execute(
-                """
-                SELECT p.id,
-                       p.name,
-                       p.age,
-                       p.gender,
-                       p.phone,
-                       p.address,
-                       u.email,
-                       u.status,
-                       u.id AS user_id
-                FROM patient_profiles p
-                JOIN users u ON p.user_id = u.id
-                WHERE p.name LIKE ?
-                   OR p.phone LIKE ?
-                   OR u.email LIKE ?
-                   OR p.id = ?
-                ORDER BY p.name
-                """,
-                (like, like, like, pid),
-            )
-        else:
-            cur.execute(
-                """
-                SELECT p.id,
-                       p.name,
-                       p.age,
-                       p.gender,
-                       p.phone,
-                       p.address,
-                       u.email,
-                       u.status,
-                       u.id AS user_id
-                FROM patient_profiles p
-                JOIN users u ON p.user_id = u.id
-                ORDER BY p.name
-                """,
-            )
-        patients = cur.fetchall()
-
-        if appt_status:
-            cur.execute(
-                """
-                SELECT a.id,
-                       a.date,
-                       a.time,
-                       a.status,
-                       a.created_at,
-                       d.name AS doctor_name,
-                       p.name AS patient_name
-                FROM appointments a
-                JOIN doctor_profiles d ON a.doctor_id = d.id
-                JOIN patient_profiles p ON a.patient_id = p.id
-                WHERE a.status = ?
-                ORDER BY a.date DESC, a.time DESC
-                """,
-                (appt_status,),
-            )
-        else:
-            cur.execute(
-                """
-                SELECT a.id,
-                       a.date,
-                       a.time,
-                       a.status,
-                       a.created_at,
-                       d.name AS doctor_name,
-                       p.name AS patient_name
-                FROM appointments a
-                JOIN doctor_profiles d ON a.doctor_id = d.id
-                JOIN patient_profiles p ON a.patient_id = p.id
-                ORDER BY a.date DESC, a.time DESC
-                """,
-            )
-        appointments = cur.fetchall()
+        filters = _dashboard_filters()
+        per_page = _page_size()
+        panels = {}
+        for panel in DASHBOARD_PANELS:
+            rows, next_cursor = _load_panel(cur, panel, filters, per_page)
+            panels[panel] = {"rows": rows, "next_cursor": next_cursor}
 
         conn.close()
 
         return render_template(
             "admin/dashboard.html",
-            doctor_count=doctor_count,
-            patient_count=patient_count,
-            appointment_count=appointment_count,
-            doctors=doctors,
-            patients=patients,
-            appointments=appointments,
-            doc_q=doc_q,
-            pat_q=pat_q,
-            status=appt_status,
+            panels=panels,
+            per_page=per_page,
+            **counts,
+            **filters,
+        )
+
+    @app.route("/admin/dashboard/panels/<panel>")
+    @role_required("admin")
+    def admin_dashboard_panel(panel):
+        """Render the next page of a single dashboard panel as table rows."""
+        if panel not in DASHBOARD_PANELS:
+            abort(404)
+        conn = get_db()
+        cur = conn.cursor()
+        filters = _dashboard_filters()
+        per_page = _page_size()
+        rows, next_cursor = _load_panel(cur, panel, filters, per_page)
+        conn.close()
+        return render_template(
+            f"admin/panels/{panel}.html",
+            rows=rows,
+            next_cursor=next_cursor,
+            per_page=per_page,
+            **filters,
         )
 
     @app.route("/admin/doctors")
@@ -172,35 +252,35 @@ def init_admin_routes(app):
         cur = conn.cursor()
 
         base_query = """
-            SELECT d.*, u.email, u.status, dept.name AS department_name
+            SELECT d.*, u.email, u.status
             FROM doctor_profiles d
             JOIN users u ON d.user_id = u.id
-            LEFT JOIN departments dept ON d.department_id = dept.id
         """
         params = []
 
-        if q:
-            base_query += " WHERE d.name LIKE ? OR d.specialization LIKE ? OR dept.name LIKE ?"
-            like = f"%{q}%"
-            params = [like, like, like]
-
-        base_query += " ORDER BY d.name"
+        match = fts_query(q)
+        if match:
+            base_query += """
+                JOIN (
+                    SELECT rowid AS id, rank FROM doctor_search WHERE doctor_search MATCH ?
+                ) s ON s.id = d.id
+                ORDER BY s.rank, d.name
+            """
+            params = [match]
+        else:
+            base_query += " ORDER BY d.name"
         cur.execute(base_query, params)
-        doctors = cur.fetchall()
-        conn.close()
-        return render_template("admin/doctors_list.html", doctors=doctors, q=q)
+        doctors = rows_for_template(cur)
+        return stream_page("admin/doctors_list.html", doctors=doctors, q=q)
 
     @app.route("/admin/doctors/new", methods=["GET", "POST"])
     @role_required("admin")
     def admin_add_doctor():
         conn = get_db()
         cur = conn.cursor()
-        cur.execute("SELECT * FROM departments ORDER BY name")
-        departments = cur.fetchall()
+        departments = reference_data().departments
 
         if request.method == "POST":
-            from werkzeug.security import generate_password_hash
-
             email = request.form.get("email", "").strip()
             password = request.form.get("password", "")
             name = request.form.get("name", "").strip()
@@ -220,7 +300,12 @@ def init_admin_routes(app):
                 conn.close()
                 return redirect(url_for("admin_add_doctor"))
 
-            password_hash = generate_password_hash(password)
+            try:
+                password_hash = hash_password(password)
+            except HashingBusy:
+                conn.close()
+                flash("The server is busy. Please try again in a moment.", "warning")
+                return redirect(url_for("admin_add_doctor"))
             cur.execute(
                 "INSERT INTO users (email, password_hash, role, status) "
                 "VALUES (?, ?, 'doctor', 'active')",
@@ -249,8 +334,7 @@ def init_admin_routes(app):
     def admin_edit_doctor(doctor_id):
         conn = get_db()
         cur = conn.cursor()
-        cur.execute("SELECT * FROM departments ORDER BY name")
-        departments = cur.fetchall()
+        departments = reference_data().departments
 
         cur.execute(
             """
@@ -268,8 +352,6 @@ def init_admin_routes(app):
             return redirect(url_for("admin_dashboard"))
 
         if request.method == "POST":
-            from werkzeug.security import generate_password_hash
-
             email = request.form.get("email", "").strip()
             name = request.form.get("name", "").strip()
             specialization = request.form.get("specialization", "").strip()
@@ -284,7 +366,12 @@ def init_admin_routes(app):
                 return redirect(url_for("admin_edit_doctor", doctor_id=doctor_id))
 
             if new_password:
-                password_hash = generate_password_hash(new_password)
+                try:
+                    password_hash = hash_password(new_password)
+                except HashingBusy:
+                    conn.close()
+                    flash("The server is busy. Please try again in a moment.", "warning")
+                    return redirect(url_for("admin_edit_doctor", doctor_id=doctor_id))
                 cur.execute(
                     "UPDATE users SET email = ?, password_hash = ? WHERE id = ?",
                     (email, password_hash, doctor["user_id"]),
@@ -306,6 +393,7 @@ def init_admin_routes(app):
 
             conn.commit()
             conn.close()
+            invalidate_identity(doctor["user_id"])
             flash("Doctor updated successfully.", "success")
             return redirect(url_for("admin_dashboard"))
 
@@ -329,20 +417,30 @@ def init_admin_routes(app):
             JOIN users u ON p.user_id = u.id
         """
         params = []
-        if q:
-            base_query += " WHERE p.name LIKE ? OR p.phone LIKE ? OR u.email LIKE ? OR p.id = ?"
-            like = f"%{q}%"
+        match = fts_query(q)
+        if match:
             try:
                 pid = int(q)
             except ValueError:
                 pid = -1
-            params = [like, like, like, pid]
-
-        base_query += " ORDER BY p.name"
+            # An exact patient ID match ranks ahead of every text match.
+            base_query += """
+                JOIN (
+                    SELECT id, MIN(rank) AS rank FROM (
+                        SELECT rowid AS id, rank FROM patient_search WHERE patient_search MATCH ?
+                        UNION ALL
+                        SELECT ?, -1e308
+                    )
+                    GROUP BY id
+                ) s ON s.id = p.id
+                ORDER BY s.rank, p.name
+            """
+            params = [match, pid]
+        else:
+            base_query += " ORDER BY p.name"
         cur.execute(base_query, params)
-        patients = cur.fetchall()
-        conn.close()
-        return render_template("admin/patients_list.html", patients=patients, q=q)
+        patients = rows_for_template(cur)
+        return stream_page("admin/patients_list.html", patients=patients, q=q)
 
     @app.route("/admin/patients/<int:patient_id>/edit", methods=["GET", "POST"])
     @role_required("admin")
@@ -394,6 +492,7 @@ def init_admin_routes(app):
 
             conn.commit()
             conn.close()
+            invalidate_identity(patient["user_id"])
             flash("Patient updated successfully.", "success")
             return redirect(url_for("admin_dashboard"))
 
@@ -418,19 +517,94 @@ def init_admin_routes(app):
         cur.execute("UPDATE users SET status = ? WHERE id = ?", (new_status, user_id))
         conn.commit()
         conn.close()
+        invalidate_identity(user_id)
         flash(f"User status updated to {new_status}.", "success")
         return redirect(_req.referrer or url_for("admin_dashboard"))
 
+    @app.route("/admin/metrics", methods=["GET", "POST"])
+    @role_required("admin")
+    def admin_metrics():
+        registry = get_registry()
+        if request.method == "POST":
+            registry.reset()
+            flash("Metrics reset.", "success")
+            return redirect(url_for("admin_metrics"))
+
+        extensions = current_app.extensions
+        return render_template(
+            "admin/metrics.html",
+            endpoints=registry.endpoints(),
+            statements=registry.statements(),
+            pool=pool_stats(current_app),
+            read_pool=pool_stats(current_app, "db_read_pool"),
+            hashing=extensions["password_hasher"].stats() if "password_hasher" in extensions else None,
+            principals=extensions["principals"].stats() if "principals" in extensions else None,
+            writer=extensions["writer"].stats() if "writer" in extensions else None,
+            cache=extensions["cache"].stats() if "cache" in extensions else None,
+            reference=extensions["reference"].stats() if "reference" in extensions else None,
+        )
+
+    @app.route("/admin/slow-queries")
+    @role_required("admin")
+    def admin_slow_queries():
+        q = request.args.get("q", "").strip()
+        endpoint = request.args.get("endpoint", "").strip()
+        log = current_app.extensions.get("slow_queries")
+        groups = aggregate(read_entries(log.directory), q=q, endpoint=endpoint) if log else []
+        return render_template(
+            "admin/slow_queries.html",
+            groups=groups,
+            q=q,
+            endpoint=endpoint,
+            threshold_ms=current_app.config.get("SLOW_QUERY_MS"),
+        )
+
+    @app.route("/admin/import", methods=["GET", "POST"])
+    @role_required("admin")
+    def admin_bulk_import():
+        if request.method == "POST":
+            upload = request.files.get("file")
+            role = request.form.get("role") or None
+            if not upload or not upload.filename:
+                flash("Please choose a CSV or JSONL file.", "danger")
+                return redirect(url_for("admin_bulk_import"))
+
+            conn = get_db()
+            job_id = start_import(conn, upload, role)
+            conn.close()
+            flash(f"Importing {upload.filename} in the background.", "info")
+            return redirect(url_for("admin_bulk_import_job", job_id=job_id))
+
+        conn = get_db()
+        jobs = recent_jobs(conn)
+        conn.close()
+        return render_template("admin/bulk_import.html", job=None, report=None, jobs=jobs)
+
+    @app.route("/admin/import/<int:job_id>")
+    @role_required("admin")
+    def admin_bulk_import_job(job_id):
+        conn = get_db()
+        job = get_job(conn, job_id)
+        jobs = recent_jobs(conn)
+        conn.close()
+        if job is None:
+            flash("Import not found.", "danger")
+            return redirect(url_for("admin_bulk_import"))
+        return render_template(
+            "admin/bulk_import.html", job=job, report=ImportReport.from_job(job), jobs=jobs
+        )
+
     @app.route("/admin/appointments")
     @role_required("admin")
     def admin_appointments():
         status = request.args.get("status", "").strip()
+        deep_history = request.args.get("history") == "all"
         conn = get_db()
         cur = conn.cursor()
 
-        query = """
+        query = f"""
             SELECT a.*, d.name AS doctor_name, p.name AS patient_name
-            FROM appointments a
+            FROM {history_source(conn, deep_history)} a
             JOIN doctor_profiles d ON a.doctor_id = d.id
             JOIN patient_profiles p ON a.patient_id = p.id
         """
@@ -441,10 +615,40 @@ def init_admin_routes(app):
         query += " ORDER BY a.date DESC, a.time DESC"
 
         cur.execute(query, params)
-        appointments = cur.fetchall()
-        conn.close()
-        return render_template(
+        appointments = rows_for_template(cur)
+        return stream_page(
             "admin/appointments_list.html",
             appointments=appointments,
             status=status,
+            deep_history=deep_history,
+        )
+
+    @app.route("/admin/appointments/export.<fmt>")
+    @role_required("admin")
+    def admin_export_appointments(fmt):
+        if fmt not in EXPORT_FORMATS:
+            abort(404)
+        filters = {
+            "status": request.args.get("status", "").strip(),
+            "doctor_id": request.args.get("doctor_id", type=int),
+            "department_id": request.args.get("department_id", type=int),
+            "date_from": request.args.get("from", "").strip(),
+            "date_to": request.args.get("to", "").strip(),
+        }
+        for key in ("date_from", "date_to"):
+            if filters[key]:
+                try:
+                    filters[key] = iso_date(filters[key])
+                except ValueError:
+                    abort(400)
+        deep_history = request.args.get("history") == "all"
+        conn = get_db()
+        # The pooled connection stays checked out until the last chunk is sent.
+        chunks = export_chunks(conn, filters, fmt, archived=deep_history)
+        return Response(
+            stream_with_context(chunks),
+            mimetype=EXPORT_FORMATS[fmt],
+            headers={
+                "Content-Disposition": f'attachment; filename="{export_filename(filters, fmt)}"'
+            },
         )
@@ -5,20 +5,64 @@ from flask_login import (
     login_user,
     logout_user,
 )
-from werkzeug.security import check_password_hash, generate_password_hash
 
-from db import init_db, get_db
+from availability import init_app as init_availability
+from cache import init_app as init_cache
+from db import get_db, init_app as init_db_pool
+from metrics import init_app as init_metrics
+from migrations import init_app as init_migrations
+from reference import init_app as init_reference
+from slow_queries import init_app as init_slow_queries
+from passwords import (
+    HashingBusy,
+    hash_password,
+    init_app as init_passwords,
+    needs_rehash,
+    verify_password,
+)
 from admin_routes import init_admin_routes
 from doctor_routes import init_doctor_routes
 from patient_routes import init_patient_routes
+from security import init_app as init_principals, load_identity
+from streaming import init_app as init_streaming
+from writer import init_app as init_writer
 
-app = Flask(__name__)
-app.config["SECRET_KEY"] = "change-this-secret-key"
-init_db()
-login_manager = LoginManager(app)
+login_manager = LoginManager()
 login_manager.login_view = "login"
 
 
+def create_app(config=None):
+    """
+    Build the Flask app. Importing this module doesn't touch the database;
+    creating the app brings it up to date (see migrations.py) and warms the
+    caches. `config` overrides the defaults before any extension reads them.
+    """
+    app = Flask(__name__)
+    app.config["SECRET_KEY"] = "change-this-secret-key"
+    app.config["DB_POOL_SIZE"] = 4
+    app.config["DB_READ_POOL_SIZE"] = 8
+    if config:
+        app.config.update(config)
+    init_migrations(app)
+    init_db_pool(app)
+    init_metrics(app)
+    init_slow_queries(app)
+    init_cache(app)
+    init_availability(app)
+    init_passwords(app)
+    init_principals(app)
+    init_streaming(app)
+    init_writer(app)
+    init_reference(app)
+    login_manager.init_app(app)
+
+    init_auth_routes(app)
+    init_admin_routes(app)
+    init_doctor_routes(app)
+    init_patient_routes(app)
+    return app
+
+
 class UserMixinWrapper:
     def __init__(self):
         self.is_authenticated = True
@@ -40,111 +84,122 @@ class User(UserMixinWrapper):
 
 @login_manager.user_loader
 def load_user(user_id):
-    conn = get_db()
-    cur = conn.cursor()
-    cur.execute("SELECT * FROM users WHERE id = ?", (user_id,))
-    row = cur.fetchone()
-    conn.close()
-    if row:
-        return User(row)
+    identity = load_identity(user_id)
+    if identity:
+        return User(identity["user"])
     return None
 
 
-
-@app.route("/")
-def index():
-    if current_user.is_authenticated:
-        if current_user.role == "admin":
-            return redirect(url_for("admin_dashboard"))
-        elif current_user.role == "doctor":
-            return redirect(url_for("doctor_dashboard"))
-        else:
-            return redirect(url_for("patient_dashboard"))
-    return redirect(url_for("login"))
-
-
-# Auth routes 
-
-
-@app.route("/login", methods=["GET", "POST"])
-def login():
-    if request.method == "POST":
-        email = request.form.get("email", "").strip()
-        password = request.form.get("password", "")
-
-        conn = get_db()
-        cur = conn.cursor()
-        cur.execute("SELECT * FROM users WHERE email = ?", (email,))
-        row = cur.fetchone()
-        conn.close()
-
-        if row and check_password_hash(row["password_hash"], password):
-            if row["status"] != "active":
-                flash("Your account is not active. Please contact hospital staff.", "warning")
-                return redirect(url_for("login"))
-            user = User(row)
-            login_user(user)
-            return redirect(url_for("index"))
-        else:
-            flash("Invalid email or password.", "danger")
-
-    return render_template("login.html")
-
-
-@app.route("/logout")
-def logout():
-    logout_user()
-    return redirect(url_for("login"))
-
-
-@app.route("/register", methods=["GET", "POST"])
-def register():
-
-    if request.method == "POST":
-        email = request.form.get("email", "").strip()
-        password = request.form.get("password", "")
-        name = request.form.get("name", "").strip()
-
-        if not email or not password or not name:
-            flash("Please fill all required fields.", "danger")
-            return redirect(url_for("register"))
-
-        conn = get_db()
-        cur = conn.cursor()
-
-        cur.execute("SELECT id FROM users WHERE email = ?", (email,))
-        if cur.fetchone():
-            flash("Email already registered.", "warning")
-            conn.close()
-            return redirect(url_for("register"))
-
-        password_hash = generate_password_hash(password)
-        cur.execute(
-            "INSERT INTO users (email, password_hash, role, status) "
-            "VALUES (?, ?, 'patient', 'active')",
-            (email, password_hash),
-        )
-        user_id = cur.lastrowid
-
-        cur.execute(
-            "INSERT INTO patient_profiles (user_id, name) VALUES (?, ?)",
-            (user_id, name),
-        )
-
-        conn.commit()
-        conn.close()
-
-        flash("Registration successful. Please log in.", "success")
+def init_auth_routes(app):
+    @app.route("/")
+    def index():
+        if current_user.is_authenticated:
+            if current_user.role == "admin":
+                return redirect(url_for("admin_dashboard"))
+            elif current_user.role == "doctor":
+                return redirect(url_for("doctor_dashboard"))
+            else:
+                return redirect(url_for("patient_dashboard"))
         return redirect(url_for("login"))
 
-    return render_template("register.html")
+    # Auth routes
+
+    @app.route("/login", methods=["GET", "POST"])
+    def login():
+        if request.method == "POST":
+            email = request.form.get("email", "").strip()
+            password = request.form.get("password", "")
+
+            conn = get_db()
+            cur = conn.cursor()
+            cur.execute("SELECT * FROM users WHERE email = ?", (email,))
+            row = cur.fetchone()
+
+            try:
+                valid = row is not None and verify_password(row["password_hash"], password)
+            except HashingBusy:
+                conn.close()
+                flash("The server is busy. Please try logging in again in a moment.", "warning")
+                return render_template("login.html"), 503
+
+            if valid:
+                if row["status"] != "active":
+                    conn.close()
+                    flash("Your account is not active. Please contact hospital staff.", "warning")
+                    return redirect(url_for("login"))
+                if needs_rehash(row["password_hash"]):
+                    # Work factor changed since this hash was made: upgrade it now
+                    # that we have the plain password. Skipped if the queue is full.
+                    try:
+                        cur.execute(
+                            "UPDATE users SET password_hash = ? WHERE id = ? AND password_hash = ?",
+                            (hash_password(password), row["id"], row["password_hash"]),
+                        )
+                        conn.commit()
+                    except HashingBusy:
+                        pass
+                conn.close()
+                user = User(row)
+                login_user(user)
+                return redirect(url_for("index"))
+            else:
+                conn.close()
+                flash("Invalid email or password.", "danger")
+
+        return render_template("login.html")
+
+    @app.route("/logout")
+    def logout():
+        logout_user()
+        return redirect(url_for("login"))
 
+    @app.route("/register", methods=["GET", "POST"])
+    def register():
+
+        if request.method == "POST":
+            email = request.form.get("email", "").strip()
+            password = request.form.get("password", "")
+            name = request.form.get("name", "").strip()
+
+            if not email or not password or not name:
+                flash("Please fill all required fields.", "danger")
+                return redirect(url_for("register"))
+
+            conn = get_db()
+            cur = conn.cursor()
+
+            cur.execute("SELECT id FROM users WHERE email = ?", (email,))
+            if cur.fetchone():
+                flash("Email already registered.", "warning")
+                conn.close()
+                return redirect(url_for("register"))
+
+            try:
+                password_hash = hash_password(password)
+            except HashingBusy:
+                conn.close()
+                flash("The server is busy. Please try again in a moment.", "warning")
+                return redirect(url_for("register"))
+            cur.execute(
+                "INSERT INTO users (email, password_hash, role, status) "
+                "VALUES (?, ?, 'patient', 'active')",
+                (email, password_hash),
+            )
+            user_id = cur.lastrowid
+
+            cur.execute(
+                "INSERT INTO patient_profiles (user_id, name) VALUES (?, ?)",
+                (user_id, name),
+            )
+
+            conn.commit()
+            conn.close()
 
+            flash("Registration successful. Please log in.", "success")
+            return redirect(url_for("login"))
 
-init_admin_routes(app)
-init_doctor_routes(app)
-init_patient_routes(app)
+        return render_template("register.html")
 
 
 if __name__ == "__main__":
-    app.run(debug=True)
+    create_app().run(debug=True)
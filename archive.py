@@ -0,0 +1,272 @@
+# archive.py
+"""
+Hot/cold archival of old appointments.
+
+Completed and Cancelled appointments older than N months move, with their
+treatments, from hms.db into an archive database next to it
+(hms_archive.db). The archive is ATTACHed as "archive" only when needed:
+by the archival job, and by views that ask for deep history. Everything
+else reads the hot tables only, which keeps them and their indexes small.
+
+Each batch runs as two transactions. The first copies the rows into the
+archive and commits; the second deletes from the hot tables only the rows
+whose archived copy is in place. (In WAL mode SQLite does not commit attached
+databases atomically together, so a single transaction could lose rows if
+it crashed between the two files.) A crash between the steps leaves rows in
+both files: the copy uses INSERT OR REPLACE, so the next run finishes the
+move, and deep-history reads skip archive rows whose id is still hot.
+
+Dashboard totals keep counting archived appointments: each batch adds its
+rows to the "archived_*" counters in stat_counters.
+
+Usage:
+    python archive.py run [months] [batch_size]   # archive old appointments
+    python archive.py stats                       # hot vs archived row counts
+"""
+import os
+import sys
+from datetime import date
+
+import db
+
+DEFAULT_MONTHS = 12
+DEFAULT_BATCH_SIZE = 1000
+ARCHIVED_STATUSES = ("Completed", "Cancelled")
+
+_APPOINTMENT_COLUMNS = "id, patient_id, doctor_id, department_id, date, time, status, created_at"
+_TREATMENT_COLUMNS = "id, appointment_id, diagnosis, prescription, notes"
+
+_ARCHIVE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS archive.appointments (
+    id INTEGER PRIMARY KEY,
+    patient_id INTEGER NOT NULL,
+    doctor_id INTEGER NOT NULL,
+    department_id INTEGER,
+    date TEXT NOT NULL,
+    time TEXT NOT NULL,
+    status TEXT NOT NULL,
+    created_at TEXT NOT NULL,
+    archived_at TEXT NOT NULL DEFAULT (datetime('now'))
+);
+CREATE INDEX IF NOT EXISTS archive.idx_archive_appointments_patient_date_time
+    ON appointments (patient_id, date, time);
+CREATE INDEX IF NOT EXISTS archive.idx_archive_appointments_doctor_date_time
+    ON appointments (doctor_id, date, time);
+CREATE INDEX IF NOT EXISTS archive.idx_archive_appointments_date_time
+    ON appointments (date, time);
+CREATE TABLE IF NOT EXISTS archive.treatments (
+    id INTEGER PRIMARY KEY,
+    appointment_id INTEGER NOT NULL UNIQUE,
+    diagnosis TEXT,
+    prescription TEXT,
+    notes TEXT
+);
+"""
+
+# Appointments with their treatment columns, for history queries. The deep
+# version adds archived rows that aren't (any longer) in the hot table.
+HOT_HISTORY = """(
+    SELECT a.*, t.diagnosis, t.prescription, t.notes
+    FROM main.appointments a
+    LEFT JOIN main.treatments t ON t.appointment_id = a.id
+)"""
+DEEP_HISTORY = f"""(
+    SELECT a.*, t.diagnosis, t.prescription, t.notes
+    FROM main.appointments a
+    LEFT JOIN main.treatments t ON t.appointment_id = a.id
+    UNION ALL
+    SELECT {", ".join("aa." + c for c in _APPOINTMENT_COLUMNS.split(", "))},
+           atr.diagnosis, atr.prescription, atr.notes
+    FROM archive.appointments aa
+    LEFT JOIN archive.treatments atr ON atr.appointment_id = aa.id
+    WHERE NOT EXISTS (SELECT 1 FROM main.appointments m WHERE m.id = aa.id)
+)"""
+
+
+def archive_path():
+    root, _ = os.path.splitext(db.DB_PATH)
+    return root + "_archive.db"
+
+
+def is_attached(conn):
+    return any(row[1] == "archive" for row in conn.execute("PRAGMA database_list").fetchall())
+
+
+def attach(conn, create=False):
+    """
+    ATTACH the archive as "archive" if it isn't already. Returns False when
+    there is no archive yet (and `create` is False) or the connection is in
+    the middle of a transaction, where ATTACH isn't allowed.
+    """
+    if is_attached(conn):
+        return True
+    path = archive_path()
+    if not create and not os.path.exists(path):
+        return False
+    if conn.in_transaction:
+        return False
+    conn.execute("ATTACH DATABASE ? AS archive", (path,))
+    if create:
+        conn.executescript(_ARCHIVE_SCHEMA)
+    return True
+
+
+def history_source(conn, deep):
+    """
+    Table expression of appointments joined with their treatment columns
+    (diagnosis, prescription, notes): hot rows only, or hot plus archived
+    rows when `deep` is set and an archive exists.
+    """
+    if deep and attach(conn):
+        return DEEP_HISTORY
+    return HOT_HISTORY
+
+
+def cutoff_date(months, today=None):
+    """The date `months` months before `today` (day clamped to 28)."""
+    today = today or date.today()
+    month_index = today.year * 12 + (today.month - 1) - months
+    return date(month_index // 12, month_index % 12 + 1, min(today.day, 28))
+
+
+def _add_archived_counts(cur):
+    """Move this batch's rows into the archived_* dashboard counters."""
+    cur.execute(
+        """
+        SELECT status, COALESCE(CAST(department_id AS TEXT), '') AS dept, COUNT(*) AS c
+        FROM main.appointments
+        WHERE id IN (SELECT id FROM temp.archive_batch)
+        GROUP BY status, department_id
+        """
+    )
+    deltas = {}
+    for row in cur.fetchall():
+        for scope_key in (
+            ("archived_total", "appointments"),
+            ("archived_status", row["status"]),
+            ("archived_department", row["dept"]),
+        ):
+            deltas[scope_key] = deltas.get(scope_key, 0) + row["c"]
+    cur.executemany(
+        """
+        INSERT INTO stat_counters (scope, key, value) VALUES (?, ?, ?)
+        ON CONFLICT (scope, key) DO UPDATE SET value = value + excluded.value
+        """,
+        [(scope, key, value) for (scope, key), value in deltas.items()],
+    )
+
+
+def archive_batch(conn, cutoff, batch_size=DEFAULT_BATCH_SIZE):
+    """Move one batch older than `cutoff` (ISO date). Returns rows moved."""
+    cur = conn.cursor()
+
+    # 1) Copy into the archive.
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        cur.execute("DELETE FROM temp.archive_batch")
+        cur.execute(
+            """
+            INSERT INTO temp.archive_batch (id)
+            SELECT id FROM main.appointments
+            WHERE status IN (?, ?) AND date < ?
+            LIMIT ?
+            """,
+            (*ARCHIVED_STATUSES, cutoff, batch_size),
+        )
+        if cur.rowcount <= 0:
+            conn.rollback()
+            return 0
+        cur.execute(
+            f"""
+            INSERT OR REPLACE INTO archive.appointments ({_APPOINTMENT_COLUMNS})
+            SELECT {_APPOINTMENT_COLUMNS} FROM main.appointments
+            WHERE id IN (SELECT id FROM temp.archive_batch)
+            """
+        )
+        cur.execute(
+            f"""
+            INSERT OR REPLACE INTO archive.treatments ({_TREATMENT_COLUMNS})
+            SELECT {_TREATMENT_COLUMNS} FROM main.treatments
+            WHERE appointment_id IN (SELECT id FROM temp.archive_batch)
+            """
+        )
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+
+    # 2) Drop from the hot tables what made it into the archive unchanged.
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        cur.execute(
+            """
+            DELETE FROM temp.archive_batch
+            WHERE id NOT IN (
+                SELECT m.id FROM main.appointments m
+                JOIN archive.appointments aa ON aa.id = m.id AND aa.status = m.status
+                WHERE m.id IN (SELECT id FROM temp.archive_batch)
+            )
+            """
+        )
+        _add_archived_counts(cur)
+        cur.execute(
+            "DELETE FROM main.treatments WHERE appointment_id IN (SELECT id FROM temp.archive_batch)"
+        )
+        cur.execute(
+            "DELETE FROM main.appointments WHERE id IN (SELECT id FROM temp.archive_batch)"
+        )
+        moved = cur.rowcount
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    return moved
+
+
+def archive_old(conn, months=DEFAULT_MONTHS, batch_size=DEFAULT_BATCH_SIZE, today=None):
+    """Archive everything eligible in batches. Returns (cutoff, rows moved)."""
+    cutoff = cutoff_date(months, today).isoformat()
+    attach(conn, create=True)
+    conn.execute("CREATE TEMP TABLE IF NOT EXISTS archive_batch (id INTEGER PRIMARY KEY)")
+    total = 0
+    while True:
+        moved = archive_batch(conn, cutoff, batch_size)
+        if not moved:
+            break
+        total += moved
+    return cutoff, total
+
+
+def table_counts(conn):
+    counts = {}
+    for table in ("appointments", "treatments"):
+        counts[("hot", table)] = conn.execute(f"SELECT COUNT(*) FROM main.{table}").fetchone()[0]
+    if attach(conn):
+        for table in ("appointments", "treatments"):
+            counts[("archive", table)] = conn.execute(
+                f"SELECT COUNT(*) FROM archive.{table}"
+            ).fetchone()[0]
+    return counts
+
+
+def main(argv):
+    command = argv[1] if len(argv) > 1 else ""
+    conn = db.get_db()
+    if command == "run":
+        months = int(argv[2]) if len(argv) > 2 else DEFAULT_MONTHS
+        batch_size = int(argv[3]) if len(argv) > 3 else DEFAULT_BATCH_SIZE
+        cutoff, moved = archive_old(conn, months, batch_size)
+        print(f"[Archive] Moved {moved} appointments dated before {cutoff} to {archive_path()}.")
+    elif command == "stats":
+        for (where, table), count in table_counts(conn).items():
+            print(f"[Archive] {where:7} {table:12} {count}")
+    else:
+        print(__doc__)
+        conn.close()
+        return 2
+    conn.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
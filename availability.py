@@ -0,0 +1,393 @@
+# availability.py
+"""
+In-memory slot availability engine.
+
+For every (doctor, day) in a rolling window the engine keeps two bitmaps
+with one bit per minute of the day: the slots the doctor has opened and the
+slots that are booked. Free slots are `opened & ~booked`, so "free slots for
+doctor X this week" is a handful of integer operations instead of a
+LEFT JOIN between doctor_availability and appointments.
+
+The database stays authoritative: routes update the engine after they
+commit, and anything the engine cannot answer (dates outside the window,
+odd time formats) returns None so the caller falls back to SQL. Writes made
+outside this process (other workers, scripts) are picked up by re-warming
+every `refresh_seconds`. The re-warm runs on a background thread while
+requests keep answering from the current window, and is skipped when
+nothing has committed since the last one (PRAGMA data_version, via the
+generation probe in cache.py).
+
+Usage:
+    python availability.py check   # compare the engine with the tables
+"""
+import sys
+import threading
+import time
+from datetime import date, timedelta
+
+from flask import current_app
+
+import db
+from db import get_db
+
+DEFAULT_WINDOW_DAYS = 14
+DEFAULT_REFRESH_SECONDS = 60
+
+# No generation rows (see cache.py), so these stamp with data_version.
+TABLES = ("doctor_availability", "appointments")
+
+# Free slots straight from the tables; the fallback when the engine can't answer.
+FREE_SLOTS_SQL = """
+    SELECT da.date, da.time
+    FROM doctor_availability da
+    WHERE da.doctor_id = ?
+      AND da.date >= ?
+      AND da.date <= ?
+      AND da.is_available = 1
+      AND NOT EXISTS (
+          SELECT 1 FROM appointments a
+          WHERE a.doctor_id = da.doctor_id
+            AND a.date = da.date
+            AND a.time = da.time
+            AND a.status = 'Booked'
+      )
+    ORDER BY da.date, da.time
+"""
+
+
+def _minute(time_str):
+    """'HH:MM' -> minute of the day, or None for anything else."""
+    if len(time_str) != 5 or time_str[2] != ":":
+        return None
+    try:
+        hours, minutes = int(time_str[:2]), int(time_str[3:])
+    except ValueError:
+        return None
+    if 0 <= hours < 24 and 0 <= minutes < 60:
+        return hours * 60 + minutes
+    return None
+
+
+def _times(bits):
+    """Set bits of a day bitmap -> sorted 'HH:MM' strings."""
+    times = []
+    while bits:
+        low = bits & -bits
+        minute = low.bit_length() - 1
+        times.append(f"{minute // 60:02d}:{minute % 60:02d}")
+        bits ^= low
+    return times
+
+
+class AvailabilityEngine:
+    def __init__(
+        self,
+        window_days=DEFAULT_WINDOW_DAYS,
+        refresh_seconds=DEFAULT_REFRESH_SECONDS,
+        path=None,
+        probe=None,
+    ):
+        self.window_days = window_days
+        self.refresh_seconds = refresh_seconds
+        self.path = path  # database the background refresh reads
+        self.probe = probe
+        self.warmed_at = 0.0
+        self.stamp = None
+        self._lock = threading.Lock()
+        self._days = {}  # doctor_id -> {date_str: [opened_bits, booked_bits]}
+        self._irregular = set()  # (doctor_id, date_str) the bitmaps can't represent
+        self._refreshing = False  # a background refresh is running
+        self._loading = False  # a warm is reading the tables
+        self._pending = []  # updates made meanwhile
+        self.start = None
+        self.end = None
+        self.refreshes = 0
+        self.skipped_refreshes = 0
+
+    # -- loading -----------------------------------------------------------
+
+    def _window(self, today=None):
+        today = today or date.today()
+        return today.isoformat(), (today + timedelta(days=self.window_days)).isoformat()
+
+    def _load(self, conn, start, end, doctor_id=None):
+        days = {}
+        irregular = set()
+        one_doctor = "WHERE dp.id = ?" if doctor_id is not None else ""
+        params = (start, end) if doctor_id is None else (start, end, doctor_id)
+
+        def day(doctor_id, date_str):
+            return days.setdefault(doctor_id, {}).setdefault(date_str, [0, 0])
+
+        cur = conn.cursor()
+        # CROSS JOIN drives from doctor_profiles so each doctor's range comes off
+        # the unique (doctor_id, date, time) slot index. A date-only index is no
+        # faster for this (about 0.2s for 80k slots either way) and costs half
+        # as much again on every bulk materialize (schema.sql).
+        cur.execute(
+            """
+            SELECT da.doctor_id, da.date, da.time
+            FROM doctor_profiles dp
+            CROSS JOIN doctor_availability da
+              ON da.doctor_id = dp.id
+             AND da.date >= ?
+             AND da.date <= ?
+             AND da.is_available = 1
+            {one_doctor}
+            """.format(one_doctor=one_doctor),
+            params,
+        )
+        for row in cur.fetchall():
+            minute = _minute(row["time"])
+            if minute is None:
+                irregular.add((row["doctor_id"], row["date"]))
+            else:
+                day(row["doctor_id"], row["date"])[0] |= 1 << minute
+
+        cur.execute(
+            """
+            SELECT doctor_id, date, time
+            FROM appointments
+            WHERE date >= ? AND date <= ? AND {booked}
+            """.format(
+                # For one doctor, '+' keeps the planner on (doctor_id, date, time).
+                booked="status = 'Booked'" if doctor_id is None
+                else "+status = 'Booked' AND doctor_id = ?"
+            ),
+            params,
+        )
+        for row in cur.fetchall():
+            minute = _minute(row["time"])
+            if minute is None:
+                irregular.add((row["doctor_id"], row["date"]))
+            else:
+                day(row["doctor_id"], row["date"])[1] |= 1 << minute
+
+        return days, irregular
+
+    def warm(self, conn, today=None):
+        """(Re)load the whole window from the database."""
+        start, end = self._window(today)
+        stamp = self.probe.stamp(TABLES) if self.probe else None
+        with self._lock:
+            self._loading = True
+            self._pending = []
+        try:
+            days, irregular = self._load(conn, start, end)
+        except BaseException:
+            with self._lock:
+                self._loading = False
+                self._pending = []
+            raise
+        with self._lock:
+            # Updates made while loading may not be in what was read; they'd
+            # be lost with the old bitmaps, so apply them to the new ones.
+            for doctor_id, date_str, minute, index, value in self._pending:
+                if start <= date_str <= end:
+                    self._set(days, irregular, doctor_id, date_str, minute, index, value)
+            self._loading = False
+            self._pending = []
+            self._days = days
+            self._irregular = irregular
+            self.start, self.end = start, end
+            self.stamp = stamp
+            self.warmed_at = time.monotonic()
+
+    def warm_doctor(self, conn, doctor_id):
+        """Reload one doctor's part of the window, e.g. after a bulk write for them."""
+        with self._lock:
+            start, end = self.start, self.end
+        if start is None:
+            return
+        days, irregular = self._load(conn, start, end, doctor_id)
+        with self._lock:
+            if (self.start, self.end) != (start, end):
+                return  # a full warm moved the window meanwhile
+            self._days[doctor_id] = days.get(doctor_id, {})
+            self._irregular = {k for k in self._irregular if k[0] != doctor_id} | irregular
+
+    def _stale(self):
+        return (
+            self.start != date.today().isoformat()
+            or time.monotonic() - self.warmed_at > self.refresh_seconds
+        )
+
+    def refresh(self):
+        """
+        Start a background re-warm unless one is running. Requests keep
+        answering from the current window until it's swapped in.
+        """
+        with self._lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+        threading.Thread(target=self._refresh, name="availability-refresh", daemon=True).start()
+
+    def _refresh(self):
+        try:
+            if (
+                self.probe is not None
+                and self.start == date.today().isoformat()
+                and self.probe.stamp(TABLES) == self.stamp
+            ):
+                # Nothing committed since the last warm.
+                self.warmed_at = time.monotonic()
+                self.skipped_refreshes += 1
+                return
+            conn = db._connect(self.path, ("PRAGMA query_only = ON;",))
+            try:
+                self.warm(conn)
+            finally:
+                conn.close()
+            self.refreshes += 1
+        finally:
+            with self._lock:
+                self._refreshing = False
+
+    # -- queries -----------------------------------------------------------
+
+    def free_slots(self, conn, doctor_id, start, end):
+        """
+        Free slots for `doctor_id` between `start` and `end` (inclusive ISO
+        dates) as [{"date": ..., "time": ...}], or None if the engine can't
+        answer and the caller should ask the database.
+        """
+        if self._stale():
+            self.refresh()
+        with self._lock:
+            if self.start is None or start < self.start or end > self.end:
+                return None
+            slots = []
+            doctor_days = self._days.get(doctor_id, {})
+            for date_str in sorted(doctor_days):
+                if date_str < start or date_str > end:
+                    continue
+                opened, booked = doctor_days[date_str]
+                for time_str in _times(opened & ~booked):
+                    slots.append({"date": date_str, "time": time_str})
+            if any(d == doctor_id and start <= day <= end for d, day in self._irregular):
+                return None
+            return slots
+
+    # -- updates (call after the write has committed) ----------------------
+
+    @staticmethod
+    def _set(days, irregular, doctor_id, date_str, minute, index, value):
+        if minute is None:
+            irregular.add((doctor_id, date_str))
+            return
+        bits = days.setdefault(doctor_id, {}).setdefault(date_str, [0, 0])
+        if value:
+            bits[index] |= 1 << minute
+        else:
+            bits[index] &= ~(1 << minute)
+
+    def _update(self, doctor_id, date_str, time_str, index, value):
+        minute = _minute(time_str)
+        with self._lock:
+            if self._loading:
+                self._pending.append((doctor_id, date_str, minute, index, value))
+            if self.start is None or not (self.start <= date_str <= self.end):
+                return
+            self._set(self._days, self._irregular, doctor_id, date_str, minute, index, value)
+
+    def add_slot(self, doctor_id, date_str, time_str):
+        self._update(doctor_id, date_str, time_str, 0, True)
+
+    def book(self, doctor_id, date_str, time_str):
+        self._update(doctor_id, date_str, time_str, 1, True)
+
+    def release(self, doctor_id, date_str, time_str):
+        self._update(doctor_id, date_str, time_str, 1, False)
+
+    # -- consistency -------------------------------------------------------
+
+    def check(self, conn):
+        """
+        Compare the engine with the tables over its window.
+        Returns a list of (doctor_id, date, field, engine_times, db_times).
+        """
+        with self._lock:
+            start, end = self.start, self.end
+            snapshot = {
+                doctor_id: {day: list(bits) for day, bits in doctor_days.items()}
+                for doctor_id, doctor_days in self._days.items()
+            }
+        if start is None:
+            return []
+        expected, _ = self._load(conn, start, end)
+
+        mismatches = []
+        for doctor_id in sorted(set(snapshot) | set(expected)):
+            have_days = snapshot.get(doctor_id, {})
+            want_days = expected.get(doctor_id, {})
+            for day in sorted(set(have_days) | set(want_days)):
+                have = have_days.get(day, [0, 0])
+                want = want_days.get(day, [0, 0])
+                for index, field in enumerate(("opened", "booked")):
+                    if have[index] != want[index]:
+                        mismatches.append(
+                            (doctor_id, day, field, _times(have[index]), _times(want[index]))
+                        )
+        return mismatches
+
+
+def init_app(app):
+    """Attach an engine to the app and warm it from the database."""
+    app.config.setdefault("AVAILABILITY_WINDOW_DAYS", DEFAULT_WINDOW_DAYS)
+    app.config.setdefault("AVAILABILITY_REFRESH_SECONDS", DEFAULT_REFRESH_SECONDS)
+    engine = AvailabilityEngine(
+        app.config["AVAILABILITY_WINDOW_DAYS"],
+        app.config["AVAILABILITY_REFRESH_SECONDS"],
+        db.DB_PATH,
+        app.extensions.get("generations"),
+    )
+    conn = get_db()
+    engine.warm(conn)
+    conn.close()
+    app.extensions["availability"] = engine
+
+
+def get_engine():
+    return current_app.extensions["availability"]
+
+
+def main(argv):
+    command = argv[1] if len(argv) > 1 else "check"
+    if command != "check":
+        print(__doc__)
+        return 2
+
+    conn = get_db()
+    engine = AvailabilityEngine()
+    engine.warm(conn)
+
+    # Answer every doctor's next 7 days from the engine and from SQL.
+    today = date.today()
+    start, end = today.isoformat(), (today + timedelta(days=7)).isoformat()
+    cur = conn.cursor()
+    cur.execute("SELECT id FROM doctor_profiles")
+    failures = 0
+    for (doctor_id,) in cur.fetchall():
+        from_engine = engine.free_slots(conn, doctor_id, start, end)
+        if from_engine is None:
+            continue
+        cur.execute(FREE_SLOTS_SQL, (doctor_id, start, end))
+        from_db = [{"date": row["date"], "time": row["time"]} for row in cur.fetchall()]
+        if from_engine != from_db:
+            failures += 1
+            print(f"[Availability] Doctor {doctor_id}: engine={from_engine} db={from_db}")
+
+    mismatches = engine.check(conn)
+    for doctor_id, day, field, have, want in mismatches:
+        print(f"[Availability] Doctor {doctor_id} {day} {field}: engine={have} db={want}")
+    conn.close()
+
+    if failures or mismatches:
+        return 1
+    print("[Availability] Engine matches the database.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,356 @@
+# bench_routes.py
+"""
+Route benchmark harness.
+
+Logs in as admin, doctor and patient through the Flask test client and
+times the main pages against a generated dataset. For every route it
+reports p50/p95/p99 latency, SQL statements per request and peak Python
+memory (tracemalloc) while serving it. Results can be saved as JSON and
+compared with a saved baseline.
+
+The doctor and patient are the busiest active synthetic users, so their
+pages carry realistic amounts of history; without synthetic data the demo
+logins are used.
+
+Usage:
+    python bench_routes.py [--db PATH | --scale N] [--requests N]
+                           [--out results.json] [--baseline baseline.json]
+                           [--threshold 0.2]
+    python bench_routes.py [--db PATH | --scale N] --threads 1,2,4,8 [--seconds 5]
+
+Without --db a scratch database is generated at --scale (default 1). With
+--baseline the exit status is 1 if any route's p95 grew by more than the
+threshold (a fraction: 0.2 = 20%) or it runs more queries per request than before.
+
+With --threads it instead measures read throughput: that many threads fetch
+the patient pages in a loop while another thread keeps committing small
+writes, once with every request on the writer pool and once with GET
+requests on the query_only reader pool.
+"""
+import argparse
+import json
+import os
+import platform
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from datetime import datetime
+
+import db
+
+DEMO_LOGINS = {
+    "admin": ("admin@hospital.com", "admin123"),
+    "doctor": ("dr.cardiac@hospital.com", "doctor123"),
+    "patient": ("john.doe@example.com", "patient123"),
+}
+SYNTHETIC_PASSWORD = "password123"
+MEMORY_SAMPLES = 3
+
+# Pages fetched by the read throughput threads.
+READ_ROUTES = ("patient_dashboard", "patient_doctor_availability", "patient_appointments")
+
+# (name, role, url template); {doctor_id} is the benchmarked doctor's profile id.
+ROUTES = (
+    ("patient_dashboard", "patient", "/patient/dashboard"),
+    ("patient_doctor_availability", "patient", "/patient/doctors/{doctor_id}/availability"),
+    ("patient_appointments", "patient", "/patient/appointments"),
+    ("patient_doctors_search", "patient", "/patient/doctors?q=cardio"),
+    ("doctor_dashboard", "doctor", "/doctor/dashboard"),
+    ("admin_dashboard", "admin", "/admin/dashboard"),
+    ("admin_doctors", "admin", "/admin/doctors"),
+    ("admin_patients", "admin", "/admin/patients"),
+    ("admin_appointments", "admin", "/admin/appointments"),
+)
+
+
+def _percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, -(-len(sorted_values) * pct // 100))
+    return sorted_values[int(rank) - 1]
+
+
+def pick_logins(path):
+    """
+    Busiest active synthetic doctor and patient, falling back to the demo
+    users. Returns ({role: (email, password)}, doctor profile id).
+    """
+    conn = sqlite3.connect(path)
+    conn.row_factory = sqlite3.Row
+    logins = dict(DEMO_LOGINS)
+    row = conn.execute(
+        """
+        SELECT u.email, d.id
+        FROM users u JOIN doctor_profiles d ON d.user_id = u.id
+        WHERE u.email LIKE 'doctor%@synthetic.hms' AND u.status = 'active'
+        ORDER BY u.id LIMIT 1
+        """
+    ).fetchone()
+    if row:
+        logins["doctor"] = (row["email"], SYNTHETIC_PASSWORD)
+        doctor_id = row["id"]
+    else:
+        doctor_id = conn.execute(
+            """
+            SELECT d.id FROM doctor_profiles d JOIN users u ON u.id = d.user_id
+            WHERE u.email = ?
+            """,
+            (DEMO_LOGINS["doctor"][0],),
+        ).fetchone()["id"]
+    # Patient ids are skewed towards the start, so the first one is the busiest.
+    row = conn.execute(
+        """
+        SELECT email FROM users
+        WHERE email LIKE 'patient%@synthetic.hms' AND status = 'active'
+        ORDER BY id LIMIT 1
+        """
+    ).fetchone()
+    if row:
+        logins["patient"] = (row["email"], SYNTHETIC_PASSWORD)
+    conn.close()
+    return logins, doctor_id
+
+
+def run(path, requests=50, warmup=3):
+    """Benchmark every route in ROUTES against the database at `path`."""
+    db.DB_PATH = path
+    from app import create_app
+
+    app = create_app({"TESTING": True, "MIGRATE_ONLINE_IN_BACKGROUND": False})
+    logins, doctor_id = pick_logins(path)
+
+    statements = [0]
+
+    def trace(sql):
+        # 'main'.<shadow table> statements are SQLite's own FTS bookkeeping.
+        if "'main'." not in sql:
+            statements[0] += 1
+
+    def install(conn):
+        conn.set_trace_callback(trace)
+
+    db.close_pools(app)
+    db.connect_hooks.append(install)
+    results = {}
+    try:
+        clients = {}
+        for role, (email, password) in logins.items():
+            client = app.test_client()
+            response = client.post("/login", data={"email": email, "password": password})
+            if response.status_code != 302:
+                raise RuntimeError(f"login failed for {email}")
+            clients[role] = client
+
+        for name, role, template in ROUTES:
+            url = template.format(doctor_id=doctor_id)
+            client = clients[role]
+            # buffered=True reads streamed pages to the end and closes them,
+            # so they're timed in full.
+            for _ in range(warmup):
+                client.get(url, buffered=True)
+
+            timings = []
+            statements[0] = 0
+            for _ in range(requests):
+                started = time.perf_counter()
+                response = client.get(url, buffered=True)
+                timings.append((time.perf_counter() - started) * 1000)
+                if response.status_code != 200:
+                    raise RuntimeError(f"{url} returned {response.status_code}")
+            queries = statements[0] / requests
+
+            # Memory in a separate pass; tracemalloc slows everything down.
+            tracemalloc.start()
+            peak = 0
+            for _ in range(MEMORY_SAMPLES):
+                tracemalloc.reset_peak()
+                client.get(url, buffered=True)
+                peak = max(peak, tracemalloc.get_traced_memory()[1])
+            tracemalloc.stop()
+
+            timings.sort()
+            results[name] = {
+                "url": url,
+                "requests": requests,
+                "p50_ms": round(_percentile(timings, 50), 3),
+                "p95_ms": round(_percentile(timings, 95), 3),
+                "p99_ms": round(_percentile(timings, 99), 3),
+                "mean_ms": round(sum(timings) / len(timings), 3),
+                "queries": round(queries, 2),
+                "peak_kib": round(peak / 1024, 1),
+            }
+    finally:
+        db.connect_hooks.remove(install)
+        db.close_pools(app)
+    return results
+
+
+def _write_load(path, stop, counter):
+    """Flip appointment statuses in small committed transactions until `stop` is set."""
+    conn = db._connect(path)
+    ids = [row[0] for row in conn.execute("SELECT id FROM appointments ORDER BY id LIMIT 500")]
+    i = 0
+    while not stop.is_set():
+        appointment_id = ids[i % len(ids)]
+        conn.execute(
+            """
+            UPDATE appointments
+            SET status = CASE status WHEN 'Cancelled' THEN 'Booked' ELSE 'Cancelled' END
+            WHERE id = ? AND status != 'Completed'
+            """,
+            (appointment_id,),
+        )
+        conn.commit()
+        counter[0] += 1
+        i += 1
+        time.sleep(0.001)
+    conn.close()
+
+
+def throughput(path, thread_counts=(1, 2, 4, 8), seconds=5.0):
+    """
+    Read requests per second for each thread count, with and without the
+    reader pool, while writes are committed in the background.
+    Returns {(mode, threads): (reads/s, writes/s)}.
+    """
+    db.DB_PATH = path
+    from app import create_app
+
+    app = create_app({"TESTING": True, "MIGRATE_ONLINE_IN_BACKGROUND": False})
+    logins, doctor_id = pick_logins(path)
+    email, password = logins["patient"]
+    templates = dict((name, template) for name, _, template in ROUTES)
+    urls = [templates[name].format(doctor_id=doctor_id) for name in READ_ROUTES]
+    readers = app.extensions.pop("db_read_pool", None)
+    if readers is None:
+        raise RuntimeError("DB_READ_POOL_SIZE is 0: no reader pool to compare against")
+
+    results = {}
+    try:
+        for mode in ("writer pool", "reader pool"):
+            if mode == "reader pool":
+                app.extensions["db_read_pool"] = readers
+            for threads in thread_counts:
+                clients = []
+                for _ in range(threads):
+                    client = app.test_client()
+                    client.post("/login", data={"email": email, "password": password})
+                    clients.append(client)
+
+                stop = threading.Event()
+                reads = [0] * threads
+                writes = [0]
+
+                def read_loop(index):
+                    client = clients[index]
+                    while not stop.is_set():
+                        response = client.get(urls[reads[index] % len(urls)], buffered=True)
+                        if response.status_code != 200:
+                            raise RuntimeError(f"read returned {response.status_code}")
+                        reads[index] += 1
+
+                workers = [threading.Thread(target=read_loop, args=(i,)) for i in range(threads)]
+                workers.append(threading.Thread(target=_write_load, args=(path, stop, writes)))
+                started = time.perf_counter()
+                for worker in workers:
+                    worker.start()
+                time.sleep(seconds)
+                stop.set()
+                for worker in workers:
+                    worker.join()
+                elapsed = time.perf_counter() - started
+                results[(mode, threads)] = (sum(reads) / elapsed, writes[0] / elapsed)
+    finally:
+        app.extensions["db_read_pool"] = readers
+        db.close_pools(app)
+    return results
+
+
+def compare(results, baseline, threshold):
+    """Return a list of regression messages against a baseline's routes."""
+    regressions = []
+    for name, current in results.items():
+        before = baseline.get(name)
+        if before is None:
+            continue
+        if current["p95_ms"] > before["p95_ms"] * (1 + threshold):
+            regressions.append(
+                f"{name}: p95 {before['p95_ms']} ms -> {current['p95_ms']} ms "
+                f"(+{(current['p95_ms'] / before['p95_ms'] - 1) * 100:.0f}%)"
+            )
+        # Half a query of slack: cache expiry mid-run adds fractions.
+        if current["queries"] > before["queries"] + 0.5:
+            regressions.append(
+                f"{name}: queries/request {before['queries']} -> {current['queries']}"
+            )
+    return regressions
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Benchmark the main routes.")
+    parser.add_argument("--db", help="existing database (default: generate a scratch one)")
+    parser.add_argument("--scale", type=float, default=1.0)
+    parser.add_argument("--requests", type=int, default=50)
+    parser.add_argument("--out")
+    parser.add_argument("--baseline")
+    parser.add_argument("--threshold", type=float, default=0.2)
+    parser.add_argument("--threads", help="comma-separated thread counts for the read throughput run")
+    parser.add_argument("--seconds", type=float, default=5.0)
+    args = parser.parse_args(argv[1:])
+
+    path = args.db
+    if path is None:
+        from generate_data import build
+
+        path = os.path.join(tempfile.mkdtemp(prefix="hms-bench-"), "hms.db")
+        build(path, scale=args.scale)
+
+    if args.threads:
+        counts = [int(n) for n in args.threads.split(",")]
+        print(f"[Bench] {'mode':12} {'threads':>7} {'reads/s':>9} {'writes/s':>9}")
+        for (mode, threads), (reads, writes) in throughput(path, counts, args.seconds).items():
+            print(f"[Bench] {mode:12} {threads:7} {reads:9.1f} {writes:9.1f}")
+        return 0
+
+    results = run(path, requests=args.requests)
+    print(f"[Bench] {'route':30} {'p50':>8} {'p95':>8} {'p99':>8} {'queries':>8} {'peak KiB':>9}")
+    for name, r in results.items():
+        print(
+            f"[Bench] {name:30} {r['p50_ms']:8.2f} {r['p95_ms']:8.2f} {r['p99_ms']:8.2f} "
+            f"{r['queries']:8.2f} {r['peak_kib']:9.1f}"
+        )
+
+    if args.out:
+        report = {
+            "meta": {
+                "created_at": datetime.now().isoformat(timespec="seconds"),
+                "db": os.path.abspath(path),
+                "scale": None if args.db else args.scale,
+                "requests": args.requests,
+                "python": platform.python_version(),
+                "sqlite": sqlite3.sqlite_version,
+            },
+            "routes": results,
+        }
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"[Bench] Results written to {args.out}")
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)["routes"]
+        regressions = compare(results, baseline, args.threshold)
+        for message in regressions:
+            print(f"[Bench] REGRESSION {message}")
+        if regressions:
+            return 1
+        print(f"[Bench] No regressions against {args.baseline} (threshold {args.threshold:.0%}).")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
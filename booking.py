@@ -0,0 +1,297 @@
+# booking.py
+"""
+Atomic appointment booking.
+
+Booking and rescheduling are each one conditional write inside a
+BEGIN IMMEDIATE transaction. The slot check and the write can't interleave
+with another request, and SQLite's busy timeout queues writers instead of
+failing them with a stale-snapshot error. book(), reschedule() and cancel()
+are the same writes without the transaction, for writer.write().
+
+Usage:
+    python booking.py stress [threads] [attempts]   # contention check on a scratch DB
+"""
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from datetime import date, datetime, timedelta
+
+import db
+
+BOOKED = "booked"
+UNAVAILABLE = "unavailable"  # no open slot at that date/time
+TAKEN = "taken"              # the slot has an appointment (an active one, for booking)
+NOT_FOUND = "not_found"      # rescheduling: no such appointment for this patient
+
+_BOOK_SQL = """
+    INSERT INTO appointments (patient_id, doctor_id, department_id, date, time, status, created_at)
+    SELECT ?, da.doctor_id, dp.department_id, da.date, da.time, 'Booked', ?
+    FROM doctor_availability da
+    JOIN doctor_profiles dp ON dp.id = da.doctor_id
+    WHERE da.doctor_id = ?
+      AND da.date = ?
+      AND da.time = ?
+      AND da.is_available = 1
+    LIMIT 1
+    ON CONFLICT (doctor_id, date, time) DO UPDATE
+        SET patient_id = excluded.patient_id,
+            department_id = excluded.department_id,
+            status = 'Booked',
+            created_at = excluded.created_at
+        WHERE appointments.status = 'Cancelled'
+"""
+
+_RESCHEDULE_SQL = """
+    UPDATE appointments
+    SET date = ?, time = ?, status = 'Booked'
+    WHERE id = ? AND patient_id = ?
+"""
+
+
+def _slot_is_open(cur, doctor_id, date_str, time_str):
+    cur.execute(
+        """
+        SELECT 1 FROM doctor_availability
+        WHERE doctor_id = ? AND date = ? AND time = ? AND is_available = 1
+        """,
+        (doctor_id, date_str, time_str),
+    )
+    return cur.fetchone() is not None
+
+
+def book(conn, patient_id, doctor_id, date_str, time_str):
+    """The writes of book_slot(), for a caller that owns the transaction."""
+    created_at = datetime.now().isoformat(timespec="seconds")
+    cur = conn.cursor()
+    cur.execute(_BOOK_SQL, (patient_id, created_at, doctor_id, date_str, time_str))
+    if cur.rowcount == 1:
+        return BOOKED
+    if _slot_is_open(cur, doctor_id, date_str, time_str):
+        return TAKEN
+    return UNAVAILABLE
+
+
+def book_slot(conn, patient_id, doctor_id, date_str, time_str):
+    """
+    Book an open slot for a patient. A 'Cancelled' appointment in the same
+    slot is reused; any other appointment there means the slot is taken.
+    Returns BOOKED, UNAVAILABLE or TAKEN.
+    """
+    return db.write_transaction(conn, book, patient_id, doctor_id, date_str, time_str)
+
+
+def reschedule(conn, appointment_id, patient_id, date_str, time_str):
+    """
+    The writes of reschedule_slot(), for a caller that owns the transaction.
+    Every check runs before the first write, so a refusal leaves nothing to
+    roll back.
+    """
+    cur = conn.cursor()
+    cur.execute(
+        "SELECT doctor_id FROM appointments WHERE id = ? AND patient_id = ?",
+        (appointment_id, patient_id),
+    )
+    row = cur.fetchone()
+    if row is None:
+        return NOT_FOUND
+    doctor_id = row["doctor_id"]
+
+    # Any row in the target slot, even a cancelled one, keeps it: it may be
+    # another patient's history, with treatments attached.
+    cur.execute(
+        """
+        SELECT 1 FROM appointments
+        WHERE doctor_id = ? AND date = ? AND time = ? AND id != ?
+        """,
+        (doctor_id, date_str, time_str, appointment_id),
+    )
+    if cur.fetchone():
+        return TAKEN
+    if not _slot_is_open(cur, doctor_id, date_str, time_str):
+        return UNAVAILABLE
+
+    cur.execute(_RESCHEDULE_SQL, (date_str, time_str, appointment_id, patient_id))
+    return BOOKED
+
+
+def reschedule_slot(conn, appointment_id, patient_id, date_str, time_str):
+    """
+    Move a patient's appointment to another open slot of the same doctor.
+    A slot that holds any other appointment, cancelled or not, is TAKEN.
+    Returns BOOKED, UNAVAILABLE, TAKEN or NOT_FOUND.
+    """
+    return db.write_transaction(conn, reschedule, appointment_id, patient_id, date_str, time_str)
+
+
+def cancel(conn, appointment_id, patient_id):
+    """
+    Cancel a patient's appointment, for a caller that owns the transaction.
+    Returns the appointment as it was before (id, doctor_id, date, time,
+    status), or None if the patient has no such appointment.
+    """
+    cur = conn.cursor()
+    cur.execute(
+        """
+        SELECT id, doctor_id, date, time, status FROM appointments
+        WHERE id = ? AND patient_id = ?
+        """,
+        (appointment_id, patient_id),
+    )
+    appt = cur.fetchone()
+    if appt is not None and appt["status"] != "Cancelled":
+        cur.execute(
+            "UPDATE appointments SET status = 'Cancelled' WHERE id = ?",
+            (appointment_id,),
+        )
+    return appt
+
+
+def scratch_db(patients, slots=50):
+    """
+    A fresh database in a temp directory with one doctor, `patients`
+    patients and `slots` open slots tomorrow.
+    Returns (path, doctor_id, patient_ids, day, slot_times).
+    """
+    workdir = tempfile.mkdtemp(prefix="hms-booking-")
+    path = os.path.join(workdir, "hms.db")
+    conn = db._connect(path)
+    with open(db.SCHEMA_FILE, "r", encoding="utf-8") as f:
+        conn.executescript(f.read())
+
+    cur = conn.cursor()
+    cur.execute(
+        "INSERT INTO users (email, password_hash, role) VALUES ('doc@stress', '-', 'doctor')"
+    )
+    cur.execute(
+        "INSERT INTO doctor_profiles (user_id, name) VALUES (?, 'Dr. Stress')", (cur.lastrowid,)
+    )
+    doctor_id = cur.lastrowid
+    patient_ids = []
+    for i in range(patients):
+        cur.execute(
+            "INSERT INTO users (email, password_hash, role) VALUES (?, '-', 'patient')",
+            (f"patient{i}@stress",),
+        )
+        cur.execute(
+            "INSERT INTO patient_profiles (user_id, name) VALUES (?, ?)",
+            (cur.lastrowid, f"Patient {i}"),
+        )
+        patient_ids.append(cur.lastrowid)
+    day = (date.today() + timedelta(days=1)).isoformat()
+    slot_times = [f"{(8 * 60 + i * 15) // 60 % 24:02d}:{i * 15 % 60:02d}" for i in range(slots)]
+    cur.executemany(
+        "INSERT INTO doctor_availability (doctor_id, date, time) VALUES (?, ?, ?)",
+        [(doctor_id, day, t) for t in slot_times],
+    )
+    conn.commit()
+    conn.close()
+    return path, doctor_id, patient_ids, day, slot_times
+
+
+def stress(threads=16, attempts=2000, slots=50):
+    """
+    Fire `attempts` bookings (with some cancellations mixed in) at `slots`
+    slots of one doctor from `threads` threads, then check that no slot
+    ended up with more than one active appointment, that every reported
+    booking is in the table and that no thread hit a lock error.
+    """
+    path, doctor_id, patient_ids, day, slot_times = scratch_db(threads, slots)
+
+    lock = threading.Lock()
+    outcomes = {BOOKED: 0, TAKEN: 0, UNAVAILABLE: 0, "cancel_attempts": 0, "cancelled": 0}
+    errors = []
+    start_line = threading.Barrier(threads)
+
+    def worker(index):
+        rng = random.Random(index)
+        local = db._connect(path)
+        patient_id = patient_ids[index]
+        start_line.wait()
+        for _ in range(attempts // threads):
+            slot = rng.choice(slot_times)
+            try:
+                if rng.random() < 0.2:
+                    local.execute("BEGIN IMMEDIATE")
+                    changed = local.execute(
+                        """
+                        UPDATE appointments SET status = 'Cancelled'
+                        WHERE doctor_id = ? AND date = ? AND time = ?
+                          AND patient_id = ? AND status = 'Booked'
+                        """,
+                        (doctor_id, day, slot, patient_id),
+                    ).rowcount
+                    local.commit()
+                    with lock:
+                        outcomes["cancel_attempts"] += 1
+                        outcomes["cancelled"] += changed
+                else:
+                    result = book_slot(local, patient_id, doctor_id, day, slot)
+                    with lock:
+                        outcomes[result] += 1
+            except sqlite3.Error as exc:
+                with lock:
+                    errors.append(repr(exc))
+        local.close()
+
+    started = time.perf_counter()
+    workers = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join()
+    elapsed = time.perf_counter() - started
+
+    conn = db._connect(path)
+    cur = conn.cursor()
+    cur.execute(
+        """
+        SELECT COUNT(*) AS c FROM (
+            SELECT 1 FROM appointments WHERE status = 'Booked'
+            GROUP BY doctor_id, date, time HAVING COUNT(*) > 1
+        )
+        """
+    )
+    double_booked = cur.fetchone()["c"]
+    cur.execute("SELECT COUNT(*) AS c FROM appointments WHERE status = 'Booked'")
+    active = cur.fetchone()["c"]
+    conn.close()
+
+    return {
+        "threads": threads,
+        "attempts": sum(outcomes.values()) - outcomes["cancelled"],
+        "outcomes": outcomes,
+        "errors": errors,
+        "double_booked_slots": double_booked,
+        "active_bookings": active,
+        "expected_active": outcomes[BOOKED] - outcomes["cancelled"],
+        "seconds": round(elapsed, 3),
+    }
+
+
+def main(argv):
+    if len(argv) < 2 or argv[1] != "stress":
+        print(__doc__)
+        return 2
+    threads = int(argv[2]) if len(argv) > 2 else 16
+    attempts = int(argv[3]) if len(argv) > 3 else 2000
+    report = stress(threads, attempts)
+    for key, value in report.items():
+        if key != "errors":
+            print(f"[Booking] {key}: {value}")
+    for error in report["errors"][:10]:
+        print(f"[Booking] error: {error}")
+    ok = (
+        not report["errors"]
+        and report["double_booked_slots"] == 0
+        and report["active_bookings"] == report["expected_active"]
+    )
+    print("[Booking] OK" if ok else "[Booking] FAILED")
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
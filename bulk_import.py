@@ -0,0 +1,393 @@
+# bulk_import.py
+"""
+Bulk import of doctors and patients from CSV or JSONL.
+
+Rows are read as a stream and validated one by one. Passwords are hashed
+with the app's PASSWORD_HASH_METHOD in the same process pool as logins (see
+PasswordHasher.hash_many), so an import stays within the hashing budget.
+Users plus profiles are inserted with executemany in batched transactions.
+A bad row is reported with its line number and skipped; it never aborts
+the rest of the load.
+
+Uploads from the admin page run as background jobs (start_import): the
+file is saved to a temp file and imported on its own thread and
+connection, with progress written to import_jobs after every batch, so
+any worker process can show it.
+
+Columns (CSV header or JSON keys):
+    role        doctor | patient (optional when a default role is given)
+    email, password, name                                        required
+    doctor:  department (name), specialization, phone, bio       optional
+    patient: age, gender, phone, address, emergency_contact      optional
+
+Usage:
+    python bulk_import.py FILE [--role doctor|patient] [--batch N] [--workers N]
+"""
+import argparse
+import csv
+import io
+import json
+import os
+import re
+import sys
+import tempfile
+import threading
+from datetime import datetime
+
+from flask import current_app, has_app_context
+
+import db
+from db import get_db
+from passwords import PasswordHasher, current_method
+
+DEFAULT_BATCH_SIZE = 1000
+MAX_REPORTED_ERRORS = 500
+
+_EMAIL_RE = re.compile(r"^[^@\s]+@[^@\s]+\.[^@\s]+$")
+_DOCTOR_FIELDS = ("specialization", "phone", "bio")
+_PATIENT_FIELDS = ("age", "gender", "phone", "address", "emergency_contact")
+
+
+class ImportReport:
+    def __init__(self):
+        self.rows = 0
+        self.imported = {"doctor": 0, "patient": 0}
+        self.errors = []  # (line number, message)
+        self.error_count = 0
+
+    def error(self, line, message):
+        self.error_count += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append((line, message))
+
+    def as_dict(self):
+        return {
+            "rows": self.rows,
+            "imported": dict(self.imported),
+            "errors": self.error_count,
+        }
+
+    @classmethod
+    def from_job(cls, job):
+        """The report as last saved for an import_jobs row."""
+        report = cls()
+        report.rows = job["rows"]
+        report.imported = {"doctor": job["doctors"], "patient": job["patients"]}
+        report.errors = [tuple(error) for error in json.loads(job["errors"])]
+        report.error_count = job["error_count"]
+        return report
+
+
+def detect_format(filename):
+    return "jsonl" if filename.lower().endswith((".jsonl", ".ndjson", ".json")) else "csv"
+
+
+def iter_records(stream, fmt):
+    """
+    Yield (line number, dict) from a text stream without reading it whole.
+    Unparseable JSON lines are yielded as (line number, None).
+    """
+    if fmt == "jsonl":
+        for line_no, line in enumerate(stream, start=1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError:
+                record = None
+            yield line_no, record if isinstance(record, dict) else None
+    else:
+        reader = csv.DictReader(stream)
+        for record in reader:
+            # line_num is the reader's position, i.e. the record's last line.
+            yield reader.line_num, record
+
+
+def _clean(record, key):
+    value = record.get(key)
+    if value is None:
+        return ""
+    return str(value).strip()
+
+
+def validate(record, default_role, departments):
+    """Return (row dict, None) for a good record or (None, error message)."""
+    if record is None:
+        return None, "Could not parse row."
+    role = _clean(record, "role").lower() or default_role
+    if role not in ("doctor", "patient"):
+        return None, "Role must be 'doctor' or 'patient'."
+
+    email = _clean(record, "email")
+    password = _clean(record, "password")
+    name = _clean(record, "name")
+    if not email or not password or not name:
+        return None, "Email, password and name are required."
+    if not _EMAIL_RE.match(email):
+        return None, f"Invalid email '{email}'."
+
+    row = {"role": role, "email": email, "password": password, "name": name}
+    if role == "doctor":
+        department = _clean(record, "department")
+        if department and department.lower() not in departments:
+            return None, f"Unknown department '{department}'."
+        row["department_id"] = departments.get(department.lower()) if department else None
+        for field in _DOCTOR_FIELDS:
+            row[field] = _clean(record, field)
+    else:
+        for field in _PATIENT_FIELDS:
+            row[field] = _clean(record, field)
+        if row["age"]:
+            try:
+                row["age"] = int(row["age"])
+            except ValueError:
+                return None, f"Invalid age '{row['age']}'."
+            if not 0 <= row["age"] <= 150:
+                return None, f"Invalid age '{row['age']}'."
+        else:
+            row["age"] = None
+    return row, None
+
+
+def _insert_batch(conn, batch, hashes, report):
+    """Insert one validated batch in a single transaction."""
+    cur = conn.cursor()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        # Emails registered since the batch was validated are dropped here.
+        placeholders = ",".join("?" * len(batch))
+        cur.execute(
+            f"SELECT email FROM users WHERE email IN ({placeholders})",
+            [row["email"] for _, row in batch],
+        )
+        taken = {r["email"] for r in cur.fetchall()}
+        rows = []
+        for (line, row), password_hash in zip(batch, hashes):
+            if row["email"] in taken:
+                report.error(line, f"Email '{row['email']}' is already registered.")
+            else:
+                rows.append((row, password_hash))
+        if not rows:
+            conn.commit()
+            return
+
+        cur.executemany(
+            "INSERT INTO users (email, password_hash, role, status) VALUES (?, ?, ?, 'active')",
+            [(row["email"], password_hash, row["role"]) for row, password_hash in rows],
+        )
+        cur.execute(
+            f"SELECT id, email FROM users WHERE email IN ({','.join('?' * len(rows))})",
+            [row["email"] for row, _ in rows],
+        )
+        user_ids = {r["email"]: r["id"] for r in cur.fetchall()}
+
+        doctors = [row for row, _ in rows if row["role"] == "doctor"]
+        patients = [row for row, _ in rows if row["role"] == "patient"]
+        cur.executemany(
+            """
+            INSERT INTO doctor_profiles (user_id, department_id, name, specialization, phone, bio)
+            VALUES (?, ?, ?, ?, ?, ?)
+            """,
+            [
+                (
+                    user_ids[r["email"]], r["department_id"], r["name"],
+                    r["specialization"], r["phone"], r["bio"],
+                )
+                for r in doctors
+            ],
+        )
+        cur.executemany(
+            """
+            INSERT INTO patient_profiles
+              (user_id, name, age, gender, phone, address, emergency_contact)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            """,
+            [
+                (
+                    user_ids[r["email"]], r["name"], r["age"], r["gender"],
+                    r["phone"], r["address"], r["emergency_contact"],
+                )
+                for r in patients
+            ],
+        )
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    report.imported["doctor"] += len(doctors)
+    report.imported["patient"] += len(patients)
+
+
+def import_records(conn, records, default_role=None, batch_size=DEFAULT_BATCH_SIZE,
+                   workers=None, progress=None):
+    """
+    Validate and import an iterable of (line number, record) pairs.
+    Inside the app, passwords go through its hashing pool; elsewhere a pool
+    of `workers` processes (default: one per CPU) is started for the run.
+    progress(report) is called after each batch. Returns an ImportReport.
+    """
+    report = ImportReport()
+    cur = conn.cursor()
+    cur.execute("SELECT id, name FROM departments")
+    departments = {row["name"].lower(): row["id"] for row in cur.fetchall()}
+
+    seen_emails = set()
+    batch = []
+    hasher = None
+    if has_app_context():
+        hasher = current_app.extensions.get("password_hasher")
+    own_hasher = hasher is None
+    if own_hasher:
+        hasher = PasswordHasher(current_method(), workers=workers or os.cpu_count() or 1)
+
+    def flush():
+        if not batch:
+            return
+        hashes = hasher.hash_many([row["password"] for _, row in batch])
+        _insert_batch(conn, batch, hashes, report)
+        batch.clear()
+        if progress is not None:
+            progress(report)
+
+    try:
+        for line, record in records:
+            report.rows += 1
+            row, error = validate(record, default_role, departments)
+            if error:
+                report.error(line, error)
+                continue
+            if row["email"] in seen_emails:
+                report.error(line, f"Duplicate email '{row['email']}' in file.")
+                continue
+            seen_emails.add(row["email"])
+            batch.append((line, row))
+            if len(batch) >= batch_size:
+                flush()
+        flush()
+    finally:
+        if own_hasher:
+            hasher.shutdown()
+
+    return report
+
+
+def import_stream(conn, binary_stream, filename, default_role=None, **kwargs):
+    """Import from a binary file-like object, e.g. an uploaded file."""
+    text = io.TextIOWrapper(binary_stream, encoding="utf-8-sig", newline="")
+    try:
+        return import_records(conn, iter_records(text, detect_format(filename)), default_role, **kwargs)
+    finally:
+        text.detach()
+
+
+def _save_job(conn, job_id, report, status="running", message=None):
+    conn.execute(
+        """
+        UPDATE import_jobs
+        SET status = ?, rows = ?, doctors = ?, patients = ?, error_count = ?, errors = ?,
+            message = ?, finished_at = ?
+        WHERE id = ?
+        """,
+        (
+            status,
+            report.rows,
+            report.imported["doctor"],
+            report.imported["patient"],
+            report.error_count,
+            json.dumps(report.errors),
+            message,
+            None if status == "running" else datetime.now().isoformat(timespec="seconds"),
+            job_id,
+        ),
+    )
+    conn.commit()
+
+
+def _run_job(app, job_id, path, filename, default_role):
+    conn = db._connect(db.DB_PATH)
+    saved = ImportReport()
+
+    def progress(report):
+        nonlocal saved
+        saved = report
+        _save_job(conn, job_id, report)
+
+    try:
+        with app.app_context(), open(path, "rb") as f:
+            report = import_stream(conn, f, filename, default_role, progress=progress)
+        _save_job(conn, job_id, report, "done")
+    except Exception as exc:
+        if conn.in_transaction:
+            conn.rollback()
+        _save_job(conn, job_id, saved, "failed", str(exc))
+        raise
+    finally:
+        conn.close()
+        os.remove(path)
+
+
+def start_import(conn, upload, default_role=None):
+    """
+    Save an uploaded file (a werkzeug FileStorage) and import it on a
+    background thread. Returns the import_jobs id to poll with get_job().
+    """
+    fd, path = tempfile.mkstemp(prefix="hms-import-", suffix=os.path.splitext(upload.filename)[1])
+    os.close(fd)
+    upload.save(path)
+    cur = conn.execute(
+        "INSERT INTO import_jobs (filename, started_at) VALUES (?, ?)",
+        (upload.filename, datetime.now().isoformat(timespec="seconds")),
+    )
+    conn.commit()
+    job_id = cur.lastrowid
+    threading.Thread(
+        target=_run_job,
+        args=(current_app._get_current_object(), job_id, path, upload.filename, default_role),
+        name=f"import-{job_id}",
+        daemon=True,
+    ).start()
+    return job_id
+
+
+def get_job(conn, job_id):
+    return conn.execute("SELECT * FROM import_jobs WHERE id = ?", (job_id,)).fetchone()
+
+
+def recent_jobs(conn, limit=10):
+    return conn.execute(
+        """
+        SELECT id, filename, status, rows, doctors, patients, error_count, started_at, finished_at
+        FROM import_jobs ORDER BY id DESC LIMIT ?
+        """,
+        (limit,),
+    ).fetchall()
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Bulk import doctors and patients.")
+    parser.add_argument("file")
+    parser.add_argument("--role", choices=("doctor", "patient"))
+    parser.add_argument("--batch", type=int, default=DEFAULT_BATCH_SIZE)
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args(argv[1:])
+
+    conn = get_db()
+    with open(args.file, "rb") as f:
+        report = import_stream(
+            conn, f, args.file, args.role, batch_size=args.batch, workers=args.workers
+        )
+    conn.close()
+
+    for line, message in report.errors:
+        print(f"[Import] line {line}: {message}")
+    if report.error_count > len(report.errors):
+        print(f"[Import] ... {report.error_count - len(report.errors)} more errors")
+    print(
+        f"[Import] {report.rows} rows: {report.imported['doctor']} doctors, "
+        f"{report.imported['patient']} patients imported, {report.error_count} errors."
+    )
+    return 1 if report.error_count else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,190 @@
+# cache.py
+"""
+Query result cache that stays correct across worker processes.
+
+The rarely written tables in TABLES have a row in cache_generations, and
+triggers bump that row's generation when they change (migrations 3 and 5
+in migrations.py). An entry is stored with the generations of the tables
+it was read from, and is served only while they're unchanged, whichever
+process made the change.
+
+The busy tables (doctor_availability, appointments) have no triggers: a
+second UPDATE per row written doubled the cost of bulk writes and
+serialized every writer on one row. Entries read from them are stamped
+with PRAGMA data_version instead, so any commit at all invalidates them.
+
+Checking is cheap. The cache keeps one query_only probe connection and
+asks it for PRAGMA data_version, which changes only when some other
+connection has committed. Only then is cache_generations (a few rows on
+one page) read again. So a lookup costs one PRAGMA on top of the dict
+lookup, and the real queries run only after their tables have changed.
+
+Entries are evicted least recently used beyond CACHE_MAX_ENTRIES. Hits and
+misses are counted per region and show up on /admin/metrics and /metrics.
+Cached values are shared between requests: treat them as read-only.
+"""
+import threading
+from collections import OrderedDict
+
+from flask import current_app, has_app_context
+
+import db
+
+DEFAULT_MAX_ENTRIES = 2048
+
+# Tables with a generation counter; see migrations 3 and 5.
+TABLES = ("departments", "doctor_profiles", "patient_profiles", "users")
+
+
+class GenerationProbe:
+    """Reads cache_generations through one query_only connection, only when data_version moves."""
+
+    def __init__(self, path=None):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = None
+        self._opened = 0  # data_version restarts with each new connection
+        self._data_version = None
+        self._generations = {}
+        self.checks = 0
+        self.refreshes = 0
+
+    def _read(self):
+        """({table: generation}, version), re-reading the table only when something has committed."""
+        with self._lock:
+            if self._conn is None:
+                self._conn = db._connect(self.path, ("PRAGMA query_only = ON;",))
+                self._opened += 1
+            version = self._conn.execute("PRAGMA data_version").fetchone()[0]
+            self.checks += 1
+            if version != self._data_version:
+                rows = self._conn.execute("SELECT name, generation FROM cache_generations")
+                self._generations = {row["name"]: row["generation"] for row in rows}
+                self._data_version = version
+                self.refreshes += 1
+            return self._generations, (self._opened, version)
+
+    def generations(self):
+        """Current {table: generation}."""
+        return self._read()[0]
+
+    def stamp(self, tables):
+        """
+        The generations of `tables`, as a tuple to compare later. Tables
+        without a generation row are stamped with data_version, which
+        moves on every commit.
+        """
+        generations, version = self._read()
+        return tuple(generations[t] if t in generations else version for t in tables)
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+                self._data_version = None
+
+
+class GenerationCache:
+    """LRU of (region, key) -> value, each stamped with its tables' generations."""
+
+    def __init__(self, probe, max_entries=DEFAULT_MAX_ENTRIES):
+        self.probe = probe
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # (region, key) -> (stamp, value)
+        self.evictions = 0
+        self._hits = {}
+        self._misses = {}
+
+    def get_or_load(self, region, key, tables, load):
+        """
+        The cached value for (region, key) if none of `tables` has changed
+        since it was stored, else load() (stored for next time).
+        """
+        # Stamped before loading: a write racing with load() only makes the
+        # entry look older than it is, so it's reloaded next time.
+        stamp = self.probe.stamp(tables)
+        entry_key = (region, key)
+        with self._lock:
+            entry = self._entries.get(entry_key)
+            if entry is not None and entry[0] == stamp:
+                self._entries.move_to_end(entry_key)
+                self._hits[region] = self._hits.get(region, 0) + 1
+                return entry[1]
+            self._misses[region] = self._misses.get(region, 0) + 1
+
+        value = load()
+        with self._lock:
+            self._entries[entry_key] = (stamp, value)
+            self._entries.move_to_end(entry_key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def region_stats(self):
+        """{region: (hits, misses)}"""
+        with self._lock:
+            regions = sorted(set(self._hits) | set(self._misses))
+            return {r: (self._hits.get(r, 0), self._misses.get(r, 0)) for r in regions}
+
+    def stats(self):
+        regions = self.region_stats()
+        hits = sum(h for h, _ in regions.values())
+        misses = sum(m for _, m in regions.values())
+        with self._lock:
+            stats = {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": hits,
+                "misses": misses,
+                "hit_ratio": round(hits / (hits + misses), 3) if hits + misses else 0.0,
+                "evictions": self.evictions,
+                "checks": self.probe.checks,
+                "refreshes": self.probe.refreshes,
+            }
+        for region, (h, m) in regions.items():
+            stats[region] = f"{h} hits / {m} misses"
+        return stats
+
+
+def init_app(app):
+    """
+    Attach the generation probe and a query cache of CACHE_MAX_ENTRIES
+    entries; 0 disables the cache (the probe stays, see reference.py).
+    """
+    app.config.setdefault("CACHE_MAX_ENTRIES", DEFAULT_MAX_ENTRIES)
+    probe = GenerationProbe(db.DB_PATH)
+    app.extensions["generations"] = probe
+    if app.config["CACHE_MAX_ENTRIES"] > 0:
+        app.extensions["cache"] = GenerationCache(probe, app.config["CACHE_MAX_ENTRIES"])
+
+
+def get_cache():
+    if has_app_context():
+        return current_app.extensions.get("cache")
+    return None
+
+
+def cached(region, key, tables, load):
+    """load() through the app's cache; just load() when there is none."""
+    cache = get_cache()
+    if cache is None:
+        return load()
+    return cache.get_or_load(region, key, tables, load)
+
+
+def bump(conn, tables=TABLES):
+    """
+    Move the generations of `tables` on, for bulk loads that run with the
+    triggers dropped. The caller commits.
+    """
+    conn.executemany(
+        "UPDATE cache_generations SET generation = generation + 1 WHERE name = ?",
+        [(table,) for table in tables],
+    )
@@ -0,0 +1,169 @@
+# counters.py
+"""
+Trigger-maintained dashboard counters (see stat_counters in schema.sql).
+
+Usage:
+    python counters.py verify    # report drift between counters and tables
+    python counters.py rebuild   # recompute every counter from scratch
+"""
+import sys
+
+from db import get_db
+
+
+def compute_counters(cur):
+    """Recompute every counter straight from the base tables."""
+    counts = {}
+
+    cur.execute("SELECT COUNT(*) AS c FROM doctor_profiles")
+    counts[("total", "doctors")] = cur.fetchone()["c"]
+
+    cur.execute("SELECT COUNT(*) AS c FROM patient_profiles")
+    counts[("total", "patients")] = cur.fetchone()["c"]
+
+    cur.execute("SELECT COUNT(*) AS c FROM appointments")
+    counts[("total", "appointments")] = cur.fetchone()["c"]
+
+    cur.execute("SELECT status, COUNT(*) AS c FROM appointments GROUP BY status")
+    for row in cur.fetchall():
+        counts[("status", row["status"])] = row["c"]
+
+    cur.execute(
+        """
+        SELECT COALESCE(CAST(department_id AS TEXT), '') AS dept, COUNT(*) AS c
+        FROM appointments
+        GROUP BY department_id
+        """
+    )
+    for row in cur.fetchall():
+        counts[("department", row["dept"])] = row["c"]
+
+    # Appointments moved to the archive database (see archive.py).
+    from archive import attach
+
+    if attach(cur.connection):
+        cur.execute(
+            """
+            SELECT status, COALESCE(CAST(department_id AS TEXT), '') AS dept, COUNT(*) AS c
+            FROM archive.appointments
+            GROUP BY status, department_id
+            """
+        )
+        for row in cur.fetchall():
+            for scope_key in (
+                ("archived_total", "appointments"),
+                ("archived_status", row["status"]),
+                ("archived_department", row["dept"]),
+            ):
+                counts[scope_key] = counts.get(scope_key, 0) + row["c"]
+
+    return counts
+
+
+def read_counters(cur):
+    cur.execute("SELECT scope, key, value FROM stat_counters")
+    return {(row["scope"], row["key"]): row["value"] for row in cur.fetchall()}
+
+
+def rebuild_counters(conn, commit=True):
+    """
+    Replace stat_counters with freshly computed values in one transaction.
+    With commit=False the caller's transaction is left open.
+    """
+    cur = conn.cursor()
+    counts = compute_counters(cur)
+    cur.execute("DELETE FROM stat_counters")
+    cur.executemany(
+        "INSERT INTO stat_counters (scope, key, value) VALUES (?, ?, ?)",
+        [(scope, key, value) for (scope, key), value in counts.items()],
+    )
+    if commit:
+        conn.commit()
+    return counts
+
+
+def verify_counters(conn):
+    """
+    Compare stat_counters against the tables.
+    Returns a list of (scope, key, stored, actual) for every mismatch.
+    """
+    cur = conn.cursor()
+    actual = compute_counters(cur)
+    stored = read_counters(cur)
+    drift = []
+    for scope_key in sorted(set(actual) | set(stored)):
+        have = stored.get(scope_key, 0)
+        want = actual.get(scope_key, 0)
+        if have != want:
+            drift.append((scope_key[0], scope_key[1], have, want))
+    return drift
+
+
+def ensure_counters(conn, commit=True):
+    """Build the counters once for databases created before the table existed."""
+    cur = conn.cursor()
+    cur.execute("SELECT 1 FROM stat_counters LIMIT 1")
+    if cur.fetchone() is None:
+        rebuild_counters(conn, commit)
+
+
+def dashboard_counts(cur, departments=None):
+    """
+    Counter values for the admin dashboard: totals plus appointments per
+    status and per department (with department names resolved). Archived
+    appointments are included. `departments` are (id, name) pairs in name
+    order, e.g. from the reference registry; read from the table if omitted.
+    """
+    stored = read_counters(cur)
+    for (scope, key), value in list(stored.items()):
+        if scope.startswith("archived_"):
+            scope_key = (scope[len("archived_"):], key)
+            stored[scope_key] = stored.get(scope_key, 0) + value
+
+    if departments is None:
+        cur.execute("SELECT id, name FROM departments ORDER BY name")
+        departments = [(row["id"], row["name"]) for row in cur.fetchall()]
+    by_department = []
+    for department_id, name, *_ in departments:
+        by_department.append((name, stored.get(("department", str(department_id)), 0)))
+    unassigned = stored.get(("department", ""), 0)
+    if unassigned:
+        by_department.append(("No department", unassigned))
+
+    return {
+        "doctor_count": stored.get(("total", "doctors"), 0),
+        "patient_count": stored.get(("total", "patients"), 0),
+        "appointment_count": stored.get(("total", "appointments"), 0),
+        "status_counts": [
+            (status, stored.get(("status", status), 0))
+            for status in ("Booked", "Completed", "Cancelled")
+        ],
+        "department_counts": by_department,
+    }
+
+
+def main(argv):
+    command = argv[1] if len(argv) > 1 else "verify"
+    conn = get_db()
+    if command == "rebuild":
+        counts = rebuild_counters(conn)
+        print(f"[Counters] Rebuilt {len(counts)} counters.")
+        status = 0
+    elif command == "verify":
+        drift = verify_counters(conn)
+        if drift:
+            for scope, key, have, want in drift:
+                print(f"[Counters] Drift {scope}/{key or '-'}: stored={have} actual={want}")
+            status = 1
+        else:
+            print("[Counters] All counters match.")
+            status = 0
+    else:
+        print(__doc__)
+        status = 2
+    conn.close()
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
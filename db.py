@@ -1,51 +1,328 @@
 # db.py
+import queue
 import sqlite3
+import threading
+import time
 from pathlib import Path
 
+from flask import current_app, g, has_app_context, has_request_context, request
 from werkzeug.security import generate_password_hash
 
 DB_PATH = "hms.db"
 SCHEMA_FILE = "schema.sql"
 
+# Callables run on every new physical connection, e.g. to install a trace
+# callback. Each receives the sqlite3 connection.
+connect_hooks = []
 
-def get_db():
+
+# Requests with these methods read through the reader pool (see get_db).
+READ_METHODS = ("GET", "HEAD")
+
+
+def _connect(path=None, pragmas=()):
     """
-    Return a new SQLite connection with sane defaults for a Flask app:
+    Open a physical SQLite connection with sane defaults for a Flask app:
     - Longer timeout so short concurrent writes don't immediately fail.
     - WAL journal mode for better concurrency.
     - Foreign keys enforced.
+    `pragmas` are extra PRAGMA statements run after these, e.g. for readers.
     """
     conn = sqlite3.connect(
-        DB_PATH,
+        path or DB_PATH,
         timeout=10.0,          # wait up to 10s for locks instead of failing immediately
         check_same_thread=False,  # allow multi-threaded access (Flask dev server)
+        factory=PooledConnection,
     )
     conn.row_factory = sqlite3.Row  # access columns by name: row["email"]
 
     # Enable foreign keys and WAL for better concurrency
     conn.execute("PRAGMA foreign_keys = ON;")
     conn.execute("PRAGMA journal_mode = WAL;")
+    for pragma in pragmas:
+        conn.execute(pragma)
+
+    for hook in connect_hooks:
+        hook(conn)
 
     return conn
 
 
-def init_db():
+class PooledConnection(sqlite3.Connection):
+    """
+    sqlite3 connection that can be lent out for the length of a request.
+
+    While a connection is bound to a request, close() is a no-op so the
+    routes can keep calling conn.close() as before; the pool takes the
+    connection back at teardown.
+    """
+
+    bound = False
+    # Connect hooks may swap in a sqlite3.Cursor subclass, e.g. for metrics.
+    cursor_class = sqlite3.Cursor
+
+    def cursor(self, factory=None):
+        return super().cursor(factory or self.cursor_class)
+
+    # sqlite3.Connection.execute() bypasses Cursor.execute(); route both
+    # shortcuts through cursor() so cursor_class sees every statement.
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def close(self):
+        if self.bound:
+            return
+        super().close()
+
+
+class PoolTimeout(sqlite3.OperationalError):
+    """Raised when no pooled connection frees up within the pool timeout."""
+
+
+class ConnectionPool:
+    """
+    Bounded pool of SQLite connections.
+
+    Physical connections are opened lazily up to `size` and the PRAGMAs run
+    once per connection. acquire() blocks for up to `timeout` seconds when
+    every connection is in use and records how long callers waited.
+    """
+
+    def __init__(self, path=None, size=5, timeout=10.0, pragmas=()):
+        self.path = path or DB_PATH
+        self.pragmas = tuple(pragmas)
+        self.size = size
+        self.timeout = timeout
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._opened = 0
+        self.acquired = 0
+        self.waits = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def acquire(self):
+        start = time.perf_counter()
+        blocked = False
+        try:
+            conn = self._idle.get_nowait()
+        except queue.Empty:
+            with self._lock:
+                if self._opened < self.size:
+                    self._opened += 1
+                    opening = True
+                else:
+                    opening = False
+            if opening:
+                try:
+                    conn = _connect(self.path, self.pragmas)
+                except Exception:
+                    with self._lock:
+                        self._opened -= 1
+                    raise
+            else:
+                blocked = True
+                try:
+                    conn = self._idle.get(timeout=self.timeout)
+                except queue.Empty:
+                    raise PoolTimeout(
+                        f"no database connection free after {self.timeout}s "
+                        f"(pool size {self.size})"
+                    )
+
+        waited = time.perf_counter() - start
+        with self._lock:
+            self.acquired += 1
+            self.wait_total += waited
+            if waited > self.wait_max:
+                self.wait_max = waited
+            if blocked:
+                self.waits += 1
+        conn.bound = True
+        return conn, waited
+
+    def release(self, conn):
+        try:
+            # Never hand a half-finished transaction to the next request.
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error:
+            self._discard(conn)
+            return
+        self._idle.put(conn)
+
+    def _discard(self, conn):
+        conn.bound = False
+        try:
+            conn.close()
+        except sqlite3.Error:
+            pass
+        with self._lock:
+            self._opened -= 1
+
+    def close_all(self):
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._discard(conn)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "size": self.size,
+                "open": self._opened,
+                "idle": self._idle.qsize(),
+                "acquired": self.acquired,
+                "waits": self.waits,
+                "wait_total_ms": round(self.wait_total * 1000, 3),
+                "wait_avg_ms": round(self.wait_total * 1000 / self.acquired, 3)
+                if self.acquired
+                else 0.0,
+                "wait_max_ms": round(self.wait_max * 1000, 3),
+            }
+
+
+def _reading():
+    return has_request_context() and request.method in READ_METHODS
+
+
+def get_db(write=None):
+    """
+    Return the SQLite connection for the current request.
+
+    Inside a Flask app context the first call checks a connection out of one
+    of the app's pools and binds it to `g`; later calls in the same request
+    get the same connection back. GET and HEAD requests get a query_only
+    reader (unless a writer is already bound, so they see their own
+    writes); everything else gets a writer. write=True asks for a writer
+    whatever the method. Outside an app context (scripts, init_db) a fresh
+    standalone connection is returned, as before.
+    """
+    if not has_app_context():
+        return _connect()
+
+    pool = current_app.extensions.get("db_pool")
+    if pool is None:
+        return _connect()
+
+    if write is None:
+        write = not _reading()
+    readers = current_app.extensions.get("db_read_pool")
+    if not write and readers is not None and "db" not in g:
+        if "db_reader" not in g:
+            g.db_reader, g.db_pool_wait = readers.acquire()
+        return g.db_reader
+
+    if "db" not in g:
+        g.db, waited = pool.acquire()
+        g.db_pool_wait = g.get("db_pool_wait", 0.0) + waited
+    return g.db
+
+
+def write_transaction(conn, fn, *args):
+    """
+    Run fn(conn, *args) in a BEGIN IMMEDIATE transaction and commit it,
+    rolling back if fn raises. Returns what fn returns.
+    """
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        result = fn(conn, *args)
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    return result
+
+
+def _report_pool_wait(response):
+    waited = g.get("db_pool_wait")
+    if waited is not None:
+        response.headers.add("Server-Timing", f"db-pool;dur={waited * 1000:.3f}")
+    return response
+
+
+def close_db(exc=None):
+    conn = g.pop("db", None)
+    if conn is not None:
+        current_app.extensions["db_pool"].release(conn)
+    reader = g.pop("db_reader", None)
+    if reader is not None:
+        current_app.extensions["db_read_pool"].release(reader)
+
+
+def reader_pragmas(config):
+    return (
+        "PRAGMA query_only = ON;",
+        f"PRAGMA mmap_size = {int(config['DB_READ_MMAP_SIZE'])};",
+        # Negative cache_size is in KiB rather than pages.
+        f"PRAGMA cache_size = -{int(config['DB_READ_CACHE_KIB'])};",
+    )
+
+
+def init_app(app):
+    """
+    Attach connection pools to the app: writers sized by DB_POOL_SIZE and
+    query_only readers for GET/HEAD requests sized by DB_READ_POOL_SIZE
+    (0 sends every request to the writers). Readers map up to
+    DB_READ_MMAP_SIZE bytes of the file and cache DB_READ_CACHE_KIB KiB of
+    pages each. DB_POOL_TIMEOUT is the wait timeout for both pools.
+    """
+    app.config.setdefault("DB_POOL_SIZE", 5)
+    app.config.setdefault("DB_POOL_TIMEOUT", 10.0)
+    app.config.setdefault("DB_READ_POOL_SIZE", 4)
+    app.config.setdefault("DB_READ_MMAP_SIZE", 256 * 1024 * 1024)
+    app.config.setdefault("DB_READ_CACHE_KIB", 64 * 1024)
+    app.extensions["db_pool"] = ConnectionPool(
+        DB_PATH,
+        size=app.config["DB_POOL_SIZE"],
+        timeout=app.config["DB_POOL_TIMEOUT"],
+    )
+    if app.config["DB_READ_POOL_SIZE"]:
+        app.extensions["db_read_pool"] = ConnectionPool(
+            DB_PATH,
+            size=app.config["DB_READ_POOL_SIZE"],
+            timeout=app.config["DB_POOL_TIMEOUT"],
+            pragmas=reader_pragmas(app.config),
+        )
+    app.after_request(_report_pool_wait)
+    app.teardown_appcontext(close_db)
+
+
+def close_pools(app):
+    """Close every idle pooled connection, e.g. so connect_hooks apply to new ones."""
+    for name in ("db_pool", "db_read_pool"):
+        pool = app.extensions.get(name)
+        if pool is not None:
+            pool.close_all()
+
+
+def pool_stats(app, name="db_pool"):
+    pool = app.extensions.get(name)
+    return pool.stats() if pool else {}
+
+
+def init_db(defer_online=False):
     """
-    Create database tables from schema.sql and seed default data
-    on first run.
+    Bring the database up to the latest schema version (see migrations.py)
+    and seed the default admin on first run. With defer_online, trailing
+    online migrations are returned instead of applied.
     """
+    from migrations import migrate
+
     first_time = not Path(DB_PATH).exists()
 
-    # Create/ensure tables
-    conn = get_db()
-    with open(SCHEMA_FILE, "r", encoding="utf-8") as f:
-        sql = f.read()
-        conn.executescript(sql)
-    conn.commit()
+    conn = _connect()
+    deferred = migrate(conn, defer_online)
     conn.close()
 
     if first_time:
         seed_default_data()
+    return deferred
 
 
 def seed_default_data():
@@ -2,8 +2,12 @@ from datetime import date, timedelta
 
 from flask import render_template, request, redirect, url_for, flash
 
+from archive import history_source
+from availability import get_engine
 from db import get_db
+from schedules import WEEKDAY_NAMES, add_template, describe_weekdays, expand
 from security import role_required, get_doctor_profile_for_current_user
+from writer import write
 
 
 def init_doctor_routes(app):
@@ -34,28 +38,55 @@ def init_doctor_routes(app):
                         if slot_date < today or slot_date > today + timedelta(days=7):
                             flash("Availability must be within the next 7 days.", "warning")
                         else:
-                            cur.execute(
-                                """
-                                SELECT id FROM doctor_availability
-                                WHERE doctor_id = ? AND date = ? AND time = ?
-                                """,
-                                (doctor["id"], d, t),
-                            )
-                            if cur.fetchone():
-                                flash("This slot already exists.", "info")
-                            else:
-                                cur.execute(
+                            def add_slot(conn):
+                                # The unique slot index turns a duplicate into a no-op.
+                                cur = conn.execute(
                                     """
-                                    INSERT INTO doctor_availability (doctor_id, date, time, is_available)
+                                    INSERT OR IGNORE INTO doctor_availability (doctor_id, date, time, is_available)
                                     VALUES (?, ?, ?, 1)
                                     """,
                                     (doctor["id"], d, t),
                                 )
-                                conn.commit()
+                                return cur.rowcount == 1
+
+                            if write(add_slot):
+                                get_engine().add_slot(doctor["id"], d, t)
                                 flash("Availability slot added.", "success")
+                            else:
+                                flash("This slot already exists.", "info")
                     except ValueError:
                         flash("Invalid date format.", "danger")
 
+            elif action == "add_template":
+                def save_template(conn, *template):
+                    # Template and its slots commit together.
+                    add_template(conn, doctor["id"], *template, commit=False)
+                    return expand(conn, doctor_id=doctor["id"])
+
+                try:
+                    added = write(
+                        save_template,
+                        request.form.getlist("weekdays"),
+                        request.form.get("start_time", ""),
+                        request.form.get("end_time", ""),
+                        request.form.get("slot_minutes", ""),
+                    )
+                except ValueError as exc:
+                    flash(str(exc), "warning")
+                else:
+                    get_engine().warm_doctor(conn, doctor["id"])
+                    flash(f"Weekly schedule saved. {added} slots added.", "success")
+
+            elif action == "delete_template":
+                def delete_template(conn, template_id):
+                    conn.execute(
+                        "DELETE FROM schedule_templates WHERE id = ? AND doctor_id = ?",
+                        (template_id, doctor["id"]),
+                    )
+
+                write(delete_template, request.form.get("template_id"))
+                flash("Weekly schedule removed. Slots already created are kept.", "info")
+
             elif action == "update_appointment":
                 appt_id = request.form.get("appointment_id")
                 status = request.form.get("status")
@@ -66,13 +97,15 @@ def init_doctor_routes(app):
                 if not appt_id or not status:
                     flash("Invalid appointment update.", "danger")
                 else:
-                    cur.execute(
-                        "SELECT id FROM appointments WHERE id = ? AND doctor_id = ?",
-                        (appt_id, doctor["id"]),
-                    )
-                    if not cur.fetchone():
-                        flash("Appointment not found or not assigned to you.", "danger")
-                    else:
+                    def update_appointment(conn):
+                        cur = conn.cursor()
+                        cur.execute(
+                            "SELECT id, date, time, status FROM appointments WHERE id = ? AND doctor_id = ?",
+                            (appt_id, doctor["id"]),
+                        )
+                        appt = cur.fetchone()
+                        if not appt:
+                            return None
                         cur.execute(
                             "UPDATE appointments SET status = ? WHERE id = ?",
                             (status, appt_id),
@@ -101,8 +134,16 @@ def init_doctor_routes(app):
                                     """,
                                     (appt_id, diagnosis, prescription, notes),
                                 )
+                        return appt
 
-                        conn.commit()
+                    appt = write(update_appointment)
+                    if not appt:
+                        flash("Appointment not found or not assigned to you.", "danger")
+                    else:
+                        if appt["status"] == "Booked" and status != "Booked":
+                            get_engine().release(doctor["id"], appt["date"], appt["time"])
+                        elif appt["status"] != "Booked" and status == "Booked":
+                            get_engine().book(doctor["id"], appt["date"], appt["time"])
                         flash("Appointment updated.", "success")
 
         today = date.today()
@@ -134,10 +175,10 @@ def init_doctor_routes(app):
 
         cur.execute(
             """
-            SELECT DISTINCT p.id, p.name
-            FROM appointments a
-            JOIN patient_profiles p ON a.patient_id = p.id
-            WHERE a.doctor_id = ?
+            SELECT p.id, p.name, s.visit_count, s.last_visit_date, s.next_booked
+            FROM doctor_patient_summary s
+            JOIN patient_profiles p ON s.patient_id = p.id
+            WHERE s.doctor_id = ?
             ORDER BY p.name
             """,
             (doctor["id"],),
@@ -157,9 +198,24 @@ def init_doctor_routes(app):
         )
         slots = cur.fetchall()
 
+        cur.execute(
+            """
+            SELECT id, weekday_mask, start_time, end_time, slot_minutes
+            FROM schedule_templates
+            WHERE doctor_id = ?
+            ORDER BY id
+            """,
+            (doctor["id"],),
+        )
+        templates = [
+            dict(row, weekdays=describe_weekdays(row["weekday_mask"])) for row in cur.fetchall()
+        ]
+
         selected_patient = None
+        summary = None
         history = []
         selected_patient_id = request.args.get("patient_id")
+        deep_history = request.args.get("history") == "all"
 
         if selected_patient_id:
             try:
@@ -173,16 +229,26 @@ def init_doctor_routes(app):
                 if selected_patient:
                     cur.execute(
                         """
+                        SELECT * FROM doctor_patient_summary
+                        WHERE doctor_id = ? AND patient_id = ?
+                        """,
+                        (doctor["id"], pid_int),
+                    )
+                    summary = cur.fetchone()
+
+                    # Unary '+' keeps the planner on the (patient_id, date, time)
+                    # index instead of the much less selective status index.
+                    cur.execute(
+                        f"""
                         SELECT a.date,
                                a.time,
                                d.name AS doctor_name,
-                               t.diagnosis,
-                               t.prescription
-                        FROM appointments a
+                               a.diagnosis,
+                               a.prescription
+                        FROM {history_source(conn, deep_history)} a
                         JOIN doctor_profiles d ON a.doctor_id = d.id
-                        LEFT JOIN treatments t ON t.appointment_id = a.id
                         WHERE a.patient_id = ?
-                          AND a.status = 'Completed'
+                          AND +a.status = 'Completed'
                         ORDER BY a.date DESC, a.time DESC
                         """,
                         (pid_int,),
@@ -200,7 +266,11 @@ def init_doctor_routes(app):
             upcoming_appts=upcoming_appts,
             patients=patients,
             slots=slots,
+            templates=templates,
+            weekday_names=WEEKDAY_NAMES,
             selected_patient=selected_patient,
+            summary=summary,
             history=history,
             selected_patient_id=selected_patient_id,
+            deep_history=deep_history,
         )
@@ -0,0 +1,200 @@
+# export.py
+"""
+Streaming export of appointments with their treatments, as CSV or JSONL.
+
+Rows are read from the cursor with fetchmany() and written out one chunk at
+a time, so memory use doesn't grow with the table and the first bytes go
+out before the query has produced all of its rows. The admin endpoint hands the same
+generator to a streamed Response.
+
+Filters: status, doctor, department and a date range (inclusive). Archived
+appointments are included when asked for (see archive.py).
+
+Usage:
+    python export.py [--format csv|jsonl] [--status S] [--doctor ID]
+                     [--department ID|NAME] [--from YYYY-MM-DD] [--to YYYY-MM-DD]
+                     [--archived] [--out FILE]
+"""
+import argparse
+import csv
+import io
+import json
+import sys
+from datetime import date
+
+from archive import history_source
+from db import get_db
+
+FORMATS = {
+    "csv": "text/csv",
+    "jsonl": "application/x-ndjson",
+}
+CHUNK_SIZE = 500
+STATUSES = ("Booked", "Completed", "Cancelled")
+
+COLUMNS = (
+    "id",
+    "date",
+    "time",
+    "status",
+    "doctor_id",
+    "doctor_name",
+    "patient_id",
+    "patient_name",
+    "department",
+    "created_at",
+    "diagnosis",
+    "prescription",
+    "notes",
+)
+
+
+def build_query(conn, filters, archived=False):
+    """SELECT for the export and its parameters. Unknown filter keys are ignored."""
+    clauses = []
+    params = []
+    if filters.get("status"):
+        clauses.append("a.status = ?")
+        params.append(filters["status"])
+    if filters.get("doctor_id"):
+        clauses.append("a.doctor_id = ?")
+        params.append(int(filters["doctor_id"]))
+    if filters.get("department_id"):
+        clauses.append("a.department_id = ?")
+        params.append(int(filters["department_id"]))
+    if filters.get("date_from"):
+        clauses.append("a.date >= ?")
+        params.append(filters["date_from"])
+    if filters.get("date_to"):
+        clauses.append("a.date <= ?")
+        params.append(filters["date_to"])
+
+    sql = f"""
+        SELECT a.id, a.date, a.time, a.status,
+               a.doctor_id, d.name AS doctor_name,
+               a.patient_id, p.name AS patient_name,
+               dept.name AS department, a.created_at,
+               a.diagnosis, a.prescription, a.notes
+        FROM {history_source(conn, archived)} a
+        JOIN doctor_profiles d ON a.doctor_id = d.id
+        JOIN patient_profiles p ON a.patient_id = p.id
+        LEFT JOIN departments dept ON a.department_id = dept.id
+    """
+    if clauses:
+        sql += " WHERE " + " AND ".join(clauses)
+    sql += " ORDER BY a.date, a.time"
+    return sql, params
+
+
+def iter_chunks(cur, chunk_size=CHUNK_SIZE):
+    """Yield lists of rows from an executed cursor until it runs dry."""
+    while True:
+        rows = cur.fetchmany(chunk_size)
+        if not rows:
+            return
+        yield rows
+
+
+def _csv_chunks(chunks):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(COLUMNS)
+    yield buffer.getvalue()
+    for rows in chunks:
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerows(tuple(row) for row in rows)
+        yield buffer.getvalue()
+
+
+def _jsonl_chunks(chunks):
+    for rows in chunks:
+        yield "".join(json.dumps(dict(zip(COLUMNS, row))) + "\n" for row in rows)
+
+
+def export_chunks(conn, filters, fmt="csv", archived=False, chunk_size=CHUNK_SIZE):
+    """Generator of text chunks of the export in `fmt` (csv or jsonl)."""
+    if fmt not in FORMATS:
+        raise ValueError(f"unknown export format {fmt!r}")
+    sql, params = build_query(conn, filters, archived)
+    cur = conn.cursor()
+    cur.execute(sql, params)
+    chunks = iter_chunks(cur, chunk_size)
+    try:
+        if fmt == "csv":
+            yield from _csv_chunks(chunks)
+        else:
+            yield from _jsonl_chunks(chunks)
+    finally:
+        cur.close()
+
+
+def iso_date(value):
+    """Normalize a YYYY-MM-DD filter value. Raises ValueError if it isn't a date."""
+    return date.fromisoformat(value).isoformat()
+
+
+def _filename_date(value):
+    try:
+        return iso_date(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def filename(filters, fmt):
+    """
+    Download name for an export. Only known statuses and valid dates go into
+    it, since it ends up inside a Content-Disposition header.
+    """
+    parts = ["appointments"]
+    if filters.get("status") in STATUSES:
+        parts.append(filters["status"].lower())
+    date_from = _filename_date(filters.get("date_from"))
+    date_to = _filename_date(filters.get("date_to"))
+    if date_from or date_to:
+        parts.append(f"{date_from or 'start'}_{date_to or 'end'}")
+    return "-".join(parts) + "." + fmt
+
+
+def _department_id(conn, value):
+    if value is None or value.isdigit():
+        return value
+    row = conn.execute("SELECT id FROM departments WHERE name = ?", (value,)).fetchone()
+    if row is None:
+        raise SystemExit(f"[Export] Unknown department: {value}")
+    return row["id"]
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Export appointments and treatments.")
+    parser.add_argument("--format", choices=sorted(FORMATS), default="csv")
+    parser.add_argument("--status", choices=STATUSES)
+    parser.add_argument("--doctor", help="doctor profile id")
+    parser.add_argument("--department", help="department id or name")
+    parser.add_argument("--from", dest="date_from", type=iso_date)
+    parser.add_argument("--to", dest="date_to", type=iso_date)
+    parser.add_argument("--archived", action="store_true", help="include archived appointments")
+    parser.add_argument("--out", help="output file (default: stdout)")
+    args = parser.parse_args(argv[1:])
+
+    conn = get_db()
+    filters = {
+        "status": args.status,
+        "doctor_id": args.doctor,
+        "department_id": _department_id(conn, args.department),
+        "date_from": args.date_from,
+        "date_to": args.date_to,
+    }
+    out = open(args.out, "w", encoding="utf-8", newline="") if args.out else sys.stdout
+    try:
+        for chunk in export_chunks(conn, filters, args.format, args.archived):
+            out.write(chunk)
+    finally:
+        if args.out:
+            out.close()
+        conn.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
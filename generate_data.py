@@ -0,0 +1,369 @@
+# generate_data.py
+"""
+Synthetic data generator for performance work.
+
+Runs demo.seed_demo_data() first (so the demo logins keep working), then
+bulk loads doctors, patients, open slots, appointments and treatments on top.
+Scale 1 is 100 doctors, 10,000 patients and 200,000 appointments; scale 100
+gives 10k doctors, 1M patients and 20M appointments.
+
+Output is deterministic for a given --seed and --today. Loading is built for
+speed rather than safety, so point it at a scratch database:
+    - synchronous = OFF and foreign key checks off while loading
+    - secondary indexes and triggers are dropped first and recreated at the
+      end; dashboard counters, the search index and the doctor/patient
+      summaries are rebuilt once
+    - rows go in with executemany, in batches, in primary key order
+
+Every generated user has the password "password123".
+
+Usage:
+    python generate_data.py [--scale N] [--seed N] [--db PATH] [--today YYYY-MM-DD]
+"""
+import argparse
+import random
+import sys
+import time
+from datetime import date, datetime, timedelta
+
+from werkzeug.security import generate_password_hash
+
+import db
+
+BASE_DOCTORS = 100
+BASE_PATIENTS = 10_000
+BASE_APPOINTMENTS = 200_000
+HISTORY_DAYS = 730
+FUTURE_DAYS = 14
+BATCH_SIZE = 50_000
+PASSWORD = "password123"
+
+# Weekday clinic hours: 09:00-12:45 and 14:00-16:45 in 15 minute slots.
+SLOT_TIMES = [f"{h:02d}:{m:02d}" for h in (9, 10, 11, 12, 14, 15, 16) for m in (0, 15, 30, 45)]
+
+# Tables whose secondary indexes and triggers are rebuilt after the load.
+LOADED_TABLES = (
+    "users", "doctor_profiles", "patient_profiles",
+    "doctor_availability", "appointments", "treatments",
+)
+
+DEPARTMENTS = {
+    "Cardiology": ("Interventional Cardiologist", "Cardiac Electrophysiologist"),
+    "Neurology": ("Neurologist", "Neurophysiologist"),
+    "Orthopedics": ("Orthopedic Surgeon", "Sports Medicine Specialist"),
+    "Pediatrics": ("Pediatrician", "Neonatologist"),
+    "Dermatology": ("Dermatologist", "Cosmetic Dermatologist"),
+    "General Medicine": ("General Physician", "Internist"),
+    "ENT": ("Otolaryngologist",),
+    "Ophthalmology": ("Ophthalmologist", "Retina Specialist"),
+    "Psychiatry": ("Psychiatrist",),
+    "Gynecology": ("Gynecologist", "Obstetrician"),
+}
+
+FIRST_NAMES = (
+    "Aarav", "Aditi", "Alice", "Arjun", "Brian", "Chen", "Divya", "Elena", "Farah", "George",
+    "Hana", "Ishaan", "James", "Kavya", "Leo", "Maya", "Nikhil", "Olivia", "Priya", "Quinn",
+    "Rahul", "Sara", "Tomas", "Uma", "Vikram", "Wei", "Xavier", "Yara", "Zoe", "Meera",
+)
+LAST_NAMES = (
+    "Sharma", "Patel", "Smith", "Iyer", "Garcia", "Khan", "Nair", "Brown", "Reddy", "Lee",
+    "Gupta", "Wilson", "Menon", "Lopez", "Das", "Taylor", "Rao", "Martin", "Bose", "Clark",
+)
+STREETS = ("Main Street", "Park Lane", "MG Road", "Lake View", "Hill Road", "Station Road")
+DIAGNOSES = (
+    ("Hypertension, well controlled", "Amlodipine 5mg once daily"),
+    ("Migraine without aura", "Paracetamol + lifestyle changes"),
+    ("Seasonal allergic rhinitis", "Cetirizine 10mg at night"),
+    ("Type 2 diabetes", "Metformin 500mg twice daily"),
+    ("Lower back strain", "Physiotherapy, ibuprofen as needed"),
+    ("Viral fever", "Rest, fluids, paracetamol"),
+    ("Atopic dermatitis", "Emollients, hydrocortisone 1% cream"),
+)
+
+
+def _name(rng):
+    return f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}"
+
+
+def _phone(rng):
+    return f"9{rng.randrange(10 ** 9):09d}"
+
+
+def _next_id(cur, table):
+    cur.execute(f"SELECT COALESCE(MAX(id), 0) + 1 FROM {table}")
+    return cur.fetchone()[0]
+
+
+def _insert(conn, sql, rows):
+    """executemany in batches, one transaction per batch."""
+    batch = []
+    total = 0
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= BATCH_SIZE:
+            conn.executemany(sql, batch)
+            conn.commit()
+            total += len(batch)
+            batch.clear()
+    if batch:
+        conn.executemany(sql, batch)
+        conn.commit()
+        total += len(batch)
+    return total
+
+
+def drop_secondary(conn):
+    """Drop secondary indexes and triggers on the loaded tables; return their SQL."""
+    placeholders = ",".join("?" * len(LOADED_TABLES))
+    cur = conn.execute(
+        f"""
+        SELECT type, name, sql FROM sqlite_master
+        WHERE type IN ('index', 'trigger') AND sql IS NOT NULL
+          AND tbl_name IN ({placeholders})
+        """,
+        LOADED_TABLES,
+    )
+    saved = cur.fetchall()
+    for row in saved:
+        conn.execute(f"DROP {row['type'].upper()} {row['name']}")
+    conn.commit()
+    return [row["sql"] for row in saved]
+
+
+def restore_secondary(conn, statements):
+    from cache import bump
+    from counters import rebuild_counters
+    from search import rebuild_search_index
+    from summaries import rebuild_summaries
+
+    for sql in statements:
+        conn.execute(sql)
+    conn.commit()
+    rebuild_counters(conn)
+    rebuild_search_index(conn)
+    rebuild_summaries(conn)
+    # The generation triggers were dropped for the load too.
+    bump(conn)
+    conn.execute("ANALYZE")
+    conn.commit()
+
+
+def _departments(conn):
+    cur = conn.cursor()
+    for name in DEPARTMENTS:
+        cur.execute(
+            "INSERT INTO departments (name) VALUES (?) ON CONFLICT (name) DO NOTHING", (name,)
+        )
+    conn.commit()
+    cur.execute("SELECT id, name FROM departments")
+    return [(row["id"], DEPARTMENTS.get(row["name"], ("General Physician",))) for row in cur.fetchall()]
+
+
+def generate(conn, scale=1.0, seed=42, today=None):
+    """Bulk load the synthetic rows. Returns {table: rows inserted}."""
+    rng = random.Random(seed)
+    today = today or date.today()
+    n_doctors = max(1, int(BASE_DOCTORS * scale))
+    n_patients = max(1, int(BASE_PATIENTS * scale))
+    n_appointments = int(BASE_APPOINTMENTS * scale)
+
+    departments = _departments(conn)
+    cur = conn.cursor()
+    first_user = _next_id(cur, "users")
+    first_doctor = _next_id(cur, "doctor_profiles")
+    first_patient = _next_id(cur, "patient_profiles")
+    first_appointment = _next_id(cur, "appointments")
+    first_treatment = _next_id(cur, "treatments")
+    password_hash = generate_password_hash(PASSWORD)
+    counts = {}
+
+    # Users: doctors first, then patients, with explicit ids.
+    counts["users"] = _insert(
+        conn,
+        "INSERT INTO users (id, email, password_hash, role, status) VALUES (?, ?, ?, ?, ?)",
+        (
+            (
+                first_user + i,
+                f"doctor{i}@synthetic.hms" if i < n_doctors else f"patient{i - n_doctors}@synthetic.hms",
+                password_hash,
+                "doctor" if i < n_doctors else "patient",
+                "active" if rng.random() > 0.002 else "blacklisted",
+            )
+            for i in range(n_doctors + n_patients)
+        ),
+    )
+
+    doctor_departments = [rng.choice(departments) for _ in range(n_doctors)]
+    counts["doctor_profiles"] = _insert(
+        conn,
+        """
+        INSERT INTO doctor_profiles (id, user_id, department_id, name, specialization, phone, bio)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+        """,
+        (
+            (
+                first_doctor + i,
+                first_user + i,
+                dept_id,
+                f"Dr. {_name(rng)}",
+                rng.choice(specializations),
+                _phone(rng),
+                f"{rng.randint(2, 30)} years of clinical experience.",
+            )
+            for i, (dept_id, specializations) in enumerate(doctor_departments)
+        ),
+    )
+
+    counts["patient_profiles"] = _insert(
+        conn,
+        """
+        INSERT INTO patient_profiles
+          (id, user_id, name, age, gender, phone, address, emergency_contact)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        """,
+        (
+            (
+                first_patient + i,
+                first_user + n_doctors + i,
+                _name(rng),
+                int(rng.triangular(0, 95, 38)),
+                rng.choice(("Male", "Female", "Female", "Male", "Other")),
+                _phone(rng),
+                f"{rng.randint(1, 999)} {rng.choice(STREETS)}",
+                f"{_name(rng)} - {_phone(rng)}",
+            )
+            for i in range(n_patients)
+        ),
+    )
+
+    # Weekday grid from HISTORY_DAYS ago to FUTURE_DAYS ahead.
+    days = [today + timedelta(days=offset) for offset in range(-HISTORY_DAYS, FUTURE_DAYS + 1)]
+    days = [d.isoformat() for d in days if d.weekday() < 5]
+    today_str = today.isoformat()
+    future_days = [d for d in days if d >= today_str]
+    per_day = len(SLOT_TIMES)
+
+    counts["doctor_availability"] = _insert(
+        conn,
+        "INSERT INTO doctor_availability (doctor_id, date, time, is_available) VALUES (?, ?, ?, 1)",
+        (
+            (first_doctor + i, day, slot)
+            for i in range(n_doctors)
+            for day in future_days
+            for slot in SLOT_TIMES
+        ),
+    )
+
+    treatments = []
+
+    def appointment_rows():
+        appointment_id = first_appointment
+        per_doctor, extra = divmod(n_appointments, n_doctors)
+        for i in range(n_doctors):
+            dept_id = doctor_departments[i][0]
+            wanted = min(per_doctor + (1 if i < extra else 0), len(days) * per_day)
+            for cell in sorted(rng.sample(range(len(days) * per_day), wanted)):
+                day = days[cell // per_day]
+                if day < today_str:
+                    r = rng.random()
+                    status = "Completed" if r < 0.80 else "Cancelled" if r < 0.95 else "Booked"
+                else:
+                    status = "Booked" if rng.random() < 0.9 else "Cancelled"
+                # Skewed so a minority of patients account for most visits.
+                patient_id = first_patient + int(n_patients * rng.random() ** 2)
+                booked_on = date.fromisoformat(day) - timedelta(days=rng.randint(1, 30))
+                yield (
+                    appointment_id,
+                    patient_id,
+                    first_doctor + i,
+                    dept_id,
+                    day,
+                    SLOT_TIMES[cell % per_day],
+                    status,
+                    f"{booked_on.isoformat()}T{rng.randint(7, 21):02d}:{rng.randint(0, 59):02d}:00",
+                )
+                if status == "Completed":
+                    diagnosis, prescription = rng.choice(DIAGNOSES)
+                    treatments.append((appointment_id, diagnosis, prescription))
+                    if len(treatments) >= BATCH_SIZE:
+                        _flush_treatments()
+                appointment_id += 1
+
+    treatment_count = [0]
+
+    def _flush_treatments():
+        conn.executemany(
+            """
+            INSERT INTO treatments (id, appointment_id, diagnosis, prescription, notes)
+            VALUES (?, ?, ?, ?, '')
+            """,
+            [
+                (first_treatment + treatment_count[0] + n, appointment_id, diagnosis, prescription)
+                for n, (appointment_id, diagnosis, prescription) in enumerate(treatments)
+            ],
+        )
+        treatment_count[0] += len(treatments)
+        treatments.clear()
+
+    counts["appointments"] = _insert(
+        conn,
+        """
+        INSERT INTO appointments
+          (id, patient_id, doctor_id, department_id, date, time, status, created_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        """,
+        appointment_rows(),
+    )
+    if treatments:
+        _flush_treatments()
+        conn.commit()
+    counts["treatments"] = treatment_count[0]
+    return counts
+
+
+def build(path, scale=1.0, seed=42, today=None):
+    """Create (or extend) the database at `path` with demo plus synthetic data."""
+    db.DB_PATH = path
+    from demo import seed_demo_data
+
+    db.init_db()
+    seed_demo_data()
+
+    started = time.perf_counter()
+    conn = db._connect(path)
+    conn.execute("PRAGMA foreign_keys = OFF")
+    conn.execute("PRAGMA synchronous = OFF")
+    conn.execute("PRAGMA cache_size = -262144")  # 256 MiB
+    conn.execute("PRAGMA temp_store = MEMORY")
+
+    deferred = drop_secondary(conn)
+    print(f"[Generate] Dropped {len(deferred)} indexes/triggers for the load.")
+    counts = generate(conn, scale, seed, today)
+    loaded = time.perf_counter()
+    for table, count in counts.items():
+        print(f"[Generate] {table}: {count} rows")
+    print(f"[Generate] Loaded in {loaded - started:.1f}s; rebuilding indexes, counters, search and summaries...")
+
+    restore_secondary(conn, deferred)
+    conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    conn.close()
+    print(
+        f"[Generate] Done in {time.perf_counter() - started:.1f}s "
+        f"({datetime.now().isoformat(timespec='seconds')})."
+    )
+    return counts
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Generate a large synthetic dataset.")
+    parser.add_argument("--scale", type=float, default=1.0)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--db", default=db.DB_PATH)
+    parser.add_argument("--today", type=date.fromisoformat, default=None)
+    args = parser.parse_args(argv[1:])
+    build(args.db, args.scale, args.seed, args.today)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,392 @@
+# metrics.py
+"""
+Per-request SQL and render-time metrics.
+
+Every pooled connection gets InstrumentedCursor as its cursor class (through
+db.connect_hooks). The cursor times each statement from execute() to the
+last fetch, counts the rows it returned and charges both to the current
+request. Template rendering is timed with Flask's before_render_template and
+template_rendered signals, so each request splits into DB, render and
+everything else.
+
+Totals are kept in memory per endpoint, together with latency histograms
+and the most expensive statements. They are served on /admin/metrics
+(HTML, admins only) and on /metrics in Prometheus text format. /metrics is
+only answered for METRICS_ALLOWED_IPS.
+"""
+import re
+import threading
+import time
+
+from flask import (
+    Response,
+    abort,
+    before_render_template,
+    current_app,
+    g,
+    has_request_context,
+    request,
+    template_rendered,
+)
+
+import db
+
+# Request latency buckets in seconds (Prometheus "le" bounds).
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+MAX_STATEMENTS = 200
+DEFAULT_ALLOWED_IPS = ("127.0.0.1", "::1")
+
+_WS_RE = re.compile(r"\s+")
+
+
+def normalize(sql):
+    return _WS_RE.sub(" ", sql).strip()
+
+
+class _Statement:
+    __slots__ = ("sql", "parameters", "connection", "seconds", "rows", "done")
+
+    def __init__(self, sql, parameters, connection):
+        self.sql = sql
+        self.parameters = parameters
+        self.connection = connection
+        self.seconds = 0.0
+        self.rows = 0
+        self.done = False
+
+
+class RequestSQL:
+    """Statements run while serving one request."""
+
+    def __init__(self):
+        self.statements = []
+        self.render_seconds = 0.0
+
+
+def _current_request_sql():
+    if has_request_context():
+        return g.get("request_sql")
+    return None
+
+
+class InstrumentedCursor(db.sqlite3.Cursor):
+    """
+    Cursor that charges execute and fetch time plus returned rows to the
+    current request. Outside a request it behaves like a plain cursor.
+    """
+
+    _statement = None
+
+    def _run(self, method, sql, parameters):
+        tracker = _current_request_sql()
+        if tracker is None:
+            return method(sql, parameters)
+        self._finish()
+        statement = _Statement(sql, parameters, self.connection)
+        tracker.statements.append(statement)
+        self._statement = statement
+        started = time.perf_counter()
+        try:
+            return method(sql, parameters)
+        finally:
+            statement.seconds += time.perf_counter() - started
+            if self.description is None:
+                # No result set: nothing left to fetch.
+                statement.rows = max(self.rowcount, 0)
+                self._finish()
+
+    def execute(self, sql, parameters=()):
+        return self._run(super().execute, sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self._run(super().executemany, sql, seq_of_parameters)
+
+    def _timed(self, statement, method, *args):
+        started = time.perf_counter()
+        try:
+            return method(*args)
+        finally:
+            statement.seconds += time.perf_counter() - started
+
+    def fetchone(self):
+        statement = self._statement
+        if statement is None:
+            return super().fetchone()
+        row = self._timed(statement, super().fetchone)
+        if row is None:
+            self._finish()
+        else:
+            statement.rows += 1
+        return row
+
+    def fetchmany(self, size=None):
+        statement = self._statement
+        if statement is None:
+            return super().fetchmany(size or self.arraysize)
+        rows = self._timed(statement, super().fetchmany, size or self.arraysize)
+        statement.rows += len(rows)
+        if not rows:
+            self._finish()
+        return rows
+
+    def fetchall(self):
+        statement = self._statement
+        if statement is None:
+            return super().fetchall()
+        rows = self._timed(statement, super().fetchall)
+        statement.rows += len(rows)
+        self._finish()
+        return rows
+
+    def __next__(self):
+        row = self.fetchone()
+        if row is None:
+            raise StopIteration
+        return row
+
+    def _finish(self):
+        statement = self._statement
+        self._statement = None
+        if statement is not None:
+            _statement_done(statement)
+
+
+def _statement_done(statement):
+    if statement.done:
+        return
+    statement.done = True
+    if not has_request_context():
+        return
+    listeners = current_app.extensions.get("statement_listeners")
+    if listeners:
+        endpoint = request.endpoint or "unknown"
+        for listener in listeners:
+            listener(endpoint, statement)
+
+
+def add_statement_listener(app, listener):
+    """
+    Call listener(endpoint, statement) for each statement `app`'s requests
+    finish, e.g. the slow-query log. The statement has sql, parameters,
+    seconds, rows and the connection it ran on.
+    """
+    listeners = app.extensions.setdefault("statement_listeners", [])
+    if listener not in listeners:
+        listeners.append(listener)
+
+
+def _instrument(conn):
+    conn.cursor_class = InstrumentedCursor
+
+
+class _EndpointStats:
+    __slots__ = ("requests", "seconds", "db_seconds", "render_seconds", "queries", "rows", "buckets")
+
+    def __init__(self):
+        self.requests = 0
+        self.seconds = 0.0
+        self.db_seconds = 0.0
+        self.render_seconds = 0.0
+        self.queries = 0
+        self.rows = 0
+        self.buckets = [0] * len(LATENCY_BUCKETS)
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._endpoints = {}
+        self._statements = {}  # normalized sql -> [count, seconds, max, rows, endpoints]
+
+    def record(self, endpoint, seconds, tracker):
+        with self._lock:
+            stats = self._endpoints.get(endpoint)
+            if stats is None:
+                stats = self._endpoints[endpoint] = _EndpointStats()
+            stats.requests += 1
+            stats.seconds += seconds
+            stats.render_seconds += tracker.render_seconds
+            stats.queries += len(tracker.statements)
+            for i, bound in enumerate(LATENCY_BUCKETS):
+                if seconds <= bound:
+                    stats.buckets[i] += 1
+            for statement in tracker.statements:
+                stats.db_seconds += statement.seconds
+                stats.rows += statement.rows
+                key = normalize(statement.sql)
+                entry = self._statements.get(key)
+                if entry is None:
+                    if len(self._statements) >= MAX_STATEMENTS:
+                        continue
+                    entry = self._statements[key] = [0, 0.0, 0.0, 0, set()]
+                entry[0] += 1
+                entry[1] += statement.seconds
+                entry[2] = max(entry[2], statement.seconds)
+                entry[3] += statement.rows
+                entry[4].add(endpoint)
+
+    def endpoints(self):
+        """Per-endpoint totals and averages, slowest total first."""
+        with self._lock:
+            rows = []
+            for name, s in self._endpoints.items():
+                n = s.requests or 1
+                rows.append({
+                    "endpoint": name,
+                    "requests": s.requests,
+                    "seconds": s.seconds,
+                    "avg_ms": s.seconds * 1000 / n,
+                    "db_ms": s.db_seconds * 1000 / n,
+                    "render_ms": s.render_seconds * 1000 / n,
+                    "other_ms": max(s.seconds - s.db_seconds - s.render_seconds, 0.0) * 1000 / n,
+                    "queries": s.queries / n,
+                    "rows": s.rows / n,
+                    "buckets": list(s.buckets),
+                    "db_seconds": s.db_seconds,
+                    "render_seconds": s.render_seconds,
+                    "query_count": s.queries,
+                })
+        rows.sort(key=lambda r: r["seconds"], reverse=True)
+        return rows
+
+    def statements(self, limit=20):
+        """Statements by total time spent in them."""
+        with self._lock:
+            rows = [
+                {
+                    "sql": sql,
+                    "count": count,
+                    "total_ms": seconds * 1000,
+                    "avg_ms": seconds * 1000 / count,
+                    "max_ms": worst * 1000,
+                    "rows": rows / count,
+                    "endpoints": sorted(endpoints),
+                }
+                for sql, (count, seconds, worst, rows, endpoints) in self._statements.items()
+            ]
+        rows.sort(key=lambda r: r["total_ms"], reverse=True)
+        return rows[:limit]
+
+    def reset(self):
+        with self._lock:
+            self._endpoints.clear()
+            self._statements.clear()
+
+
+def _label(value):
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def prometheus_text(registry, pools=None, cache=None):
+    """
+    Registry, pool stats ({pool name: stats}) and query cache hits and
+    misses ({region: (hits, misses)}) in Prometheus text format.
+    """
+    lines = [
+        "# HELP hms_request_duration_seconds Request latency by endpoint.",
+        "# TYPE hms_request_duration_seconds histogram",
+    ]
+    endpoints = registry.endpoints()
+    for e in endpoints:
+        label = f'endpoint="{_label(e["endpoint"])}"'
+        for bound, count in zip(LATENCY_BUCKETS, e["buckets"]):
+            lines.append(f'hms_request_duration_seconds_bucket{{{label},le="{bound}"}} {count}')
+        lines.append(f'hms_request_duration_seconds_bucket{{{label},le="+Inf"}} {e["requests"]}')
+        lines.append(f"hms_request_duration_seconds_sum{{{label}}} {e['seconds']:.6f}")
+        lines.append(f"hms_request_duration_seconds_count{{{label}}} {e['requests']}")
+
+    for name, key, help_text in (
+        ("hms_db_seconds_total", "db_seconds", "Time spent in SQL statements."),
+        ("hms_render_seconds_total", "render_seconds", "Time spent rendering templates."),
+        ("hms_db_queries_total", "query_count", "SQL statements executed."),
+    ):
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} counter")
+        for e in endpoints:
+            value = e[key]
+            value = f"{value:.6f}" if isinstance(value, float) else value
+            lines.append(f'{name}{{endpoint="{_label(e["endpoint"])}"}} {value}')
+
+    pools = {name: stats for name, stats in (pools or {}).items() if stats}
+    if pools:
+        for key in ("size", "open", "idle"):
+            lines.append(f"# TYPE hms_db_pool_{key} gauge")
+            for name, stats in pools.items():
+                lines.append(f'hms_db_pool_{key}{{pool="{name}"}} {stats[key]}')
+        lines.append("# TYPE hms_db_pool_waits_total counter")
+        for name, stats in pools.items():
+            lines.append(f'hms_db_pool_waits_total{{pool="{name}"}} {stats["waits"]}')
+
+    if cache:
+        for name, index in (("hms_cache_hits_total", 0), ("hms_cache_misses_total", 1)):
+            lines.append(f"# TYPE {name} counter")
+            for region, counts in cache.items():
+                lines.append(f'{name}{{region="{_label(region)}"}} {counts[index]}')
+    return "\n".join(lines) + "\n"
+
+
+def get_registry():
+    return current_app.extensions["metrics"]
+
+
+def _start_request():
+    g.request_sql = RequestSQL()
+    g.request_started = time.perf_counter()
+
+
+def _finish_request(exc=None):
+    tracker = g.pop("request_sql", None)
+    started = g.pop("request_started", None)
+    if tracker is None or started is None:
+        return
+    # Statements whose results were never read to the end.
+    for statement in tracker.statements:
+        _statement_done(statement)
+    current_app.extensions["metrics"].record(
+        request.endpoint or "unknown", time.perf_counter() - started, tracker
+    )
+
+
+def _render_started(sender, template, context, **extra):
+    if has_request_context():
+        g.render_started = time.perf_counter()
+
+
+def _render_finished(sender, template, context, **extra):
+    if not has_request_context():
+        return
+    tracker = g.get("request_sql")
+    started = g.pop("render_started", None)
+    if tracker is not None and started is not None:
+        tracker.render_seconds += time.perf_counter() - started
+
+
+def prometheus_view():
+    allowed = current_app.config["METRICS_ALLOWED_IPS"]
+    if allowed is not None and request.remote_addr not in allowed:
+        abort(404)
+    pools = {
+        "write": db.pool_stats(current_app),
+        "read": db.pool_stats(current_app, "db_read_pool"),
+    }
+    cache = current_app.extensions.get("cache")
+    text = prometheus_text(get_registry(), pools, cache.region_stats() if cache else None)
+    return Response(text, mimetype="text/plain; version=0.0.4")
+
+
+def init_app(app):
+    """
+    Instrument pooled connections and start collecting per-endpoint metrics.
+    METRICS_ALLOWED_IPS limits who may read /metrics (None allows anyone).
+    """
+    app.config.setdefault("METRICS_ALLOWED_IPS", DEFAULT_ALLOWED_IPS)
+    app.extensions["metrics"] = MetricsRegistry()
+    if _instrument not in db.connect_hooks:
+        db.connect_hooks.append(_instrument)
+    # Connections opened before this point keep the plain cursor otherwise.
+    db.close_pools(app)
+    app.before_request(_start_request)
+    app.teardown_request(_finish_request)
+    before_render_template.connect(_render_started, app)
+    template_rendered.connect(_render_finished, app)
+    app.add_url_rule("/metrics", "prometheus_metrics", prometheus_view)
@@ -0,0 +1,380 @@
+# migrations.py
+"""
+Numbered schema migrations, keyed on PRAGMA user_version.
+
+The database records the last migration applied in its header
+(PRAGMA user_version). Startup reads that one number and applies only the
+migrations above it, so a current database costs a single PRAGMA instead of
+re-running schema.sql. Migration 1 is the baseline: schema.sql plus the
+backfills that used to run on every start. It only uses IF NOT EXISTS and
+drop-and-recreate, so it's safe on databases created before versioning
+(user_version 0). Schema changes from now on are new migrations at the end
+of MIGRATIONS; schema.sql stays as the baseline.
+
+Each migration runs in its own BEGIN IMMEDIATE transaction, which also bumps
+user_version. The version is re-read once the write lock is held, so when
+several workers start at once only the first applies it; the others find
+it already done.
+
+A migration marked online only adds indexes the code can do without. By
+default they run in the foreground like the rest. With
+MIGRATE_ONLINE_IN_BACKGROUND, trailing online migrations are left to a
+background thread and the app serves requests straight away. WAL readers
+carry on during the build, but the build holds the write lock throughout,
+and writers only wait for it for the 10s busy timeout before failing.
+Indexing 1M appointments takes about 1.2s here, so at around 8M rows a
+booking made during the build fails. Run `migrations.py migrate` before
+starting the app on anything near that size. Scripts and
+`migrations.py migrate` always run everything in the foreground.
+
+Usage:
+    python migrations.py status                   # current version and pending migrations
+    python migrations.py migrate                  # apply every pending migration now
+    python migrations.py bench [workers] [runs]   # startup cost: schema.sql vs user_version
+"""
+import os
+import sqlite3
+import subprocess
+import sys
+import threading
+import time
+
+import db
+
+
+class Migration:
+    """One numbered schema change: `sql` (a script) or `run(conn)`."""
+
+    def __init__(self, version, name, sql=None, run=None, online=False):
+        self.version = version
+        self.name = name
+        self.sql = sql
+        self.run = run
+        self.online = online
+
+
+def statements(script):
+    """Split an SQL script into complete statements (CREATE TRIGGER bodies included)."""
+    current = ""
+    for line in script.splitlines(keepends=True):
+        current += line
+        if sqlite3.complete_statement(current):
+            yield current.strip()
+            current = ""
+
+
+def _execute_script(conn, script):
+    # executescript() would COMMIT first; run statement by statement inside
+    # the migration's transaction instead.
+    for statement in statements(script):
+        conn.execute(statement)
+
+
+def _baseline(conn):
+    from counters import ensure_counters
+    from search import ensure_search_index
+    from summaries import ensure_summaries
+
+    with open(db.SCHEMA_FILE, "r", encoding="utf-8") as f:
+        _execute_script(conn, f.read())
+    # The backfills run inside apply()'s transaction, so the baseline and
+    # its version bump commit together.
+    ensure_counters(conn, commit=False)
+    ensure_search_index(conn, commit=False)
+    ensure_summaries(conn, commit=False)
+
+
+def _cache_generations(tables):
+    """cache_generations and the triggers that bump a table's row on every change (cache.py)."""
+    script = """
+    CREATE TABLE IF NOT EXISTS cache_generations (
+        name TEXT PRIMARY KEY,
+        generation INTEGER NOT NULL DEFAULT 0
+    ) WITHOUT ROWID;
+    """
+    for table in tables:
+        script += f"INSERT OR IGNORE INTO cache_generations (name) VALUES ('{table}');\n"
+        for event in ("INSERT", "UPDATE", "DELETE"):
+            script += f"""
+            DROP TRIGGER IF EXISTS trg_gen_{table}_{event.lower()};
+            CREATE TRIGGER trg_gen_{table}_{event.lower()} AFTER {event} ON {table}
+            BEGIN
+                UPDATE cache_generations SET generation = generation + 1 WHERE name = '{table}';
+            END;
+            """
+    return script
+
+
+MIGRATIONS = (
+    Migration(1, "baseline: schema.sql, counters, search index, summaries", run=_baseline),
+    Migration(
+        2,
+        "index appointments by department and date (department exports)",
+        sql="""
+        CREATE INDEX IF NOT EXISTS idx_appointments_department_date_time
+            ON appointments (department_id, date, time);
+        """,
+        online=True,
+    ),
+    Migration(
+        3,
+        "cache generations for departments and doctor profiles",
+        # Not doctor_availability or appointments: see cache.py.
+        sql=_cache_generations(("departments", "doctor_profiles")),
+    ),
+    Migration(
+        4,
+        "index doctors by department (reference data registry)",
+        sql="""
+        CREATE INDEX IF NOT EXISTS idx_doctor_profiles_department
+            ON doctor_profiles (department_id);
+        """,
+        online=True,
+    ),
+    Migration(
+        5,
+        "cache generations for users and patient profiles (session principals)",
+        # Only changes to what an identity holds; inserts can't invalidate one.
+        sql="""
+        INSERT OR IGNORE INTO cache_generations (name) VALUES ('users'), ('patient_profiles');
+        DROP TRIGGER IF EXISTS trg_gen_users_update;
+        CREATE TRIGGER trg_gen_users_update AFTER UPDATE OF email, role, status ON users
+        BEGIN
+            UPDATE cache_generations SET generation = generation + 1 WHERE name = 'users';
+        END;
+        DROP TRIGGER IF EXISTS trg_gen_users_delete;
+        CREATE TRIGGER trg_gen_users_delete AFTER DELETE ON users
+        BEGIN
+            UPDATE cache_generations SET generation = generation + 1 WHERE name = 'users';
+        END;
+        DROP TRIGGER IF EXISTS trg_gen_patient_profiles_update;
+        CREATE TRIGGER trg_gen_patient_profiles_update AFTER UPDATE ON patient_profiles
+        BEGIN
+            UPDATE cache_generations SET generation = generation + 1 WHERE name = 'patient_profiles';
+        END;
+        DROP TRIGGER IF EXISTS trg_gen_patient_profiles_delete;
+        CREATE TRIGGER trg_gen_patient_profiles_delete AFTER DELETE ON patient_profiles
+        BEGIN
+            UPDATE cache_generations SET generation = generation + 1 WHERE name = 'patient_profiles';
+        END;
+        """,
+    ),
+    Migration(
+        6,
+        "import_jobs: bulk imports run in the background (bulk_import.py)",
+        sql="""
+        CREATE TABLE IF NOT EXISTS import_jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            filename TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'running',   -- running | done | failed
+            rows INTEGER NOT NULL DEFAULT 0,
+            doctors INTEGER NOT NULL DEFAULT 0,
+            patients INTEGER NOT NULL DEFAULT 0,
+            error_count INTEGER NOT NULL DEFAULT 0,
+            errors TEXT NOT NULL DEFAULT '[]',        -- JSON [[line, message], ...]
+            message TEXT,                             -- why a failed job stopped
+            started_at TEXT NOT NULL,
+            finished_at TEXT
+        );
+        """,
+    ),
+)
+LATEST = MIGRATIONS[-1].version
+
+
+def current_version(conn):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def pending(conn):
+    version = current_version(conn)
+    return [m for m in MIGRATIONS if m.version > version]
+
+
+def apply(conn, migration):
+    """
+    Apply one migration and bump user_version in the same transaction.
+    Returns False if another process got there first.
+    """
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        if current_version(conn) >= migration.version:
+            conn.rollback()
+            return False
+        if migration.run is not None:
+            migration.run(conn)
+        else:
+            _execute_script(conn, migration.sql)
+        # PRAGMA takes no parameters; the version is an int from MIGRATIONS.
+        conn.execute(f"PRAGMA user_version = {int(migration.version)}")
+        conn.commit()
+    except BaseException:
+        if conn.in_transaction:
+            conn.rollback()
+        raise
+    return True
+
+
+def migrate(conn, defer_online=False):
+    """
+    Apply the pending migrations in order. With defer_online, trailing
+    online migrations are skipped and returned for the caller to run
+    later (see run_in_background); otherwise returns an empty list.
+    """
+    todo = pending(conn)
+    deferred = []
+    if defer_online:
+        while todo and todo[-1].online:
+            deferred.insert(0, todo.pop())
+    for migration in todo:
+        if apply(conn, migration):
+            print(f"[Migrate] Applied {migration.version}: {migration.name}")
+    return deferred
+
+
+def run_in_background(path, migrations):
+    """Apply `migrations` on their own connection in a daemon thread; returns the thread."""
+
+    def work():
+        conn = db._connect(path)
+        try:
+            for migration in migrations:
+                started = time.perf_counter()
+                if apply(conn, migration):
+                    print(
+                        f"[Migrate] Applied {migration.version} online in "
+                        f"{time.perf_counter() - started:.1f}s: {migration.name}"
+                    )
+        finally:
+            conn.close()
+
+    thread = threading.Thread(target=work, name="online-migrations", daemon=True)
+    thread.start()
+    return thread
+
+
+def init_app(app):
+    """
+    MIGRATE_ON_START brings the database up to date when the app is created
+    (default True). With MIGRATE_ONLINE_IN_BACKGROUND (default False),
+    trailing online migrations run on a background thread instead of
+    delaying startup; writes wait on them meanwhile (see above).
+    """
+    app.config.setdefault("MIGRATE_ON_START", True)
+    app.config.setdefault("MIGRATE_ONLINE_IN_BACKGROUND", False)
+    if not app.config["MIGRATE_ON_START"]:
+        return
+    deferred = db.init_db(defer_online=app.config["MIGRATE_ONLINE_IN_BACKGROUND"])
+    if deferred:
+        app.extensions["online_migrations"] = run_in_background(db.DB_PATH, deferred)
+
+
+def _legacy_startup(conn):
+    """What every process start did before versioning: all of schema.sql plus the checks."""
+    from counters import ensure_counters
+    from search import ensure_search_index
+    from summaries import ensure_summaries
+
+    with open(db.SCHEMA_FILE, "r", encoding="utf-8") as f:
+        conn.executescript(f.read())
+    conn.commit()
+    ensure_counters(conn)
+    ensure_search_index(conn)
+    ensure_summaries(conn)
+
+
+def _startup_child(path, mode):
+    """Child process: open the database and do one startup's schema work."""
+    db.DB_PATH = path
+    started = time.perf_counter()
+    conn = db._connect(path)
+    failed = False
+    try:
+        if mode == "legacy":
+            _legacy_startup(conn)
+        else:
+            migrate(conn, defer_online=True)
+    except sqlite3.Error:
+        failed = True
+    conn.close()
+    return time.perf_counter() - started, failed
+
+
+def bench(path, workers=8, runs=5):
+    """
+    Start `workers` processes at once, each doing one startup's schema work,
+    the old way (schema.sql) and via user_version on an up-to-date database.
+    Returns {mode: (mean ms per process, worst ms, processes that failed)}.
+    """
+    conn = db._connect(path)
+    for migration in pending(conn):
+        apply(conn, migration)
+    conn.close()
+
+    results = {}
+    for mode in ("legacy", "versioned"):
+        timings = []
+        failures = 0
+        for _ in range(runs):
+            procs = [
+                subprocess.Popen(
+                    [sys.executable, os.path.abspath(__file__), "_startup", path, mode],
+                    stdout=subprocess.PIPE,
+                    text=True,
+                )
+                for _ in range(workers)
+            ]
+            for proc in procs:
+                out, _ = proc.communicate()
+                seconds, failed = out.split()
+                timings.append(float(seconds))
+                failures += failed == "1"
+        results[mode] = (sum(timings) * 1000 / len(timings), max(timings) * 1000, failures)
+    return results
+
+
+def main(argv):
+    command = argv[1] if len(argv) > 1 else "status"
+    if command == "_startup":
+        seconds, failed = _startup_child(argv[2], argv[3])
+        print(seconds, int(failed))
+        return 0
+
+    if command == "bench":
+        workers = int(argv[2]) if len(argv) > 2 else 8
+        runs = int(argv[3]) if len(argv) > 3 else 5
+        results = bench(db.DB_PATH, workers, runs)
+        print(f"[Migrate] {workers} processes starting at once, {runs} runs:")
+        for mode, (mean_ms, worst_ms, failures) in results.items():
+            print(
+                f"[Migrate] {mode:10} mean {mean_ms:8.1f} ms   worst {worst_ms:8.1f} ms   "
+                f"failed {failures}/{workers * runs}"
+            )
+        return 0
+
+    if command == "status" and not os.path.exists(db.DB_PATH):
+        print(f"[Migrate] {db.DB_PATH} doesn't exist yet; it's created at version {LATEST}.")
+        return 0
+
+    if command == "migrate":
+        # Before opening a connection: init_db seeds the admin only when it
+        # creates the file.
+        db.init_db()
+    elif command != "status":
+        print(__doc__)
+        return 2
+
+    conn = db._connect()
+    if command == "status":
+        print(f"[Migrate] {db.DB_PATH} is at version {current_version(conn)} (latest {LATEST}).")
+        for migration in pending(conn):
+            kind = "online" if migration.online else "blocking"
+            print(f"[Migrate] pending {migration.version} ({kind}): {migration.name}")
+    else:
+        print(f"[Migrate] {db.DB_PATH} is at version {current_version(conn)}.")
+    conn.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,264 @@
+# passwords.py
+"""
+Password hashing off the request thread.
+
+Hashes are computed in a small process pool, so a burst of logins uses at
+most PASSWORD_HASH_WORKERS cores and the request threads only wait on a
+future. Workers are started through a forkserver (spawn where there is
+none): forking the threaded server process directly could copy a lock
+held by another thread and deadlock the child. A semaphore bounds the
+number of hashes queued or running; when the queue is full for
+PASSWORD_HASH_TIMEOUT seconds HashingBusy is raised instead of letting
+logins pile up behind each other.
+
+The work factor is PASSWORD_HASH_METHOD, a werkzeug method string such as
+"scrypt:32768:8:1" or "pbkdf2:sha256:600000"; shorthands like "scrypt" get
+werkzeug's defaults. A stored hash made with other parameters still
+verifies, and the login route re-hashes it with the current method after a
+successful login (see needs_rehash).
+
+Time spent hashing is added to the response as a Server-Timing "pwhash"
+entry and totalled in stats().
+
+Usage:
+    python passwords.py bench [method] [rounds]   # time one hash per method
+"""
+import multiprocessing
+import sys
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from flask import current_app, g, has_app_context
+from werkzeug.security import (
+    DEFAULT_PBKDF2_ITERATIONS,
+    check_password_hash,
+    generate_password_hash,
+)
+
+DEFAULT_METHOD = "scrypt:32768:8:1"
+DEFAULT_WORKERS = 2
+DEFAULT_QUEUE = 32
+DEFAULT_TIMEOUT = 10.0
+
+
+class HashingBusy(RuntimeError):
+    """Raised when the hashing queue stays full for the whole timeout."""
+
+
+def normalize_method(method):
+    """
+    The method with werkzeug's defaults filled in, as it appears in the
+    prefix of a stored hash: "scrypt" -> "scrypt:32768:8:1",
+    "pbkdf2:sha256" -> "pbkdf2:sha256:1000000". Other methods are returned
+    unchanged.
+    """
+    name, *args = method.split(":")
+    if name == "scrypt" and not args:
+        args = [str(2**15), "8", "1"]
+    elif name == "pbkdf2":
+        args += ["sha256", str(DEFAULT_PBKDF2_ITERATIONS)][len(args):]
+    return ":".join([name] + args)
+
+
+def _stale_hash(password_hash, method):
+    return normalize_method(password_hash.split("$", 1)[0]) != normalize_method(method)
+
+
+def _mp_context():
+    methods = multiprocessing.get_all_start_methods()
+    return multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+
+
+def _hash(password, method):
+    return generate_password_hash(password, method=method)
+
+
+def _check(password_hash, password):
+    return check_password_hash(password_hash, password)
+
+
+class PasswordHasher:
+    """
+    Bounded process pool for password hashes.
+
+    init_app creates the pool; worker processes start on the first hash,
+    so importing the app or running a CLI never starts ones it doesn't need.
+    """
+
+    def __init__(self, method=DEFAULT_METHOD, workers=DEFAULT_WORKERS,
+                 queue_size=DEFAULT_QUEUE, timeout=DEFAULT_TIMEOUT):
+        self.method = method
+        self.workers = workers
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(queue_size)
+        self._lock = threading.Lock()
+        self._pool = None
+        self.calls = 0
+        self.bulk_calls = 0
+        self.busy = 0
+        self.seconds_total = 0.0
+        self.seconds_max = 0.0
+
+    def _executor(self):
+        with self._lock:
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=_mp_context())
+            return self._pool
+
+    def start(self):
+        self._executor()
+
+    def _run(self, fn, *args):
+        if not self._slots.acquire(timeout=self.timeout):
+            with self._lock:
+                self.busy += 1
+            raise HashingBusy(f"password hashing queue full after {self.timeout}s")
+        start = time.perf_counter()
+        try:
+            return self._executor().submit(fn, *args).result()
+        finally:
+            self._slots.release()
+            self._record(time.perf_counter() - start)
+
+    def _record(self, seconds):
+        with self._lock:
+            self.calls += 1
+            self.seconds_total += seconds
+            if seconds > self.seconds_max:
+                self.seconds_max = seconds
+        if has_app_context():
+            g.pwhash_seconds = g.get("pwhash_seconds", 0.0) + seconds
+
+    def hash(self, password):
+        return self._run(_hash, password, self.method)
+
+    def verify(self, password_hash, password):
+        return self._run(_check, password_hash, password)
+
+    def hash_many(self, passwords):
+        """
+        Hashes of `passwords`, in order, for bulk imports. At most one hash
+        per worker is in the pool's queue at a time, so a login waits
+        behind at most that many import hashes, not the whole batch.
+        """
+        pool = self._executor()
+        in_flight = deque()
+        hashes = []
+        for password in passwords:
+            if len(in_flight) >= self.workers:
+                hashes.append(in_flight.popleft().result())
+            in_flight.append(pool.submit(_hash, password, self.method))
+        while in_flight:
+            hashes.append(in_flight.popleft().result())
+        with self._lock:
+            self.bulk_calls += len(hashes)
+        return hashes
+
+    def needs_rehash(self, password_hash):
+        """True if the stored hash was made with other parameters."""
+        return _stale_hash(password_hash, self.method)
+
+    def shutdown(self):
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "method": self.method,
+                "workers": self.workers,
+                "calls": self.calls,
+                "bulk_calls": self.bulk_calls,
+                "busy": self.busy,
+                "seconds_total": round(self.seconds_total, 3),
+                "avg_ms": round(self.seconds_total * 1000 / self.calls, 3) if self.calls else 0.0,
+                "max_ms": round(self.seconds_max * 1000, 3),
+            }
+
+
+def _hasher():
+    if has_app_context():
+        return current_app.extensions.get("password_hasher")
+    return None
+
+
+def current_method():
+    hasher = _hasher()
+    return hasher.method if hasher else DEFAULT_METHOD
+
+
+def hash_password(password):
+    """Hash with the app's pool, or in-process outside an app (scripts)."""
+    hasher = _hasher()
+    if hasher is None:
+        return _hash(password, DEFAULT_METHOD)
+    return hasher.hash(password)
+
+
+def verify_password(password_hash, password):
+    hasher = _hasher()
+    if hasher is None:
+        return _check(password_hash, password)
+    return hasher.verify(password_hash, password)
+
+
+def needs_rehash(password_hash):
+    hasher = _hasher()
+    if hasher is None:
+        return _stale_hash(password_hash, DEFAULT_METHOD)
+    return hasher.needs_rehash(password_hash)
+
+
+def _report_hash_time(response):
+    seconds = g.get("pwhash_seconds")
+    if seconds is not None:
+        response.headers.add("Server-Timing", f"pwhash;dur={seconds * 1000:.3f}")
+    return response
+
+
+def init_app(app):
+    """
+    Attach a hasher to the app. Configured by PASSWORD_HASH_METHOD,
+    PASSWORD_HASH_WORKERS, PASSWORD_HASH_QUEUE and PASSWORD_HASH_TIMEOUT.
+    """
+    app.config.setdefault("PASSWORD_HASH_METHOD", DEFAULT_METHOD)
+    app.config.setdefault("PASSWORD_HASH_WORKERS", DEFAULT_WORKERS)
+    app.config.setdefault("PASSWORD_HASH_QUEUE", DEFAULT_QUEUE)
+    app.config.setdefault("PASSWORD_HASH_TIMEOUT", DEFAULT_TIMEOUT)
+    hasher = PasswordHasher(
+        app.config["PASSWORD_HASH_METHOD"],
+        workers=app.config["PASSWORD_HASH_WORKERS"],
+        queue_size=app.config["PASSWORD_HASH_QUEUE"],
+        timeout=app.config["PASSWORD_HASH_TIMEOUT"],
+    )
+    hasher.start()
+    app.extensions["password_hasher"] = hasher
+    app.after_request(_report_hash_time)
+
+
+def main(argv):
+    if len(argv) < 2 or argv[1] != "bench":
+        print(__doc__)
+        return 2
+    methods = [argv[2]] if len(argv) > 2 else [
+        "scrypt:16384:8:1",
+        DEFAULT_METHOD,
+        "pbkdf2:sha256:260000",
+        "pbkdf2:sha256:600000",
+    ]
+    rounds = int(argv[3]) if len(argv) > 3 else 5
+    for method in methods:
+        start = time.perf_counter()
+        for _ in range(rounds):
+            _hash("correct horse battery staple", method)
+        per_hash = (time.perf_counter() - start) / rounds
+        print(f"[Passwords] {method}: {per_hash * 1000:.1f} ms per hash")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
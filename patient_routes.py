@@ -1,14 +1,24 @@
-from datetime import date, datetime, timedelta
+from datetime import date, timedelta
 import sqlite3
 
 from flask import render_template, request, redirect, url_for, flash
+from flask_login import current_user
 
+from archive import history_source
+from availability import FREE_SLOTS_SQL, get_engine
+from booking import BOOKED, NOT_FOUND, TAKEN, UNAVAILABLE, book, cancel, reschedule
+from cache import cached
 from db import get_db
+from reference import reference_data
+from search import fts_query
 from security import (
     role_required,
     get_doctor_profile_for_current_user,
     get_patient_profile_for_current_user,
+    invalidate_identity,
+    load_identity,
 )
+from writer import write
 
 
 def init_patient_routes(app):
@@ -25,8 +35,7 @@ def init_patient_routes(app):
         conn = get_db()
         cur = conn.cursor()
 
-        cur.execute("SELECT * FROM departments ORDER BY name")
-        departments = cur.fetchall()
+        departments = reference_data().departments
 
         cur.execute(
             """
@@ -40,12 +49,13 @@ def init_patient_routes(app):
         )
         upcoming = cur.fetchall()
 
+        # Archived visits are only read when the patient asks for full history.
+        deep_history = request.args.get("history") == "all"
         cur.execute(
-            """
-            SELECT a.*, d.name AS doctor_name, t.diagnosis, t.prescription
-            FROM appointments a
+            f"""
+            SELECT a.*, d.name AS doctor_name
+            FROM {history_source(conn, deep_history)} a
             JOIN doctor_profiles d ON a.doctor_id = d.id
-            LEFT JOIN treatments t ON t.appointment_id = a.id
             WHERE a.patient_id = ? AND a.date < ?
             ORDER BY a.date DESC, a.time DESC
             """,
@@ -60,6 +70,7 @@ def init_patient_routes(app):
             departments=departments,
             upcoming=upcoming,
             past=past,
+            deep_history=deep_history,
         )
 
     @app.route("/patient/profile", methods=["GET", "POST"])
@@ -70,12 +81,6 @@ def init_patient_routes(app):
             flash("Patient profile not found.", "danger")
             return redirect(url_for("logout"))
 
-        conn = get_db()
-        cur = conn.cursor()
-        cur.execute("SELECT email FROM users WHERE id = ?", (patient["user_id"],))
-        user_row = cur.fetchone()
-        email = user_row["email"] if user_row else ""
-
         if request.method == "POST":
             name = request.form.get("name", "").strip()
             age = request.form.get("age") or None
@@ -88,23 +93,26 @@ def init_patient_routes(app):
             if not name or not new_email:
                 flash("Name and email are required.", "danger")
             else:
-                cur.execute(
-                    """
-                    UPDATE patient_profiles
-                    SET name = ?, age = ?, gender = ?, phone = ?, address = ?, emergency_contact = ?
-                    WHERE id = ?
-                    """,
-                    (name, age, gender, phone, address, emergency_contact, patient["id"]),
-                )
-                cur.execute(
-                    "UPDATE users SET email = ? WHERE id = ?",
-                    (new_email, patient["user_id"]),
-                )
-                conn.commit()
+                def save(conn):
+                    conn.execute(
+                        """
+                        UPDATE patient_profiles
+                        SET name = ?, age = ?, gender = ?, phone = ?, address = ?, emergency_contact = ?
+                        WHERE id = ?
+                        """,
+                        (name, age, gender, phone, address, emergency_contact, patient["id"]),
+                    )
+                    conn.execute(
+                        "UPDATE users SET email = ? WHERE id = ?",
+                        (new_email, patient["user_id"]),
+                    )
+
+                write(save)
+                invalidate_identity(current_user.id)
                 flash("Profile updated.", "success")
 
-        conn.close()
         patient = get_patient_profile_for_current_user()
+        email = load_identity(current_user.id)["user"]["email"]
         return render_template("patient/profile.html", patient=patient, email=email)
 
     @app.route("/patient/doctors")
@@ -115,20 +123,23 @@ def init_patient_routes(app):
         conn = get_db()
         cur = conn.cursor()
 
-        base_query = """
-            SELECT d.*, dept.name AS department_name
-            FROM doctor_profiles d
-            LEFT JOIN departments dept ON d.department_id = dept.id
-        """
+        base_query = "SELECT d.* FROM doctor_profiles d"
         params = []
-        if q:
-            base_query += " WHERE d.name LIKE ? OR d.specialization LIKE ? OR dept.name LIKE ?"
-            like = f"%{q}%"
-            params = [like, like, like]
-
-        base_query += " ORDER BY d.name"
-        cur.execute(base_query, params)
-        doctors = cur.fetchall()
+        match = fts_query(q)
+        if match:
+            base_query += """
+                JOIN (
+                    SELECT rowid AS id, rank FROM doctor_search WHERE doctor_search MATCH ?
+                ) s ON s.id = d.id
+                ORDER BY s.rank, d.name
+            """
+            params = [match]
+        else:
+            base_query += " ORDER BY d.name"
+        doctors = cached(
+            "doctor_directory", match, ("doctor_profiles", "departments"),
+            lambda: cur.execute(base_query, params).fetchall(),
+        )
         conn.close()
         return render_template("patient/doctors_list.html", doctors=doctors, q=q)
 
@@ -139,16 +150,12 @@ def init_patient_routes(app):
         conn = get_db()
         cur = conn.cursor()
 
-        cur.execute(
-            """
-            SELECT d.*, dept.name AS department_name
-            FROM doctor_profiles d
-            LEFT JOIN departments dept ON d.department_id = dept.id
-            WHERE d.id = ?
-            """,
-            (doctor_id,),
+        doctor = cached(
+            "doctor", doctor_id, ("doctor_profiles",),
+            lambda: cur.execute(
+                "SELECT * FROM doctor_profiles WHERE id = ?", (doctor_id,)
+            ).fetchone(),
         )
-        doctor = cur.fetchone()
         if not doctor:
             conn.close()
             flash("Doctor not found.", "danger")
@@ -157,25 +164,15 @@ def init_patient_routes(app):
         today_str = date.today().isoformat()
         next_week_str = (date.today() + timedelta(days=7)).isoformat()
 
-        cur.execute(
-            """
-            SELECT da.date, da.time
-            FROM doctor_availability da
-            LEFT JOIN appointments a
-              ON a.doctor_id = da.doctor_id
-             AND a.date = da.date
-             AND a.time = da.time
-             AND a.status = 'Booked'
-            WHERE da.doctor_id = ?
-              AND da.is_available = 1
-              AND date(da.date) >= date(?)
-              AND date(da.date) <= date(?)
-              AND a.id IS NULL
-            ORDER BY da.date, da.time
-            """,
-            (doctor_id, today_str, next_week_str),
-        )
-        slots = cur.fetchall()
+        slots = get_engine().free_slots(conn, doctor_id, today_str, next_week_str)
+        if slots is None:
+            # Dates are stored as 'YYYY-MM-DD', so plain string comparison in
+            # FREE_SLOTS_SQL keeps the range on the availability index.
+            slots = cached(
+                "free_slots", (doctor_id, today_str, next_week_str),
+                ("doctor_availability", "appointments"),
+                lambda: cur.execute(FREE_SLOTS_SQL, (doctor_id, today_str, next_week_str)).fetchall(),
+            )
 
         patient = get_patient_profile_for_current_user()
         appointments = []
@@ -222,82 +219,20 @@ def init_patient_routes(app):
             flash("Patient profile not found.", "danger")
             return redirect(url_for("logout"))
 
-        conn = get_db()
-        cur = conn.cursor()
-
-        cur.execute(
-            """
-            SELECT da.id
-            FROM doctor_availability da
-            LEFT JOIN appointments a
-              ON a.doctor_id = da.doctor_id
-             AND a.date = da.date
-             AND a.time = da.time
-             AND a.status = 'Booked'
-            WHERE da.doctor_id = ?
-              AND da.date = ?
-              AND da.time = ?
-              AND da.is_available = 1
-              AND a.id IS NULL
-            """,
-            (doctor_id, date_str, time_str),
-        )
-        slot = cur.fetchone()
-        if not slot:
-            conn.close()
-            flash("Selected slot is no longer available. Please choose another.", "warning")
+        try:
+            result = write(book, patient["id"], doctor_id, date_str, time_str)
+        except sqlite3.OperationalError:
+            flash("The booking system is busy right now. Please try again.", "warning")
             return redirect(url_for("patient_doctor_availability", doctor_id=doctor_id))
 
-        created_at = datetime.now().isoformat(timespec="seconds")
-
-        cur.execute(
-            """
-            SELECT id FROM appointments
-            WHERE doctor_id = ? AND date = ? AND time = ?
-            """,
-            (doctor_id, date_str, time_str),
-        )
-        existing_appt = cur.fetchone()
-
-        if existing_appt:
-            cur.execute(
-                """
-                UPDATE appointments
-                SET patient_id = ?,
-                    department_id = (SELECT department_id FROM doctor_profiles WHERE id = ?),
-                    status = 'Booked',
-                    created_at = ?
-                WHERE id = ?
-                """,
-                (
-                    patient["id"],
-                    doctor_id,
-                    created_at,
-                    existing_appt["id"],
-                ),
-            )
-        else:
-            cur.execute(
-                """
-                INSERT INTO appointments (patient_id, doctor_id, department_id, date, time, status, created_at)
-                VALUES (
-                    ?, ?,
-                    (SELECT department_id FROM doctor_profiles WHERE id = ?),
-                    ?, ?, 'Booked', ?
-                )
-                """,
-                (
-                    patient["id"],
-                    doctor_id,
-                    doctor_id,
-                    date_str,
-                    time_str,
-                    created_at,
-                ),
-            )
+        if result != BOOKED:
+            if result == TAKEN:
+                flash("Sorry, someone else just booked that slot. Please choose another.", "warning")
+            else:
+                flash("Selected slot is no longer available. Please choose another.", "warning")
+            return redirect(url_for("patient_doctor_availability", doctor_id=doctor_id))
 
-        conn.commit()
-        conn.close()
+        get_engine().book(doctor_id, date_str, time_str)
 
         flash("Appointment booked successfully.", "success")
         return redirect(url_for("patient_dashboard"))
@@ -329,40 +264,22 @@ def init_patient_routes(app):
                 conn.close()
                 return redirect(url_for("book_appointment", doctor_id=doctor_id))
 
-            cur.execute(
-                """
-                SELECT id FROM doctor_availability
-                WHERE doctor_id = ? AND date = ? AND time = ? AND is_available = 1
-                """,
-                (doctor_id, date_str, time_str),
-            )
-            if not cur.fetchone():
-                flash("Selected slot is not available.", "warning")
+            try:
+                result = write(book, patient["id"], doctor_id, date_str, time_str)
+            except sqlite3.OperationalError:
                 conn.close()
+                flash("The booking system is busy right now. Please try again.", "warning")
                 return redirect(url_for("book_appointment", doctor_id=doctor_id))
+            conn.close()
 
-            cur.execute(
-                """
-                SELECT id FROM appointments
-                WHERE doctor_id = ? AND date = ? AND time = ?
-                """,
-                (doctor_id, date_str, time_str),
-            )
-            if cur.fetchone():
+            if result == UNAVAILABLE:
+                flash("Selected slot is not available.", "warning")
+                return redirect(url_for("book_appointment", doctor_id=doctor_id))
+            if result == TAKEN:
                 flash("This slot is already booked. Please choose another.", "warning")
-                conn.close()
                 return redirect(url_for("book_appointment", doctor_id=doctor_id))
 
-            created_at = datetime.now().isoformat(timespec="seconds")
-            cur.execute(
-                """
-                INSERT INTO appointments (patient_id, doctor_id, department_id, date, time, status, created_at)
-                VALUES (?, ?, ?, ?, ?, 'Booked', ?)
-                """,
-                (patient["id"], doctor_id, doctor["department_id"], date_str, time_str, created_at),
-            )
-            conn.commit()
-            conn.close()
+            get_engine().book(doctor_id, date_str, time_str)
             flash("Appointment booked successfully.", "success")
             return redirect(url_for("patient_dashboard"))
 
@@ -401,32 +318,21 @@ def init_patient_routes(app):
             flash("Patient profile not found.", "danger")
             return redirect(url_for("logout"))
 
-        conn = get_db()
-        cur = conn.cursor()
-        cur.execute(
-            """
-            SELECT id, status FROM appointments
-            WHERE id = ? AND patient_id = ?
-            """,
-            (appointment_id, patient["id"]),
-        )
-        appt = cur.fetchone()
-        if not appt:
-            conn.close()
-            flash("Appointment not found.", "danger")
+        try:
+            appt = write(cancel, appointment_id, patient["id"])
+        except sqlite3.OperationalError:
+            flash("The booking system is busy right now. Please try again.", "warning")
             return redirect(url_for("patient_appointments"))
 
-        if appt["status"] == "Cancelled":
+        if not appt:
+            flash("Appointment not found.", "danger")
+        elif appt["status"] == "Cancelled":
             flash("Appointment is already cancelled.", "info")
         else:
-            cur.execute(
-                "UPDATE appointments SET status = 'Cancelled' WHERE id = ?",
-                (appointment_id,),
-            )
-            conn.commit()
+            if appt["status"] == "Booked":
+                get_engine().release(appt["doctor_id"], appt["date"], appt["time"])
             flash("Appointment cancelled.", "success")
 
-        conn.close()
         return redirect(url_for("patient_appointments"))
 
     @app.route("/patient/appointments/<int:appointment_id>/reschedule", methods=["GET", "POST"])
@@ -463,40 +369,28 @@ def init_patient_routes(app):
                 conn.close()
                 return redirect(url_for("reschedule_appointment", appointment_id=appointment_id))
 
-            cur.execute(
-                """
-                SELECT id FROM doctor_availability
-                WHERE doctor_id = ? AND date = ? AND time = ? AND is_available = 1
-                """,
-                (appt["doctor_id"], date_str, time_str),
-            )
-            if not cur.fetchone():
-                flash("Selected slot is not available.", "warning")
+            try:
+                result = write(reschedule, appointment_id, patient["id"], date_str, time_str)
+            except sqlite3.OperationalError:
                 conn.close()
+                flash("The booking system is busy right now. Please try again.", "warning")
                 return redirect(url_for("reschedule_appointment", appointment_id=appointment_id))
+            conn.close()
 
-            cur.execute(
-                """
-                SELECT id FROM appointments
-                WHERE doctor_id = ? AND date = ? AND time = ? AND id != ?
-                """,
-                (appt["doctor_id"], date_str, time_str, appointment_id),
-            )
-            if cur.fetchone():
+            if result == UNAVAILABLE:
+                flash("Selected slot is not available.", "warning")
+                return redirect(url_for("reschedule_appointment", appointment_id=appointment_id))
+            if result == TAKEN:
                 flash("This slot is already booked. Please choose another.", "warning")
-                conn.close()
                 return redirect(url_for("reschedule_appointment", appointment_id=appointment_id))
-
-            cur.execute(
-                """
-                UPDATE appointments
-                SET date = ?, time = ?, status = 'Booked'
-                WHERE id = ?
-                """,
-                (date_str, time_str, appointment_id),
-            )
-            conn.commit()
-            conn.close()
+            if result == NOT_FOUND:
+                flash("Appointment not found.", "danger")
+                return redirect(url_for("patient_appointments"))
+
+            engine = get_engine()
+            if appt["status"] == "Booked":
+                engine.release(appt["doctor_id"], appt["date"], appt["time"])
+            engine.book(appt["doctor_id"], date_str, time_str)
             flash("Appointment rescheduled.", "success")
             return redirect(url_for("patient_appointments"))
 
@@ -0,0 +1,207 @@
+# query_plans.py
+"""
+Query-plan regression check.
+
+Builds a scratch database with the demo data, drives every route through the
+Flask test client as admin, doctor and patient, records each SQL statement
+the routes run and fails if EXPLAIN QUERY PLAN shows a full table scan.
+
+Usage:
+    python query_plans.py          # exit status 1 if any route query scans a table
+    python query_plans.py -v       # also print the plan of every statement
+"""
+import os
+import re
+import sys
+import tempfile
+from datetime import date, timedelta
+
+import db
+from archive import archive_old, attach as attach_archive
+from availability import FREE_SLOTS_SQL
+
+# Tiny tables that are fine to scan (import_jobs: newest first, LIMIT 10).
+SCAN_ALLOWED_TABLES = ("departments", "stat_counters", "cache_generations", "import_jobs")
+
+_STATEMENT_RE = re.compile(r"^\s*(SELECT|WITH|UPDATE|DELETE|INSERT)\b", re.IGNORECASE)
+_PLAN_NAME_RE = re.compile(r"^(?:SCAN|MATERIALIZE|CO-ROUTINE)\s+(\S+)")
+
+DEMO_LOGINS = {
+    "admin": ("admin@hospital.com", "admin123"),
+    "doctor": ("dr.cardiac@hospital.com", "doctor123"),
+    "patient": ("john.doe@example.com", "patient123"),
+}
+
+
+def build_app(db_path):
+    """Point db.py at `db_path`, create the app and seed the demo data."""
+    db.DB_PATH = db_path
+    here = os.path.dirname(os.path.abspath(__file__))
+    db.SCHEMA_FILE = os.path.join(here, "schema.sql")
+
+    from app import create_app
+    from demo import seed_demo_data
+
+    # Build online indexes up front so the plans are checked against them.
+    app = create_app({"TESTING": True, "MIGRATE_ONLINE_IN_BACKGROUND": False})
+
+    seed_demo_data()
+    # Move the demo's past visits to the archive so deep-history reads have
+    # something to plan against.
+    conn = db.get_db()
+    archive_old(conn, months=0)
+    conn.close()
+    return app
+
+
+def login(client, role):
+    email, password = DEMO_LOGINS[role]
+    client.post("/login", data={"email": email, "password": password})
+
+
+def exercise_routes(app):
+    """Hit every route once per role, including the write paths."""
+    today = date.today()
+    tomorrow = (today + timedelta(days=1)).isoformat()
+
+    with app.test_client() as client:
+        login(client, "patient")
+        for url in (
+            "/patient/dashboard",
+            "/patient/dashboard?history=all",
+            "/patient/profile",
+            "/patient/doctors",
+            "/patient/doctors?q=card",
+            "/patient/doctors/1/availability",
+            "/patient/appointments",
+            "/patient/appointments/book/1",
+            "/patient/appointments/3/reschedule",
+        ):
+            client.get(url)
+        client.post("/patient/book", data={"doctor_id": 1, "date": today.isoformat(), "time": "11:00"})
+        client.post(
+            "/patient/profile",
+            data={"name": "John Doe", "email": "john.doe@example.com", "phone": "4444444444"},
+        )
+        client.post("/patient/appointments/3/cancel")
+        client.post("/patient/appointments/3/reschedule", data={"date": tomorrow, "time": "10:00"})
+
+    with app.test_client() as client:
+        login(client, "doctor")
+        client.get("/doctor/dashboard")
+        client.get("/doctor/dashboard?patient_id=1")
+        client.get("/doctor/dashboard?patient_id=1&history=all")
+        client.post("/doctor/dashboard", data={"action": "add_slot", "date": tomorrow, "time": "15:00"})
+        client.post(
+            "/doctor/dashboard",
+            data={"action": "update_appointment", "appointment_id": 1, "status": "Completed"},
+        )
+
+    with app.test_client() as client:
+        login(client, "admin")
+        for url in (
+            "/admin/dashboard",
+            "/admin/dashboard?doc_q=card&pat_q=john&status=Booked",
+            "/admin/dashboard/panels/appointments?per_page=1",
+            "/admin/doctors",
+            "/admin/doctors?q=neuro",
+            "/admin/patients",
+            "/admin/patients?q=jane",
+            "/admin/appointments",
+            "/admin/appointments?status=Completed",
+            "/admin/appointments?status=Completed&history=all",
+            "/admin/appointments/export.csv",
+            "/admin/appointments/export.jsonl?status=Completed&history=all",
+            "/admin/appointments/export.csv?doctor_id=1&from=2020-01-01&to=2030-12-31",
+            "/admin/appointments/export.csv?department_id=1",
+            "/admin/doctors/new",
+            "/admin/doctors/1/edit",
+            "/admin/patients/1/edit",
+            "/admin/import",
+        ):
+            client.get(url, buffered=True)
+        client.post(
+            "/admin/doctors/1/edit",
+            data={"email": "dr.cardiac@hospital.com", "name": "Dr. Alice Cardio", "department_id": 1},
+        )
+        client.post("/admin/users/2/toggle_status")
+        client.post("/admin/users/2/toggle_status")
+
+
+def capture_statements(app):
+    """Run exercise_routes() and return the distinct statements it executed."""
+    seen = []
+
+    def trace(sql):
+        # Statements against 'main'.'<shadow table>' are SQLite's own FTS bookkeeping.
+        if "'main'." in sql:
+            return
+        if _STATEMENT_RE.match(sql) and sql not in seen:
+            seen.append(sql)
+
+    def install(conn):
+        conn.set_trace_callback(trace)
+
+    db.connect_hooks.append(install)
+    try:
+        exercise_routes(app)
+        with app.app_context():
+            # Paths the routes only take now and then: warming the availability
+            # engine and its SQL fallback.
+            conn = db.get_db()
+            today = date.today().isoformat()
+            app.extensions["availability"].warm(conn)
+            conn.execute(FREE_SLOTS_SQL, (1, today, today)).fetchall()
+    finally:
+        db.connect_hooks.remove(install)
+        db.close_pools(app)
+    return seen
+
+
+def full_scans(conn, sql):
+    """Return (plan, offending plan lines) for one statement."""
+    plan = [row[3] for row in conn.execute("EXPLAIN QUERY PLAN " + sql)]
+    allowed = set(SCAN_ALLOWED_TABLES)
+    for table in SCAN_ALLOWED_TABLES:
+        allowed.update(re.findall(rf"\b{table}\s+(?:AS\s+)?(\w+)", sql, re.IGNORECASE))
+    # Materialized subqueries and CTEs are scanned by design.
+    for detail in plan:
+        if detail.startswith(("MATERIALIZE", "CO-ROUTINE")):
+            allowed.add(_PLAN_NAME_RE.match(detail).group(1))
+
+    bad = []
+    for detail in plan:
+        if not detail.startswith("SCAN "):
+            continue
+        if "USING" in detail or "VIRTUAL TABLE" in detail or "CONSTANT ROW" in detail:
+            continue
+        if _PLAN_NAME_RE.match(detail).group(1) in allowed:
+            continue
+        bad.append(detail)
+    return plan, bad
+
+
+def main(argv):
+    verbose = "-v" in argv[1:]
+    workdir = tempfile.mkdtemp(prefix="hms-plans-")
+    app = build_app(os.path.join(workdir, "hms.db"))
+    statements = capture_statements(app)
+
+    conn = db.get_db()
+    attach_archive(conn)
+    failures = 0
+    for sql in statements:
+        plan, bad = full_scans(conn, sql)
+        if bad or verbose:
+            print(" ".join(sql.split()))
+            for detail in plan:
+                print(f"    {'!!' if detail in bad else '  '} {detail}")
+        failures += bool(bad)
+    conn.close()
+
+    print(f"[Plans] {len(statements)} statements checked, {failures} with full table scans.")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
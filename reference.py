@@ -0,0 +1,139 @@
+# reference.py
+"""
+Reference data held in memory: departments and each doctor's department.
+
+Departments almost never change, yet the department list was read on every
+dashboard and doctor form, and the department name was joined into every
+doctor query. The registry loads both once, at startup, into an immutable
+snapshot that requests share. Routes take the department list from
+reference_data(); templates resolve names with department_name(id).
+
+The snapshot is stamped with the departments and doctor_profiles
+generations (see cache.py). When either moves, in this process or
+another, the next request loads a fresh snapshot and swaps it in whole,
+so readers never see a half-built one. A request keeps the snapshot it
+started with.
+
+Usage:
+    python reference.py    # print the departments and doctors per department
+"""
+import sys
+import threading
+from collections import namedtuple
+from types import MappingProxyType
+
+from flask import current_app, g, has_request_context
+
+import db
+
+Department = namedtuple("Department", "id name description")
+
+TABLES = ("departments", "doctor_profiles")
+
+
+class ReferenceData:
+    """One immutable snapshot of the reference tables."""
+
+    __slots__ = ("departments", "by_id", "doctor_departments", "stamp")
+
+    def __init__(self, departments, doctor_departments, stamp=None):
+        self.departments = tuple(departments)  # ordered by name
+        self.by_id = MappingProxyType({d.id: d for d in self.departments})
+        self.doctor_departments = MappingProxyType(doctor_departments)
+        self.stamp = stamp
+
+    def department_name(self, department_id):
+        department = self.by_id.get(department_id)
+        return department.name if department else None
+
+    def doctor_department(self, doctor_id):
+        """The doctor's Department, or None if unassigned or unknown."""
+        return self.by_id.get(self.doctor_departments.get(doctor_id))
+
+
+def load(conn, stamp=None):
+    departments = [
+        Department(row["id"], row["name"], row["description"])
+        for row in conn.execute("SELECT id, name, description FROM departments ORDER BY name")
+    ]
+    doctor_departments = {
+        row["id"]: row["department_id"]
+        for row in conn.execute(
+            "SELECT id, department_id FROM doctor_profiles WHERE department_id IS NOT NULL"
+        )
+    }
+    return ReferenceData(departments, doctor_departments, stamp)
+
+
+class ReferenceRegistry:
+    """Hands out the current snapshot, reloading it when its tables' generations move."""
+
+    def __init__(self, probe, path=None):
+        self.probe = probe
+        self.path = path
+        self._lock = threading.Lock()
+        self._data = None
+        self.loads = 0
+
+    def get(self):
+        stamp = self.probe.stamp(TABLES)
+        data = self._data
+        if data is not None and data.stamp == stamp:
+            return data
+        with self._lock:
+            if self._data is None or self._data.stamp != stamp:
+                conn = db._connect(self.path, ("PRAGMA query_only = ON;",))
+                try:
+                    self._data = load(conn, stamp)
+                finally:
+                    conn.close()
+                self.loads += 1
+            return self._data
+
+    def stats(self):
+        data = self._data
+        return {
+            "departments": len(data.departments) if data else 0,
+            "doctors_mapped": len(data.doctor_departments) if data else 0,
+            "loads": self.loads,
+        }
+
+
+def init_app(app):
+    """Load the reference data now and expose department_name() to templates."""
+    registry = ReferenceRegistry(app.extensions["generations"], db.DB_PATH)
+    registry.get()
+    app.extensions["reference"] = registry
+    app.jinja_env.globals["department_name"] = department_name
+
+
+def reference_data():
+    """The current snapshot, checked once per request and kept on `g` for the rest of it."""
+    if not has_request_context():
+        return current_app.extensions["reference"].get()
+    if "reference" not in g:
+        g.reference = current_app.extensions["reference"].get()
+    return g.reference
+
+
+def department_name(department_id):
+    return reference_data().department_name(department_id)
+
+
+def main(argv):
+    if len(argv) > 1:
+        print(__doc__)
+        return 2
+    conn = db._connect()
+    data = load(conn)
+    conn.close()
+    per_department = {}
+    for department_id in data.doctor_departments.values():
+        per_department[department_id] = per_department.get(department_id, 0) + 1
+    for department in data.departments:
+        print(f"[Reference] {department.id:4} {department.name:30} {per_department.get(department.id, 0):6} doctors")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
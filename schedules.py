@@ -0,0 +1,239 @@
+# schedules.py
+"""
+Recurring weekly schedule templates (schedule_templates in schema.sql).
+
+A template such as "Mon-Fri 09:00-13:00 every 15 minutes" is expanded into
+doctor_availability rows over a rolling horizon. Existing slots are skipped,
+and everything is written with one INSERT ... SELECT in a single transaction.
+
+Usage:
+    python schedules.py materialize [days]      # expand all templates
+    python schedules.py bench [doctors] [days]  # time a bulk run on a scratch DB
+"""
+import os
+import sys
+import tempfile
+import time
+from datetime import date, datetime, timedelta
+
+import db
+
+DEFAULT_HORIZON_DAYS = 28
+WEEKDAY_NAMES = ("Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun")
+
+
+def _minutes(time_str, end=False):
+    """
+    'HH:MM' (or 'HH:MM:SS', seconds ignored) -> minutes after midnight.
+    '24:00' is allowed only as an end bound. Raises ValueError otherwise.
+    """
+    parts = time_str.split(":")
+    if len(parts) not in (2, 3) or not all(p.isascii() and p.isdigit() for p in parts):
+        raise ValueError(time_str)
+    hours, minutes = int(parts[0]), int(parts[1])
+    if len(parts) == 3 and int(parts[2]) > 59:
+        raise ValueError(time_str)
+    if end and (hours, minutes) == (24, 0):
+        return 24 * 60
+    if not (0 <= hours <= 23 and 0 <= minutes <= 59):
+        raise ValueError(time_str)
+    return hours * 60 + minutes
+
+
+def describe_weekdays(mask):
+    return ", ".join(name for i, name in enumerate(WEEKDAY_NAMES) if mask & (1 << i))
+
+
+def add_template(conn, doctor_id, weekdays, start_time, end_time, slot_minutes, commit=True):
+    """
+    Validate and store a template. `weekdays` are 0 (Mon) .. 6 (Sun).
+    Raises ValueError with a user-facing message on bad input, before
+    anything is written. With commit=False the caller owns the transaction
+    (a writer.write() job).
+    """
+    mask = 0
+    for day in weekdays:
+        try:
+            day = int(day)
+        except (TypeError, ValueError):
+            raise ValueError("Invalid weekday.")
+        if not 0 <= day <= 6:
+            raise ValueError("Invalid weekday.")
+        mask |= 1 << day
+    if not mask:
+        raise ValueError("Pick at least one weekday.")
+    try:
+        start, end = _minutes(start_time), _minutes(end_time, end=True)
+        slot_minutes = int(slot_minutes)
+    except (AttributeError, TypeError, ValueError):
+        raise ValueError("Invalid time or slot length.")
+    if start >= end:
+        raise ValueError("End time must be after start time.")
+    if not 5 <= slot_minutes <= 240:
+        raise ValueError("Slot length must be between 5 and 240 minutes.")
+
+    cur = conn.cursor()
+    cur.execute(
+        """
+        INSERT INTO schedule_templates
+          (doctor_id, weekday_mask, start_time, end_time, slot_minutes, created_at)
+        VALUES (?, ?, ?, ?, ?, ?)
+        """,
+        (
+            doctor_id,
+            mask,
+            f"{start // 60:02d}:{start % 60:02d}",
+            f"{end // 60:02d}:{end % 60:02d}",
+            slot_minutes,
+            datetime.now().isoformat(timespec="seconds"),
+        ),
+    )
+    if commit:
+        conn.commit()
+    return cur.lastrowid
+
+
+# Expands every template into (doctor_id, date, time) rows inside SQLite.
+# `days` walks the date range with each day's weekday bit (bit 0 = Monday)
+# and `times` walks each template's slot times. The CROSS JOINs fix the
+# loop order to template (by doctor), day, time, so rows come out in the
+# order of the unique slot index (schema.sql) without sorting them, and
+# that index skips the ones that already exist.
+_MATERIALIZE_SQL = """
+    WITH RECURSIVE
+    days(day, bit) AS (
+        SELECT ?, 1 << ((strftime('%w', ?) + 6) % 7)
+        UNION ALL
+        SELECT date(day, '+1 day'), 1 << ((strftime('%w', day, '+1 day') + 6) % 7)
+        FROM days WHERE day < ?
+    ),
+    templates AS (
+        SELECT id, doctor_id, weekday_mask,
+               substr(start_time, 1, 2) * 60 + substr(start_time, 4, 2) AS start_minute,
+               substr(start_time, 1, 5) AS start_time,
+               substr(end_time, 1, 2) * 60 + substr(end_time, 4, 2) AS end_minute,
+               slot_minutes
+        FROM schedule_templates
+        {where}
+        ORDER BY doctor_id, start_time
+    ),
+    times(template_id, minute, time, end_minute, step) AS (
+        SELECT id, start_minute, start_time, end_minute, slot_minutes FROM templates
+        UNION ALL
+        SELECT template_id, minute + step,
+               printf('%02d:%02d', (minute + step) / 60, (minute + step) % 60),
+               end_minute, step
+        FROM times WHERE minute + step < end_minute
+    )
+    INSERT OR IGNORE INTO doctor_availability (doctor_id, date, time, is_available)
+    SELECT t.doctor_id, d.day, s.time, 1
+    FROM templates t
+    CROSS JOIN days d
+    CROSS JOIN times s
+    WHERE t.weekday_mask & d.bit AND s.template_id = t.id
+"""
+
+
+def expand(conn, start=None, days=DEFAULT_HORIZON_DAYS, doctor_id=None):
+    """
+    materialize() without the transaction, for callers that already hold
+    the write lock (a writer.write() job). Returns the number of slots inserted.
+    """
+    start = start or date.today()
+    end = start + timedelta(days=days - 1)
+    where, params = "", []
+    if doctor_id is not None:
+        where, params = "WHERE doctor_id = ?", [doctor_id]
+    conn.execute(
+        _MATERIALIZE_SQL.format(where=where),
+        [start.isoformat(), start.isoformat(), end.isoformat()] + params,
+    )
+    # cursor.rowcount is -1 for statements that start with WITH.
+    return conn.execute("SELECT changes()").fetchone()[0]
+
+
+def materialize(conn, start=None, days=DEFAULT_HORIZON_DAYS, doctor_id=None):
+    """
+    Expand templates into doctor_availability for `days` days from `start`
+    (default today), optionally for one doctor only. Returns the number of
+    slots inserted.
+
+    One INSERT ... SELECT in a BEGIN IMMEDIATE transaction: the rows are
+    generated by SQLite rather than bound one by one from Python, and
+    slots that already exist, including ones added concurrently, are
+    skipped by the unique index rather than a read made before the lock.
+    """
+    return db.write_transaction(conn, expand, start, days, doctor_id)
+
+
+def bench(doctors=500, days=91):
+    """
+    Time materialize() for `doctors` doctors with a Mon-Fri 09-13 / 15 min
+    template, on a scratch DB with every migration applied.
+    """
+    from migrations import migrate
+
+    workdir = tempfile.mkdtemp(prefix="hms-schedules-")
+    conn = db._connect(os.path.join(workdir, "hms.db"))
+    migrate(conn)
+
+    cur = conn.cursor()
+    now = datetime.now().isoformat(timespec="seconds")
+    for i in range(doctors):
+        cur.execute(
+            "INSERT INTO users (email, password_hash, role) VALUES (?, '-', 'doctor')",
+            (f"doctor{i}@bench",),
+        )
+        cur.execute(
+            "INSERT INTO doctor_profiles (user_id, name) VALUES (?, ?)",
+            (cur.lastrowid, f"Dr. Bench {i}"),
+        )
+        cur.execute(
+            """
+            INSERT INTO schedule_templates
+              (doctor_id, weekday_mask, start_time, end_time, slot_minutes, created_at)
+            VALUES (?, 31, '09:00', '13:00', 15, ?)
+            """,
+            (cur.lastrowid, now),
+        )
+    conn.commit()
+
+    started = time.perf_counter()
+    inserted = materialize(conn, days=days)
+    first = time.perf_counter() - started
+
+    started = time.perf_counter()
+    again = materialize(conn, days=days)
+    second = time.perf_counter() - started
+    conn.close()
+    return {
+        "doctors": doctors,
+        "days": days,
+        "inserted": inserted,
+        "seconds": round(first, 3),
+        "rerun_inserted": again,
+        "rerun_seconds": round(second, 3),
+    }
+
+
+def main(argv):
+    command = argv[1] if len(argv) > 1 else ""
+    if command == "materialize":
+        days = int(argv[2]) if len(argv) > 2 else DEFAULT_HORIZON_DAYS
+        conn = db.get_db()
+        inserted = materialize(conn, days=days)
+        conn.close()
+        print(f"[Schedules] Inserted {inserted} slots over the next {days} days.")
+        return 0
+    if command == "bench":
+        doctors = int(argv[2]) if len(argv) > 2 else 500
+        days = int(argv[3]) if len(argv) > 3 else 91
+        for key, value in bench(doctors, days).items():
+            print(f"[Schedules] {key}: {value}")
+        return 0
+    print(__doc__)
+    return 2
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
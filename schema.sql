@@ -1,3 +1,6 @@
+-- Baseline schema: migration 1 in migrations.py. Later schema changes go in
+-- as new numbered migrations there rather than edits to this file.
+
 PRAGMA foreign_keys = ON;
 
 CREATE TABLE IF NOT EXISTS users (
@@ -72,11 +75,351 @@ CREATE TABLE IF NOT EXISTS treatments (
     FOREIGN KEY (appointment_id) REFERENCES appointments (id) ON DELETE CASCADE
 );
 
-CREATE INDEX IF NOT EXISTS idx_appointments_patient_id
-    ON appointments (patient_id);
+-- Superseded by the composite indexes below (and, for appointments.doctor_id,
+-- by the UNIQUE (doctor_id, date, time) constraint).
+DROP INDEX IF EXISTS idx_appointments_patient_id;
+DROP INDEX IF EXISTS idx_appointments_doctor_id;
+DROP INDEX IF EXISTS idx_doctor_availability_doctor_id;
+DROP INDEX IF EXISTS idx_doctor_availability_date;
+
+-- Patient dashboards and history: WHERE patient_id = ? [AND date ...] ORDER BY date, time
+CREATE INDEX IF NOT EXISTS idx_appointments_patient_date_time
+    ON appointments (patient_id, date, time);
+
+-- One availability row per (doctor, date, time); also serves the availability
+-- lookups (WHERE doctor_id = ? AND date BETWEEN ? AND ?). Duplicates in older
+-- databases keep the unavailable row if there is one, else the oldest.
+DELETE FROM doctor_availability AS da
+WHERE EXISTS (
+    SELECT 1 FROM doctor_availability keep
+    WHERE keep.doctor_id = da.doctor_id AND keep.date = da.date AND keep.time = da.time
+      AND (keep.is_available < da.is_available
+           OR (keep.is_available = da.is_available AND keep.id < da.id))
+);
+CREATE UNIQUE INDEX IF NOT EXISTS idx_doctor_availability_slot
+    ON doctor_availability (doctor_id, date, time);
+
+CREATE INDEX IF NOT EXISTS idx_appointments_date_time
+    ON appointments (date, time);
+
+CREATE INDEX IF NOT EXISTS idx_appointments_status_date_time
+    ON appointments (status, date, time);
+
+CREATE INDEX IF NOT EXISTS idx_doctor_profiles_name
+    ON doctor_profiles (name);
+
+CREATE INDEX IF NOT EXISTS idx_patient_profiles_name
+    ON patient_profiles (name);
+
+-- Dashboard statistics, kept current by the triggers below so the admin
+-- dashboard never has to COUNT(*) the big tables.
+--   scope 'total':      key is 'doctors', 'patients' or 'appointments'
+--   scope 'status':     key is the appointment status
+--   scope 'department': key is the appointment department_id ('' for none)
+CREATE TABLE IF NOT EXISTS stat_counters (
+    scope TEXT NOT NULL,
+    key TEXT NOT NULL,
+    value INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (scope, key)
+) WITHOUT ROWID;
+
+CREATE TRIGGER IF NOT EXISTS trg_doctor_profiles_count_ins
+AFTER INSERT ON doctor_profiles
+BEGIN
+    INSERT INTO stat_counters (scope, key, value) VALUES ('total', 'doctors', 1)
+        ON CONFLICT (scope, key) DO UPDATE SET value = value + 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_doctor_profiles_count_del
+AFTER DELETE ON doctor_profiles
+BEGIN
+    UPDATE stat_counters SET value = value - 1 WHERE scope = 'total' AND key = 'doctors';
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_patient_profiles_count_ins
+AFTER INSERT ON patient_profiles
+BEGIN
+    INSERT INTO stat_counters (scope, key, value) VALUES ('total', 'patients', 1)
+        ON CONFLICT (scope, key) DO UPDATE SET value = value + 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_patient_profiles_count_del
+AFTER DELETE ON patient_profiles
+BEGIN
+    UPDATE stat_counters SET value = value - 1 WHERE scope = 'total' AND key = 'patients';
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_appointments_count_ins
+AFTER INSERT ON appointments
+BEGIN
+    INSERT INTO stat_counters (scope, key, value) VALUES ('total', 'appointments', 1)
+        ON CONFLICT (scope, key) DO UPDATE SET value = value + 1;
+    INSERT INTO stat_counters (scope, key, value) VALUES ('status', NEW.status, 1)
+        ON CONFLICT (scope, key) DO UPDATE SET value = value + 1;
+    INSERT INTO stat_counters (scope, key, value)
+        VALUES ('department', COALESCE(CAST(NEW.department_id AS TEXT), ''), 1)
+        ON CONFLICT (scope, key) DO UPDATE SET value = value + 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_appointments_count_del
+AFTER DELETE ON appointments
+BEGIN
+    UPDATE stat_counters SET value = value - 1 WHERE scope = 'total' AND key = 'appointments';
+    UPDATE stat_counters SET value = value - 1 WHERE scope = 'status' AND key = OLD.status;
+    UPDATE stat_counters SET value = value - 1
+        WHERE scope = 'department' AND key = COALESCE(CAST(OLD.department_id AS TEXT), '');
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_appointments_count_status
+AFTER UPDATE OF status ON appointments
+WHEN OLD.status IS NOT NEW.status
+BEGIN
+    UPDATE stat_counters SET value = value - 1 WHERE scope = 'status' AND key = OLD.status;
+    INSERT INTO stat_counters (scope, key, value) VALUES ('status', NEW.status, 1)
+        ON CONFLICT (scope, key) DO UPDATE SET value = value + 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_appointments_count_department
+AFTER UPDATE OF department_id ON appointments
+WHEN OLD.department_id IS NOT NEW.department_id
+BEGIN
+    UPDATE stat_counters SET value = value - 1
+        WHERE scope = 'department' AND key = COALESCE(CAST(OLD.department_id AS TEXT), '');
+    INSERT INTO stat_counters (scope, key, value)
+        VALUES ('department', COALESCE(CAST(NEW.department_id AS TEXT), ''), 1)
+        ON CONFLICT (scope, key) DO UPDATE SET value = value + 1;
+END;
+
+-- Full-text directory search. rowid is doctor_profiles.id / patient_profiles.id;
+-- the triggers below keep both indexes in step with the base tables.
+CREATE VIRTUAL TABLE IF NOT EXISTS doctor_search USING fts5(
+    name, specialization, department,
+    tokenize = 'unicode61', prefix = '2 3'
+);
+
+CREATE VIRTUAL TABLE IF NOT EXISTS patient_search USING fts5(
+    name, phone, email,
+    tokenize = 'unicode61', prefix = '2 3'
+);
+
+CREATE TRIGGER IF NOT EXISTS trg_doctor_search_ins
+AFTER INSERT ON doctor_profiles
+BEGIN
+    INSERT INTO doctor_search (rowid, name, specialization, department)
+    VALUES (
+        NEW.id, NEW.name, COALESCE(NEW.specialization, ''),
+        COALESCE((SELECT name FROM departments WHERE id = NEW.department_id), '')
+    );
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_doctor_search_upd
+AFTER UPDATE OF name, specialization, department_id ON doctor_profiles
+BEGIN
+    DELETE FROM doctor_search WHERE rowid = OLD.id;
+    INSERT INTO doctor_search (rowid, name, specialization, department)
+    VALUES (
+        NEW.id, NEW.name, COALESCE(NEW.specialization, ''),
+        COALESCE((SELECT name FROM departments WHERE id = NEW.department_id), '')
+    );
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_doctor_search_del
+AFTER DELETE ON doctor_profiles
+BEGIN
+    DELETE FROM doctor_search WHERE rowid = OLD.id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_doctor_search_dept_upd
+AFTER UPDATE OF name ON departments
+BEGIN
+    UPDATE doctor_search SET department = NEW.name
+    WHERE rowid IN (SELECT id FROM doctor_profiles WHERE department_id = NEW.id);
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_patient_search_ins
+AFTER INSERT ON patient_profiles
+BEGIN
+    INSERT INTO patient_search (rowid, name, phone, email)
+    VALUES (
+        NEW.id, NEW.name, COALESCE(NEW.phone, ''),
+        COALESCE((SELECT email FROM users WHERE id = NEW.user_id), '')
+    );
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_patient_search_upd
+AFTER UPDATE OF name, phone, user_id ON patient_profiles
+BEGIN
+    DELETE FROM patient_search WHERE rowid = OLD.id;
+    INSERT INTO patient_search (rowid, name, phone, email)
+    VALUES (
+        NEW.id, NEW.name, COALESCE(NEW.phone, ''),
+        COALESCE((SELECT email FROM users WHERE id = NEW.user_id), '')
+    );
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_patient_search_del
+AFTER DELETE ON patient_profiles
+BEGIN
+    DELETE FROM patient_search WHERE rowid = OLD.id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_patient_search_email_upd
+AFTER UPDATE OF email ON users
+BEGIN
+    UPDATE patient_search SET email = NEW.email
+    WHERE rowid IN (SELECT id FROM patient_profiles WHERE user_id = NEW.id);
+END;
+
+-- Recurring weekly schedules. weekday_mask has bit 0 = Monday ... bit 6 = Sunday;
+-- slots run from start_time (inclusive) to end_time (exclusive) every
+-- slot_minutes and are expanded into doctor_availability by schedules.py.
+CREATE TABLE IF NOT EXISTS schedule_templates (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    doctor_id INTEGER NOT NULL,
+    weekday_mask INTEGER NOT NULL CHECK (weekday_mask BETWEEN 1 AND 127),
+    start_time TEXT NOT NULL,   -- 'HH:MM'
+    end_time TEXT NOT NULL,     -- 'HH:MM'
+    slot_minutes INTEGER NOT NULL CHECK (slot_minutes BETWEEN 5 AND 240),
+    created_at TEXT NOT NULL,
+    FOREIGN KEY (doctor_id) REFERENCES doctor_profiles (id) ON DELETE CASCADE
+);
+
+CREATE INDEX IF NOT EXISTS idx_schedule_templates_doctor_id
+    ON schedule_templates (doctor_id);
+
+-- What each doctor's patient list shows, one row per (doctor, patient) pair
+-- with at least one appointment. The triggers below recompute a pair from
+-- doctor_patient_summary_source whenever one of its appointments or
+-- treatments changes; summaries.py can verify or rebuild the whole table.
+--   visit_count / last_visit_date / last_diagnosis: Completed appointments
+--   next_booked: 'YYYY-MM-DD HH:MM' of the earliest appointment still Booked
+CREATE TABLE IF NOT EXISTS doctor_patient_summary (
+    doctor_id INTEGER NOT NULL,
+    patient_id INTEGER NOT NULL,
+    appointment_count INTEGER NOT NULL,
+    visit_count INTEGER NOT NULL,
+    last_visit_date TEXT,
+    last_diagnosis TEXT,
+    next_booked TEXT,
+    PRIMARY KEY (doctor_id, patient_id)
+) WITHOUT ROWID;
+
+CREATE VIEW IF NOT EXISTS doctor_patient_summary_source AS
+SELECT a.doctor_id,
+       a.patient_id,
+       COUNT(*) AS appointment_count,
+       SUM(a.status = 'Completed') AS visit_count,
+       MAX(CASE WHEN a.status = 'Completed' THEN a.date END) AS last_visit_date,
+       (
+           SELECT t.diagnosis
+           FROM appointments l
+           JOIN treatments t ON t.appointment_id = l.id
+           WHERE l.patient_id = a.patient_id AND l.doctor_id = a.doctor_id
+             AND +l.status = 'Completed'
+           ORDER BY l.date DESC, l.time DESC
+           LIMIT 1
+       ) AS last_diagnosis,
+       (
+           SELECT n.date || ' ' || n.time
+           FROM appointments n
+           WHERE n.patient_id = a.patient_id AND n.doctor_id = a.doctor_id
+             AND +n.status = 'Booked'
+           ORDER BY n.date, n.time
+           LIMIT 1
+       ) AS next_booked
+FROM appointments a
+GROUP BY a.doctor_id, a.patient_id;
+
+-- Delete-then-insert rather than INSERT OR REPLACE: an upsert's DO UPDATE
+-- overrides the conflict resolution of statements in the triggers it fires.
+-- (Dropped and recreated so databases with the OR REPLACE versions get these.)
+DROP TRIGGER IF EXISTS trg_doctor_patient_summary_appt_ins;
+CREATE TRIGGER trg_doctor_patient_summary_appt_ins
+AFTER INSERT ON appointments
+BEGIN
+    DELETE FROM doctor_patient_summary
+    WHERE doctor_id = NEW.doctor_id AND patient_id = NEW.patient_id;
+    INSERT INTO doctor_patient_summary
+    SELECT * FROM doctor_patient_summary_source
+    WHERE doctor_id = NEW.doctor_id AND patient_id = NEW.patient_id;
+END;
+
+DROP TRIGGER IF EXISTS trg_doctor_patient_summary_appt_upd;
+CREATE TRIGGER trg_doctor_patient_summary_appt_upd
+AFTER UPDATE OF doctor_id, patient_id, status, date, time ON appointments
+BEGIN
+    DELETE FROM doctor_patient_summary
+    WHERE doctor_id = OLD.doctor_id AND patient_id = OLD.patient_id;
+    DELETE FROM doctor_patient_summary
+    WHERE doctor_id = NEW.doctor_id AND patient_id = NEW.patient_id;
+    INSERT INTO doctor_patient_summary
+    SELECT * FROM doctor_patient_summary_source
+    WHERE (doctor_id = OLD.doctor_id AND patient_id = OLD.patient_id)
+       OR (doctor_id = NEW.doctor_id AND patient_id = NEW.patient_id);
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_doctor_patient_summary_appt_del
+AFTER DELETE ON appointments
+BEGIN
+    DELETE FROM doctor_patient_summary
+    WHERE doctor_id = OLD.doctor_id AND patient_id = OLD.patient_id;
+    INSERT INTO doctor_patient_summary
+    SELECT * FROM doctor_patient_summary_source
+    WHERE doctor_id = OLD.doctor_id AND patient_id = OLD.patient_id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_doctor_patient_summary_treat_ins
+AFTER INSERT ON treatments
+BEGIN
+    UPDATE doctor_patient_summary
+    SET last_diagnosis = (
+        SELECT t.diagnosis
+        FROM appointments l
+        JOIN treatments t ON t.appointment_id = l.id
+        WHERE l.patient_id = doctor_patient_summary.patient_id
+          AND l.doctor_id = doctor_patient_summary.doctor_id
+          AND +l.status = 'Completed'
+        ORDER BY l.date DESC, l.time DESC
+        LIMIT 1
+    )
+    WHERE doctor_id = (SELECT doctor_id FROM appointments WHERE id = NEW.appointment_id)
+      AND patient_id = (SELECT patient_id FROM appointments WHERE id = NEW.appointment_id);
+END;
 
-CREATE INDEX IF NOT EXISTS idx_appointments_doctor_id
-    ON appointments (doctor_id);
+CREATE TRIGGER IF NOT EXISTS trg_doctor_patient_summary_treat_upd
+AFTER UPDATE OF appointment_id, diagnosis ON treatments
+BEGIN
+    UPDATE doctor_patient_summary
+    SET last_diagnosis = (
+        SELECT t.diagnosis
+        FROM appointments l
+        JOIN treatments t ON t.appointment_id = l.id
+        WHERE l.patient_id = doctor_patient_summary.patient_id
+          AND l.doctor_id = doctor_patient_summary.doctor_id
+          AND +l.status = 'Completed'
+        ORDER BY l.date DESC, l.time DESC
+        LIMIT 1
+    )
+    WHERE (doctor_id = (SELECT doctor_id FROM appointments WHERE id = OLD.appointment_id)
+           AND patient_id = (SELECT patient_id FROM appointments WHERE id = OLD.appointment_id))
+       OR (doctor_id = (SELECT doctor_id FROM appointments WHERE id = NEW.appointment_id)
+           AND patient_id = (SELECT patient_id FROM appointments WHERE id = NEW.appointment_id));
+END;
 
-CREATE INDEX IF NOT EXISTS idx_doctor_availability_doctor_id
-    ON doctor_availability (doctor_id);
+CREATE TRIGGER IF NOT EXISTS trg_doctor_patient_summary_treat_del
+AFTER DELETE ON treatments
+BEGIN
+    UPDATE doctor_patient_summary
+    SET last_diagnosis = (
+        SELECT t.diagnosis
+        FROM appointments l
+        JOIN treatments t ON t.appointment_id = l.id
+        WHERE l.patient_id = doctor_patient_summary.patient_id
+          AND l.doctor_id = doctor_patient_summary.doctor_id
+          AND +l.status = 'Completed'
+        ORDER BY l.date DESC, l.time DESC
+        LIMIT 1
+    )
+    WHERE doctor_id = (SELECT doctor_id FROM appointments WHERE id = OLD.appointment_id)
+      AND patient_id = (SELECT patient_id FROM appointments WHERE id = OLD.appointment_id);
+END;
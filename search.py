@@ -0,0 +1,184 @@
+# search.py
+"""
+FTS5-backed directory search for doctors and patients
+(doctor_search / patient_search in schema.sql).
+
+Usage:
+    python search.py rebuild   # repopulate both indexes from the tables
+    python search.py verify    # compare FTS results with the old LIKE search
+"""
+import re
+import sys
+
+from db import get_db
+
+# Same word boundaries as the unicode61 tokenizer: letters and digits only.
+_TOKEN_RE = re.compile(r"[^\W_]+")
+
+# Filters usable as `<id column> IN (...)` with the MATCH expression as parameter.
+DOCTOR_MATCH_IDS = "SELECT rowid FROM doctor_search WHERE doctor_search MATCH ?"
+PATIENT_MATCH_IDS = "SELECT rowid FROM patient_search WHERE patient_search MATCH ?"
+
+
+def search_tokens(q):
+    return _TOKEN_RE.findall(q.lower())
+
+
+def fts_query(q):
+    """
+    Turn free text from a search box into an FTS5 MATCH expression.
+
+    Every word becomes a quoted prefix term and all of them must match, so
+    "car int" finds "Interventional Cardiologist". Returns None when the
+    text has no searchable words.
+    """
+    tokens = search_tokens(q)
+    if not tokens:
+        return None
+    return " AND ".join(f'"{token}"*' for token in tokens)
+
+
+def rebuild_search_index(conn, commit=True):
+    cur = conn.cursor()
+    cur.execute("DELETE FROM doctor_search")
+    cur.execute(
+        """
+        INSERT INTO doctor_search (rowid, name, specialization, department)
+        SELECT d.id, d.name, COALESCE(d.specialization, ''), COALESCE(dept.name, '')
+        FROM doctor_profiles d
+        LEFT JOIN departments dept ON d.department_id = dept.id
+        """
+    )
+    cur.execute("DELETE FROM patient_search")
+    cur.execute(
+        """
+        INSERT INTO patient_search (rowid, name, phone, email)
+        SELECT p.id, p.name, COALESCE(p.phone, ''), COALESCE(u.email, '')
+        FROM patient_profiles p
+        LEFT JOIN users u ON p.user_id = u.id
+        """
+    )
+    if commit:
+        conn.commit()
+
+
+def ensure_search_index(conn, commit=True):
+    """Populate the indexes once for databases created before they existed."""
+    cur = conn.cursor()
+    cur.execute(
+        """
+        SELECT (SELECT COUNT(*) FROM doctor_search) = (SELECT COUNT(*) FROM doctor_profiles)
+           AND (SELECT COUNT(*) FROM patient_search) = (SELECT COUNT(*) FROM patient_profiles)
+           AS in_sync
+        """
+    )
+    if not cur.fetchone()["in_sync"]:
+        rebuild_search_index(conn, commit)
+
+
+def _like_doctor_ids(cur, q):
+    like = f"%{q}%"
+    cur.execute(
+        """
+        SELECT d.id, d.name, d.specialization, dept.name AS department_name
+        FROM doctor_profiles d
+        LEFT JOIN departments dept ON d.department_id = dept.id
+        WHERE d.name LIKE ? OR d.specialization LIKE ? OR dept.name LIKE ?
+        """,
+        (like, like, like),
+    )
+    return {row["id"]: (row["name"], row["specialization"], row["department_name"]) for row in cur}
+
+
+def _like_patient_ids(cur, q):
+    like = f"%{q}%"
+    cur.execute(
+        """
+        SELECT p.id, p.name, p.phone, u.email
+        FROM patient_profiles p
+        JOIN users u ON p.user_id = u.id
+        WHERE p.name LIKE ? OR p.phone LIKE ? OR u.email LIKE ?
+        """,
+        (like, like, like),
+    )
+    return {row["id"]: (row["name"], row["phone"], row["email"]) for row in cur}
+
+
+def _starts_a_word(q, fields):
+    word = q.lower()
+    return any(
+        token.startswith(word)
+        for value in fields
+        if value
+        for token in search_tokens(value)
+    )
+
+
+def verify_search(conn, queries=None):
+    """
+    Check FTS search against the old LIKE '%q%' search.
+
+    For single-word queries the two must agree on every row where the word
+    starts a token; LIKE-only hits in the middle of a word are the intended
+    difference. By default the queries are word prefixes taken from the
+    data itself. Returns a list of (kind, query, missing_ids, extra_ids).
+    """
+    cur = conn.cursor()
+    if queries is None:
+        cur.execute(
+            """
+            SELECT name FROM doctor_profiles
+            UNION SELECT specialization FROM doctor_profiles
+            UNION SELECT name FROM departments
+            UNION SELECT name FROM patient_profiles
+            UNION SELECT email FROM users
+            """
+        )
+        words = set()
+        for row in cur.fetchall():
+            for token in search_tokens(row[0] or ""):
+                words.add(token[:3])
+        queries = sorted(words)
+
+    problems = []
+    for q in queries:
+        match = fts_query(q)
+        if match is None:
+            continue
+        for kind, like_rows, match_sql in (
+            ("doctor", _like_doctor_ids(cur, q), DOCTOR_MATCH_IDS),
+            ("patient", _like_patient_ids(cur, q), PATIENT_MATCH_IDS),
+        ):
+            cur.execute(match_sql, (match,))
+            fts_ids = {row[0] for row in cur.fetchall()}
+            expected = {pid for pid, fields in like_rows.items() if _starts_a_word(q, fields)}
+            missing = expected - fts_ids
+            extra = fts_ids - set(like_rows)
+            if missing or extra:
+                problems.append((kind, q, sorted(missing), sorted(extra)))
+    return problems
+
+
+def main(argv):
+    command = argv[1] if len(argv) > 1 else "verify"
+    conn = get_db()
+    if command == "rebuild":
+        rebuild_search_index(conn)
+        print("[Search] Rebuilt doctor and patient search indexes.")
+        status = 0
+    elif command == "verify":
+        problems = verify_search(conn, argv[2:] or None)
+        for kind, q, missing, extra in problems:
+            print(f"[Search] {kind} '{q}': missing={missing} extra={extra}")
+        if not problems:
+            print("[Search] FTS results match the LIKE search.")
+        status = 1 if problems else 0
+    else:
+        print(__doc__)
+        status = 2
+    conn.close()
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -1,7 +1,9 @@
 # security.py
+import threading
+import time
 from functools import wraps
 
-from flask import redirect, url_for, flash
+from flask import redirect, url_for, flash, g, current_app, has_app_context
 from flask_login import login_required, current_user
 
 from db import get_db
@@ -23,19 +25,246 @@ def role_required(role):
     return decorator
 
 
+_IDENTITY_QUERY = """
+    SELECT u.id, u.email, u.role, u.status,
+           d.id AS d_id, d.user_id AS d_user_id, d.department_id AS d_department_id,
+           d.name AS d_name, d.specialization AS d_specialization,
+           d.phone AS d_phone, d.bio AS d_bio,
+           p.id AS p_id, p.user_id AS p_user_id, p.name AS p_name, p.age AS p_age,
+           p.gender AS p_gender, p.phone AS p_phone, p.address AS p_address,
+           p.emergency_contact AS p_emergency_contact
+    FROM users u
+    LEFT JOIN doctor_profiles d ON d.user_id = u.id
+    LEFT JOIN patient_profiles p ON p.user_id = u.id
+    WHERE u.id = ?
+"""
+
+_DOCTOR_COLUMNS = ("id", "user_id", "department_id", "name", "specialization", "phone", "bio")
+_PATIENT_COLUMNS = (
+    "id", "user_id", "name", "age", "gender", "phone", "address", "emergency_contact",
+)
+
+
+def _profile(row, prefix, columns):
+    if row[prefix + "id"] is None:
+        return None
+    return {col: row[prefix + col] for col in columns}
+
+
+DEFAULT_PRINCIPAL_TTL = 30
+
+# The tables an identity is read from; see cache.py for their generations.
+IDENTITY_TABLES = ("users", "doctor_profiles", "patient_profiles")
+
+
+class PrincipalCache:
+    """
+    Process-wide cache of loaded identities.
+
+    Saves the users/profiles lookup that flask-login's user_loader would
+    otherwise run on every authenticated request. Each entry is stamped
+    with the generations of IDENTITY_TABLES, taken before the identity was
+    read, and is dropped as soon as they move. A user blacklisted in any
+    worker process is refused by every worker on its next request, and an
+    identity read just before the change can't be cached past it. The TTL
+    only bounds how long an idle entry is kept.
+    """
+
+    def __init__(self, ttl=DEFAULT_PRINCIPAL_TTL, probe=None):
+        self.ttl = ttl
+        self.probe = probe
+        self._lock = threading.Lock()
+        self._entries = {}  # user_id -> (expires_at, stamp, identity)
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+
+    def stamp(self):
+        """Take before reading an identity; pass to get() and put()."""
+        return self.probe.stamp(IDENTITY_TABLES) if self.probe is not None else None
+
+    def get(self, user_id, stamp=None):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None and entry[0] > now and entry[1] == stamp:
+                self.hits += 1
+                return entry[2]
+            if entry is not None:
+                if entry[1] != stamp:
+                    self.stale += 1
+                del self._entries[user_id]
+            self.misses += 1
+            return None
+
+    def put(self, user_id, identity, stamp=None):
+        if self.ttl <= 0:
+            return
+        with self._lock:
+            self._entries[user_id] = (time.monotonic() + self.ttl, stamp, identity)
+
+    def invalidate(self, user_id=None):
+        with self._lock:
+            if user_id is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(user_id, None)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "ttl": self.ttl,
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "stale": self.stale,
+            }
+
+
+def init_app(app):
+    """
+    Attach a principal cache checked against the generation probe (cache.py);
+    idle entries expire after PRINCIPAL_CACHE_TTL seconds, 0 disables it.
+    """
+    app.config.setdefault("PRINCIPAL_CACHE_TTL", DEFAULT_PRINCIPAL_TTL)
+    app.extensions["principals"] = PrincipalCache(
+        app.config["PRINCIPAL_CACHE_TTL"], app.extensions.get("generations")
+    )
+
+
+def _principal_cache():
+    if has_app_context():
+        return current_app.extensions.get("principals")
+    return None
+
+
+def load_identity(user_id):
+    """
+    Return the user row plus its doctor/patient profile for `user_id`.
+
+    Everything is loaded with one joined query and kept in a request-local
+    identity map on `g`, so later lookups in the same request are free.
+    Across requests the app's PrincipalCache serves it until the users or
+    profile tables change. Returns None if the user does not exist.
+    """
+    identities = g.setdefault("identities", {})
+    key = int(user_id)
+    if key in identities:
+        return identities[key]
+
+    cache = _principal_cache()
+    stamp = cache.stamp() if cache is not None else None
+    cached = cache.get(key, stamp) if cache is not None else None
+    if cached is not None:
+        identities[key] = cached
+    else:
+        conn = get_db()
+        cur = conn.cursor()
+        cur.execute(_IDENTITY_QUERY, (key,))
+        row = cur.fetchone()
+        conn.close()
+        if row is None:
+            identities[key] = None
+        else:
+            identities[key] = {
+                "user": {col: row[col] for col in ("id", "email", "role", "status")},
+                "doctor": _profile(row, "d_", _DOCTOR_COLUMNS),
+                "patient": _profile(row, "p_", _PATIENT_COLUMNS),
+            }
+            if cache is not None:
+                cache.put(key, identities[key], stamp)
+    return identities[key]
+
+
+def invalidate_identity(user_id=None):
+    """
+    Drop cached identities after a user or profile update, both in this
+    request and in the process-wide principal cache.
+    """
+    key = None if user_id is None else int(user_id)
+    cache = _principal_cache()
+    if cache is not None:
+        cache.invalidate(key)
+    identities = g.get("identities")
+    if not identities:
+        return
+    if key is None:
+        identities.clear()
+    else:
+        identities.pop(key, None)
+
+
 def get_doctor_profile_for_current_user():
-    conn = get_db()
-    cur = conn.cursor()
-    cur.execute("SELECT * FROM doctor_profiles WHERE user_id = ?", (current_user.id,))
-    doc = cur.fetchone()
-    conn.close()
-    return doc
+    identity = load_identity(current_user.id)
+    return identity["doctor"] if identity else None
 
 
 def get_patient_profile_for_current_user():
-    conn = get_db()
-    cur = conn.cursor()
-    cur.execute("SELECT * FROM patient_profiles WHERE user_id = ?", (current_user.id,))
-    patient = cur.fetchone()
-    conn.close()
-    return patient
+    identity = load_identity(current_user.id)
+    return identity["patient"] if identity else None
+
+
+def bench(requests_per_role=50):
+    """
+    Count SQL statements per authenticated request with the principal cache
+    off and on, on a scratch copy of the demo data.
+    """
+    import os
+    import tempfile
+
+    import db
+    from query_plans import build_app, login
+
+    app = build_app(os.path.join(tempfile.mkdtemp(prefix="hms-principals-"), "hms.db"))
+    cache = app.extensions["principals"]
+    urls = {
+        "admin": "/admin/doctors",
+        "doctor": "/doctor/dashboard",
+        "patient": "/patient/appointments",
+    }
+    counted = [0]
+
+    def trace(sql):
+        if "'main'." not in sql:
+            counted[0] += 1
+
+    def install(conn):
+        conn.set_trace_callback(trace)
+
+    # Install the trace on fresh connections only.
+    db.close_pools(app)
+    db.connect_hooks.append(install)
+    results = {}
+    try:
+        for ttl in (0, cache.ttl or DEFAULT_PRINCIPAL_TTL):
+            cache.ttl = ttl
+            cache.invalidate()
+            for role, url in urls.items():
+                with app.test_client() as client:
+                    login(client, role)
+                    counted[0] = 0
+                    started = time.perf_counter()
+                    for _ in range(requests_per_role):
+                        client.get(url)
+                    elapsed = time.perf_counter() - started
+                results[(ttl, role)] = (
+                    counted[0] / requests_per_role,
+                    elapsed * 1000 / requests_per_role,
+                )
+    finally:
+        db.connect_hooks.remove(install)
+        db.close_pools(app)
+    return results, cache.stats()
+
+
+if __name__ == "__main__":
+    import sys
+
+    if len(sys.argv) < 2 or sys.argv[1] != "bench":
+        print("Usage: python security.py bench [requests_per_role]")
+        sys.exit(2)
+    results, stats = bench(int(sys.argv[2]) if len(sys.argv) > 2 else 50)
+    for (ttl, role), (queries, ms) in results.items():
+        label = "cache off" if ttl == 0 else f"cache ttl={ttl}s"
+        print(f"[Principals] {label:14} {role:8} {queries:5.2f} queries/request  {ms:7.2f} ms/request")
+    print(f"[Principals] {stats}")
@@ -0,0 +1,271 @@
+# slow_queries.py
+"""
+Slow-query log.
+
+Listens to the statements metrics.InstrumentedCursor finishes and logs every
+one that took longer than SLOW_QUERY_MS (execute plus fetch time). Each log
+entry is one JSON line under SLOW_QUERY_LOG_DIR. It holds the normalized
+statement and its fingerprint, the duration, the row count, the endpoint
+and the bound parameters with anything that could be patient data redacted.
+
+Every process writes its own file, slow_queries.<pid>.jsonl, and rotates it
+itself: RotatingFileHandler can't rotate a file other processes are
+appending to. Files of processes that have exited are removed once they
+are KEEP_DAYS old.
+
+Occurrences are deduplicated by fingerprint: the process keeps a count per
+statement and captures EXPLAIN QUERY PLAN only the first time it sees one,
+so a hot slow query costs one plan and a short line per hit. The admin page
+rebuilds the counts from all the log files, so it covers every worker
+process.
+
+Usage:
+    python slow_queries.py [LOG_DIR]   # print the aggregated log
+"""
+import glob
+import hashlib
+import json
+import logging
+import os
+import re
+import sqlite3
+import sys
+import threading
+import time
+from datetime import datetime
+from logging.handlers import RotatingFileHandler
+
+from metrics import add_statement_listener, normalize
+
+DEFAULT_THRESHOLD_MS = 100
+DEFAULT_LOG_DIR = "logs"
+LOG_FILE = "slow_queries.{pid}.jsonl"
+MAX_BYTES = 5 * 1024 * 1024
+BACKUP_COUNT = 5
+KEEP_DAYS = 7
+MAX_SQL_CHARS = 4000
+
+# slow_queries.<pid>.jsonl[.<backup>]; no pid for logs from before per-process files.
+_LOG_FILE_RE = re.compile(r"^slow_queries(?:\.(\d+))?\.jsonl(?:\.\d+)?$")
+
+# Parameter values that are safe to log as they are.
+_SAFE_VALUE_RE = re.compile(
+    r"^(\d{4}-\d{2}-\d{2}(T\d{2}:\d{2}(:\d{2})?)?|\d{2}:\d{2}"
+    r"|Booked|Completed|Cancelled|active|blacklisted|admin|doctor|patient)$"
+)
+_LITERAL_RE = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+
+
+def fingerprint(sql):
+    """Normalized statement with literals replaced, plus a short hash of it."""
+    text = _LITERAL_RE.sub("?", normalize(sql))
+    return text, hashlib.sha1(text.encode("utf-8")).hexdigest()[:12]
+
+
+def _redact_value(value):
+    if value is None or isinstance(value, (int, float)):
+        return value
+    if isinstance(value, str) and _SAFE_VALUE_RE.match(value):
+        return value
+    if isinstance(value, str):
+        return f"<redacted str len={len(value)}>"
+    return f"<redacted {type(value).__name__}>"
+
+
+def redact(parameters):
+    """Keep ids, numbers, dates, times and enum values; hide everything else."""
+    if isinstance(parameters, dict):
+        return {key: _redact_value(value) for key, value in parameters.items()}
+    if isinstance(parameters, (list, tuple)):
+        if parameters and isinstance(parameters[0], (list, tuple, dict)):
+            return f"<{len(parameters)} parameter rows>"
+        return [_redact_value(value) for value in parameters]
+    return "<not logged>"
+
+
+def explain(conn, sql, parameters):
+    """EXPLAIN QUERY PLAN lines, or None if the statement can't be explained."""
+    if not isinstance(parameters, (list, tuple, dict)) or (
+        parameters and isinstance(parameters, (list, tuple)) and isinstance(parameters[0], (list, tuple, dict))
+    ):
+        parameters = ()
+    try:
+        # A plain cursor so the plan itself isn't instrumented.
+        cur = conn.cursor(sqlite3.Cursor)
+        cur.execute("EXPLAIN QUERY PLAN " + sql, parameters)
+        return [row[3] for row in cur.fetchall()]
+    except sqlite3.Error:
+        return None
+
+
+class _JSONFormatter(logging.Formatter):
+    def format(self, record):
+        return json.dumps(record.entry, default=str)
+
+
+class SlowQueryLog:
+    def __init__(self, directory=DEFAULT_LOG_DIR, threshold_ms=DEFAULT_THRESHOLD_MS):
+        self.directory = directory
+        self.threshold = threshold_ms / 1000
+        self._lock = threading.Lock()
+        self._seen = {}  # fingerprint -> count in this process
+        os.makedirs(directory, exist_ok=True)
+        prune(directory)
+        self.path = os.path.join(directory, LOG_FILE.format(pid=os.getpid()))
+        handler = RotatingFileHandler(
+            self.path, maxBytes=MAX_BYTES, backupCount=BACKUP_COUNT, encoding="utf-8", delay=True
+        )
+        handler.setFormatter(_JSONFormatter())
+        self.logger = logging.getLogger(f"hms.slow_queries.{id(self)}")
+        self.logger.propagate = False
+        self.logger.setLevel(logging.INFO)
+        self.logger.addHandler(handler)
+
+    def __call__(self, endpoint, statement):
+        if statement.seconds < self.threshold:
+            return
+        text, key = fingerprint(statement.sql)
+        with self._lock:
+            count = self._seen.get(key, 0) + 1
+            self._seen[key] = count
+        entry = {
+            "ts": datetime.now().isoformat(timespec="milliseconds"),
+            "fingerprint": key,
+            "endpoint": endpoint,
+            "ms": round(statement.seconds * 1000, 3),
+            "rows": statement.rows,
+            "params": redact(statement.parameters),
+            "count": count,
+            "sql": text[:MAX_SQL_CHARS],
+        }
+        if count == 1:
+            entry["plan"] = explain(statement.connection, statement.sql, statement.parameters)
+        self.logger.info("slow query", extra={"entry": entry})
+
+    def close(self):
+        for handler in list(self.logger.handlers):
+            handler.close()
+            self.logger.removeHandler(handler)
+
+
+def log_files(directory=DEFAULT_LOG_DIR):
+    """[(path, pid or None)] for every process's current and rotated log files."""
+    files = []
+    for path in glob.glob(os.path.join(directory, "slow_queries*.jsonl*")):
+        match = _LOG_FILE_RE.match(os.path.basename(path))
+        if match:
+            files.append((path, int(match.group(1)) if match.group(1) else None))
+    return files
+
+
+def _running(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def prune(directory=DEFAULT_LOG_DIR, keep_days=KEEP_DAYS):
+    """Remove log files older than `keep_days` unless their process is still running."""
+    cutoff = time.time() - keep_days * 86400
+    for path, pid in log_files(directory):
+        try:
+            if os.path.getmtime(path) < cutoff and (pid is None or not _running(pid)):
+                os.remove(path)
+        except FileNotFoundError:
+            continue
+
+
+def read_entries(directory=DEFAULT_LOG_DIR):
+    """Every entry in every process's current and rotated log files."""
+    for path, _ in log_files(directory):
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        yield json.loads(line)
+                    except ValueError:
+                        continue
+        except FileNotFoundError:
+            continue
+
+
+def aggregate(entries, q=None, endpoint=None):
+    """Group log entries by fingerprint, most total time first."""
+    groups = {}
+    for entry in entries:
+        if q and q.lower() not in entry.get("sql", "").lower():
+            continue
+        if endpoint and entry.get("endpoint") != endpoint:
+            continue
+        group = groups.get(entry["fingerprint"])
+        if group is None:
+            group = groups[entry["fingerprint"]] = {
+                "fingerprint": entry["fingerprint"],
+                "sql": entry.get("sql", ""),
+                "count": 0,
+                "total_ms": 0.0,
+                "max_ms": 0.0,
+                "rows": 0,
+                "endpoints": set(),
+                "first_seen": entry["ts"],
+                "plan": None,
+                "params": None,
+            }
+        group["count"] += 1
+        group["total_ms"] += entry["ms"]
+        if entry["ms"] >= group["max_ms"]:
+            group["max_ms"] = entry["ms"]
+            group["params"] = entry.get("params")
+        group["rows"] += entry.get("rows", 0)
+        group["endpoints"].add(entry.get("endpoint"))
+        # Files from different processes interleave in time.
+        group["first_seen"] = min(group["first_seen"], entry["ts"])
+        group["last_seen"] = max(group.get("last_seen", entry["ts"]), entry["ts"])
+        if entry.get("plan"):
+            group["plan"] = entry["plan"]
+    result = list(groups.values())
+    for group in result:
+        group["avg_ms"] = group["total_ms"] / group["count"]
+        group["endpoints"] = sorted(e for e in group["endpoints"] if e)
+    result.sort(key=lambda g: g["total_ms"], reverse=True)
+    return result
+
+
+def init_app(app):
+    """
+    Log statements slower than SLOW_QUERY_MS to SLOW_QUERY_LOG_DIR.
+    SLOW_QUERY_MS = None turns the log off.
+    """
+    app.config.setdefault("SLOW_QUERY_MS", DEFAULT_THRESHOLD_MS)
+    app.config.setdefault("SLOW_QUERY_LOG_DIR", DEFAULT_LOG_DIR)
+    if app.config["SLOW_QUERY_MS"] is None:
+        return
+    log = SlowQueryLog(app.config["SLOW_QUERY_LOG_DIR"], app.config["SLOW_QUERY_MS"])
+    app.extensions["slow_queries"] = log
+    add_statement_listener(app, log)
+
+
+def main(argv):
+    directory = argv[1] if len(argv) > 1 else DEFAULT_LOG_DIR
+    groups = aggregate(read_entries(directory))
+    if not groups:
+        print(f"[SlowQueries] No slow queries logged in {directory}/.")
+        return 0
+    for group in groups:
+        print(
+            f"[SlowQueries] {group['fingerprint']} x{group['count']} "
+            f"avg {group['avg_ms']:.1f} ms, max {group['max_ms']:.1f} ms, "
+            f"endpoints {', '.join(group['endpoints'])}"
+        )
+        print(f"    {group['sql'][:300]}")
+        for line in group["plan"] or []:
+            print(f"    plan: {line}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,186 @@
+# streaming.py
+"""
+Streamed rendering for long list pages.
+
+stream_page() renders a template as a generator instead of one string, and
+RowStream hands the template rows straight from the cursor, fetchmany() at a
+time. The page header goes out before the query has been read to the end,
+and only one chunk of rows is held in memory however long the list gets.
+STREAM_LIST_PAGES = False renders the same pages in one piece again.
+
+The pooled connection stays bound to the request until the last chunk has
+been sent (stream_with_context keeps the request context alive). Output is
+coalesced into pieces of about STREAM_BUFFER_BYTES so the server doesn't
+write one tiny fragment per template node.
+
+Usage:
+    python streaming.py [--db PATH | --scale N]   # TTFB and RSS, streamed vs not
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+from flask import current_app, get_flashed_messages, render_template, stream_template
+
+DEFAULT_CHUNK_SIZE = 500
+DEFAULT_BUFFER_BYTES = 16 * 1024
+
+BENCH_PAGES = ("/admin/doctors", "/admin/patients", "/admin/appointments")
+
+
+class RowStream:
+    """
+    Iterable over a cursor's rows, fetched `chunk_size` at a time. Truth
+    testing peeks at the first chunk, so templates can keep using
+    `{% if rows %}` ... `{% for row in rows %}`. Iterable once.
+    """
+
+    def __init__(self, cursor, chunk_size=DEFAULT_CHUNK_SIZE):
+        self.cursor = cursor
+        self.chunk_size = chunk_size
+        self._first = None
+
+    def _peek(self):
+        if self._first is None:
+            self._first = self.cursor.fetchmany(self.chunk_size)
+        return self._first
+
+    def __bool__(self):
+        return bool(self._peek())
+
+    def __iter__(self):
+        rows = self._peek()
+        while rows:
+            yield from rows
+            rows = self.cursor.fetchmany(self.chunk_size)
+
+
+def _coalesce(pieces, size):
+    buffered = []
+    length = 0
+    try:
+        for piece in pieces:
+            buffered.append(piece)
+            length += len(piece)
+            if length >= size:
+                yield "".join(buffered)
+                buffered = []
+                length = 0
+        if buffered:
+            yield "".join(buffered)
+    finally:
+        pieces.close()
+
+
+def stream_enabled():
+    return current_app.config["STREAM_LIST_PAGES"]
+
+
+def rows_for_template(cursor):
+    """A RowStream when list pages stream, else every row as a list."""
+    if stream_enabled():
+        return RowStream(cursor, current_app.config["STREAM_CHUNK_SIZE"])
+    return cursor.fetchall()
+
+
+def stream_page(template_name, **context):
+    """
+    render_template() for pages fed by rows_for_template(). Returns a
+    generator (a streamed response) when list pages stream.
+    """
+    if not stream_enabled():
+        return render_template(template_name, **context)
+    # Pop flashed messages now: the session cookie is written before the
+    # body is streamed, so popping them mid-stream would show them again.
+    get_flashed_messages(with_categories=True)
+    size = current_app.config["STREAM_BUFFER_BYTES"]
+    return _coalesce(stream_template(template_name, **context), size)
+
+
+def init_app(app):
+    """
+    STREAM_LIST_PAGES turns streamed list pages on or off; STREAM_CHUNK_SIZE
+    rows are fetched at a time and STREAM_BUFFER_BYTES of output sent at once.
+    """
+    app.config.setdefault("STREAM_LIST_PAGES", True)
+    app.config.setdefault("STREAM_CHUNK_SIZE", DEFAULT_CHUNK_SIZE)
+    app.config.setdefault("STREAM_BUFFER_BYTES", DEFAULT_BUFFER_BYTES)
+
+
+def _measure(path, url, streamed):
+    """Child process: TTFB, total time and RSS growth for one request."""
+    import db
+
+    db.DB_PATH = path
+    from app import create_app
+    from bench_routes import DEMO_LOGINS
+
+    app = create_app({"TESTING": True, "STREAM_LIST_PAGES": streamed})
+    client = app.test_client()
+    email, password = DEMO_LOGINS["admin"]
+    client.post("/login", data={"email": email, "password": password})
+    client.get("/admin/dashboard")
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    started = time.perf_counter()
+    response = client.get(url, buffered=False)
+    body = iter(response.response)
+    size = len(next(body, b""))
+    ttfb = time.perf_counter() - started
+    for chunk in body:
+        size += len(chunk)
+    response.close()
+    total = time.perf_counter() - started
+
+    rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return {
+        "status": response.status_code,
+        "ttfb_ms": round(ttfb * 1000, 1),
+        "total_ms": round(total * 1000, 1),
+        "kib": size // 1024,
+        "rss_growth_mib": round((rss_after - rss_before) / 1024, 1),
+    }
+
+
+def main(argv):
+    if len(argv) == 5 and argv[1] == "_measure":
+        print(json.dumps(_measure(argv[2], argv[3], argv[4] == "1")))
+        return 0
+
+    parser = argparse.ArgumentParser(description="Compare streamed and buffered list pages.")
+    parser.add_argument("--db", help="existing database (default: generate a scratch one)")
+    parser.add_argument("--scale", type=float, default=1.0)
+    args = parser.parse_args(argv[1:])
+
+    path = args.db
+    if path is None:
+        from generate_data import build
+
+        path = os.path.join(tempfile.mkdtemp(prefix="hms-stream-"), "hms.db")
+        build(path, scale=args.scale)
+
+    print(f"[Stream] {'page':22} {'mode':9} {'TTFB ms':>9} {'total ms':>9} {'KiB':>8} {'RSS +MiB':>9}")
+    for url in BENCH_PAGES:
+        for streamed in (False, True):
+            # A fresh process per measurement: ru_maxrss never goes down.
+            out = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), "_measure", path, url, "1" if streamed else "0"],
+                capture_output=True,
+                text=True,
+                check=True,
+            ).stdout
+            r = json.loads(out.strip().splitlines()[-1])
+            print(
+                f"[Stream] {url:22} {'streamed' if streamed else 'buffered':9} "
+                f"{r['ttfb_ms']:9.1f} {r['total_ms']:9.1f} {r['kib']:8} {r['rss_growth_mib']:9.1f}"
+            )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,84 @@
+# summaries.py
+"""
+Trigger-maintained doctor/patient summaries (see doctor_patient_summary in
+schema.sql). They cover the hot appointments table only, like the doctor
+dashboard itself: appointments moved to the archive drop out of them.
+
+Usage:
+    python summaries.py verify    # report rows that differ from the tables
+    python summaries.py rebuild   # recompute every summary from scratch
+"""
+import sys
+
+from db import get_db
+
+
+def rebuild_summaries(conn, commit=True):
+    """
+    Replace doctor_patient_summary with freshly computed rows in one
+    transaction. With commit=False the caller's transaction is left open.
+    """
+    cur = conn.cursor()
+    cur.execute("DELETE FROM doctor_patient_summary")
+    cur.execute("INSERT INTO doctor_patient_summary SELECT * FROM doctor_patient_summary_source")
+    if commit:
+        conn.commit()
+    return cur.rowcount
+
+
+def verify_summaries(conn):
+    """
+    Compare doctor_patient_summary against the tables.
+    Returns a list of (doctor_id, patient_id, stored, actual) for every
+    mismatch; a missing row is None.
+    """
+    cur = conn.cursor()
+    cur.execute("SELECT * FROM doctor_patient_summary")
+    stored = {(row["doctor_id"], row["patient_id"]): tuple(row) for row in cur.fetchall()}
+    cur.execute("SELECT * FROM doctor_patient_summary_source")
+    actual = {(row["doctor_id"], row["patient_id"]): tuple(row) for row in cur.fetchall()}
+    drift = []
+    for pair in sorted(set(stored) | set(actual)):
+        if stored.get(pair) != actual.get(pair):
+            drift.append((pair[0], pair[1], stored.get(pair), actual.get(pair)))
+    return drift
+
+
+def ensure_summaries(conn, commit=True):
+    """Build the summaries once for databases created before the table existed."""
+    cur = conn.cursor()
+    cur.execute(
+        """
+        SELECT EXISTS (SELECT 1 FROM appointments)
+           AND NOT EXISTS (SELECT 1 FROM doctor_patient_summary) AS missing
+        """
+    )
+    if cur.fetchone()["missing"]:
+        rebuild_summaries(conn, commit)
+
+
+def main(argv):
+    command = argv[1] if len(argv) > 1 else "verify"
+    conn = get_db()
+    if command == "rebuild":
+        rows = rebuild_summaries(conn)
+        print(f"[Summaries] Rebuilt {rows} doctor/patient summaries.")
+        status = 0
+    elif command == "verify":
+        drift = verify_summaries(conn)
+        if drift:
+            for doctor_id, patient_id, have, want in drift:
+                print(f"[Summaries] Drift doctor {doctor_id}/patient {patient_id}: stored={have} actual={want}")
+            status = 1
+        else:
+            print("[Summaries] All summaries match.")
+            status = 0
+    else:
+        print(__doc__)
+        status = 2
+    conn.close()
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,362 @@
+# writer.py
+"""
+Single-writer queue for SQLite writes.
+
+SQLite allows one writer at a time. Without the queue, every request
+commits on its own connection, and a burst of bookings queues on the
+database's busy timeout, which backs off in sleeps of up to 100 ms. With
+WRITE_QUEUE_ENABLED, the writes behind booking, cancellation, the doctor
+dashboard and profile edits go to a queue instead. One thread owns the
+only write connection and takes whatever jobs are waiting (up to
+WRITE_QUEUE_BATCH). It runs each job in its own SAVEPOINT inside one
+BEGIN IMMEDIATE transaction and commits them together. The whole group
+shares one commit and one WAL sync, and nobody waits on a lock.
+
+A job is fn(conn, *args). It runs its statements and returns a value; it
+never commits or rolls back itself (see booking.book and friends). The
+caller gets the job's return value, or its exception, through a Future
+once the group has committed. A job that raises is rolled back to its
+savepoint without touching the rest of the group. write() runs the same
+job in a BEGIN IMMEDIATE transaction on the request's own connection when
+the queue is off, so the routes look the same either way.
+
+Other writes (admin pages, registration, CLIs) still commit on their own
+connections. SQLite's busy timeout serializes them against the writer
+thread as before. A request must not hold its own write transaction open
+while it waits on the queue.
+
+Usage:
+    python writer.py bench [threads] [writes]   # direct commits vs the queue on a scratch DB
+"""
+import queue
+import random
+import sqlite3
+import sys
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+
+from flask import current_app, has_app_context
+
+import db
+
+DEFAULT_BATCH = 64
+DEFAULT_QUEUE = 1024
+DEFAULT_TIMEOUT = 10.0
+
+
+class WriterBusy(sqlite3.OperationalError):
+    """Raised when a write can't be queued, or doesn't start, within the timeout."""
+
+
+class WriterService:
+    """
+    One thread, one write connection, many queued jobs.
+
+    The thread starts on the first submit(), so importing the app or
+    running a CLI never starts it.
+    """
+
+    def __init__(self, path=None, max_batch=DEFAULT_BATCH, queue_size=DEFAULT_QUEUE,
+                 timeout=DEFAULT_TIMEOUT):
+        self.path = path
+        self.max_batch = max_batch
+        self.timeout = timeout
+        self._jobs = queue.Queue(queue_size)
+        self._lock = threading.Lock()
+        self._thread = None
+        self.jobs = 0
+        self.batches = 0
+        self.largest_batch = 0
+        self.failed = 0
+        self.busy = 0
+        self.queue_wait_total = 0.0
+        self.queue_wait_max = 0.0
+        self.commit_total = 0.0
+
+    def _start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._loop, name="sqlite-writer", daemon=True)
+                self._thread.start()
+
+    def submit(self, fn, *args):
+        """Queue fn(conn, *args). Returns a Future for its result."""
+        self._start()
+        future = Future()
+        try:
+            self._jobs.put((fn, args, future, time.perf_counter()), timeout=self.timeout)
+        except queue.Full:
+            with self._lock:
+                self.busy += 1
+            raise WriterBusy(f"write queue full after {self.timeout}s")
+        return future
+
+    def run(self, fn, *args):
+        """
+        Queue fn(conn, *args) and wait for its group to commit. If it hasn't
+        started within the timeout it is withdrawn and WriterBusy raised, so
+        a caller that gives up never has its write committed behind its back.
+        """
+        future = self.submit(fn, *args)
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeout:
+            if future.cancel():
+                with self._lock:
+                    self.busy += 1
+                raise WriterBusy(f"write not started after {self.timeout}s")
+            return future.result()
+
+    def _loop(self):
+        conn = db._connect(self.path)
+        stopping = False
+        while not stopping:
+            job = self._jobs.get()
+            if job is None:
+                break
+            batch = [job]
+            while len(batch) < self.max_batch:
+                try:
+                    job = self._jobs.get_nowait()
+                except queue.Empty:
+                    break
+                if job is None:
+                    stopping = True
+                    break
+                batch.append(job)
+            self._commit(conn, batch)
+        conn.close()
+
+    def _commit(self, conn, batch):
+        started = time.perf_counter()
+        # Jobs whose caller gave up (cancelled futures) are dropped here.
+        batch = [job for job in batch if job[2].set_running_or_notify_cancel()]
+        if not batch:
+            return
+        outcomes = []
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            for fn, args, future, _ in batch:
+                conn.execute("SAVEPOINT job")
+                try:
+                    result = fn(conn, *args)
+                except Exception as exc:
+                    conn.execute("ROLLBACK TO job")
+                    conn.execute("RELEASE job")
+                    outcomes.append((future, None, exc))
+                else:
+                    conn.execute("RELEASE job")
+                    outcomes.append((future, result, None))
+            conn.commit()
+        except Exception as exc:
+            # BEGIN or COMMIT failed: nothing in the group was written.
+            if conn.in_transaction:
+                conn.rollback()
+            outcomes = [(future, None, exc) for _, _, future, _ in batch]
+
+        finished = time.perf_counter()
+        with self._lock:
+            self.batches += 1
+            self.jobs += len(batch)
+            self.largest_batch = max(self.largest_batch, len(batch))
+            self.commit_total += finished - started
+            for _, _, _, queued in batch:
+                waited = started - queued
+                self.queue_wait_total += waited
+                if waited > self.queue_wait_max:
+                    self.queue_wait_max = waited
+            self.failed += sum(1 for _, _, exc in outcomes if exc is not None)
+        for future, result, exc in outcomes:
+            if exc is None:
+                future.set_result(result)
+            else:
+                future.set_exception(exc)
+
+    def shutdown(self):
+        """Finish the queued jobs and stop the thread."""
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            self._jobs.put(None)
+            thread.join()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "jobs": self.jobs,
+                "batches": self.batches,
+                "avg_batch": round(self.jobs / self.batches, 2) if self.batches else 0.0,
+                "largest_batch": self.largest_batch,
+                "queued": self._jobs.qsize(),
+                "failed": self.failed,
+                "busy": self.busy,
+                "queue_wait_avg_ms": round(self.queue_wait_total * 1000 / self.jobs, 3)
+                if self.jobs
+                else 0.0,
+                "queue_wait_max_ms": round(self.queue_wait_max * 1000, 3),
+                "commit_avg_ms": round(self.commit_total * 1000 / self.batches, 3)
+                if self.batches
+                else 0.0,
+            }
+
+
+def init_app(app):
+    """
+    WRITE_QUEUE_ENABLED turns the writer thread on (off by default).
+    WRITE_QUEUE_BATCH caps the jobs per commit, WRITE_QUEUE_SIZE the jobs
+    waiting, and WRITE_QUEUE_TIMEOUT how long a caller waits to queue a job
+    or for it to start.
+    """
+    app.config.setdefault("WRITE_QUEUE_ENABLED", False)
+    app.config.setdefault("WRITE_QUEUE_BATCH", DEFAULT_BATCH)
+    app.config.setdefault("WRITE_QUEUE_SIZE", DEFAULT_QUEUE)
+    app.config.setdefault("WRITE_QUEUE_TIMEOUT", DEFAULT_TIMEOUT)
+    if app.config["WRITE_QUEUE_ENABLED"]:
+        app.extensions["writer"] = WriterService(
+            db.DB_PATH,
+            max_batch=app.config["WRITE_QUEUE_BATCH"],
+            queue_size=app.config["WRITE_QUEUE_SIZE"],
+            timeout=app.config["WRITE_QUEUE_TIMEOUT"],
+        )
+
+
+def _service():
+    if has_app_context():
+        return current_app.extensions.get("writer")
+    return None
+
+
+def write(fn, *args):
+    """
+    Run the job fn(conn, *args) in a committed write transaction and return
+    its result: on the writer thread when the queue is on, else on the
+    request's write connection.
+    """
+    service = _service()
+    if service is None:
+        return db.write_transaction(db.get_db(write=True), fn, *args)
+    return service.run(fn, *args)
+
+
+def _cancel_slot(conn, patient_id, doctor_id, day, slot):
+    conn.execute(
+        """
+        UPDATE appointments SET status = 'Cancelled'
+        WHERE doctor_id = ? AND date = ? AND time = ?
+          AND patient_id = ? AND status = 'Booked'
+        """,
+        (doctor_id, day, slot, patient_id),
+    )
+
+
+def bench(threads=16, writes=2000, slots=200):
+    """
+    The booking.py stress mix (bookings with 20% cancellations) from
+    `threads` threads, once with every thread committing on its own
+    connection and once through a WriterService, each on a fresh scratch
+    database. Lock wait is the time spent in BEGIN IMMEDIATE (direct) or
+    in the queue before the job's group started (queued).
+    """
+    import booking
+    from bench_routes import _percentile
+
+    results = {}
+    for mode in ("direct", "queued"):
+        path, doctor_id, patient_ids, day, slot_times = booking.scratch_db(threads, slots)
+        service = WriterService(path) if mode == "queued" else None
+        latencies = []
+        lock_waits = []
+        errors = []
+        lock = threading.Lock()
+        start_line = threading.Barrier(threads)
+
+        def worker(index):
+            rng = random.Random(index)
+            local = db._connect(path) if service is None else None
+            patient_id = patient_ids[index]
+            start_line.wait()
+            for _ in range(writes // threads):
+                slot = rng.choice(slot_times)
+                if rng.random() < 0.2:
+                    job, args = _cancel_slot, (patient_id, doctor_id, day, slot)
+                else:
+                    job, args = booking.book, (patient_id, doctor_id, day, slot)
+                started = time.perf_counter()
+                try:
+                    if service is None:
+                        local.execute("BEGIN IMMEDIATE")
+                        waited = time.perf_counter() - started
+                        try:
+                            job(local, *args)
+                            local.commit()
+                        except BaseException:
+                            local.rollback()
+                            raise
+                    else:
+                        service.run(job, *args)
+                        waited = None
+                except sqlite3.Error as exc:
+                    with lock:
+                        errors.append(repr(exc))
+                    continue
+                elapsed = time.perf_counter() - started
+                with lock:
+                    latencies.append(elapsed)
+                    if waited is not None:
+                        lock_waits.append(waited)
+            if local is not None:
+                local.close()
+
+        started = time.perf_counter()
+        workers = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+        for t in workers:
+            t.start()
+        for t in workers:
+            t.join()
+        elapsed = time.perf_counter() - started
+
+        result = {"writes_per_s": round(len(latencies) / elapsed, 1), "errors": errors}
+        if service is not None:
+            stats = service.stats()
+            service.shutdown()
+            result["lock_wait_avg_ms"] = stats["queue_wait_avg_ms"]
+            result["lock_wait_max_ms"] = stats["queue_wait_max_ms"]
+            result["avg_batch"] = stats["avg_batch"]
+        else:
+            result["lock_wait_avg_ms"] = round(sum(lock_waits) * 1000 / max(len(lock_waits), 1), 3)
+            result["lock_wait_max_ms"] = round(max(lock_waits, default=0.0) * 1000, 3)
+            result["avg_batch"] = 1.0
+        latencies.sort()
+        for pct in (50, 95, 99):
+            result[f"p{pct}_ms"] = round(_percentile(latencies, pct) * 1000, 3)
+        result["max_ms"] = round(latencies[-1] * 1000, 3) if latencies else 0.0
+        results[mode] = result
+    return results
+
+
+def main(argv):
+    if len(argv) < 2 or argv[1] != "bench":
+        print(__doc__)
+        return 2
+    threads = int(argv[2]) if len(argv) > 2 else 16
+    writes = int(argv[3]) if len(argv) > 3 else 2000
+    results = bench(threads, writes)
+    print(
+        f"[Writer] {'mode':7} {'writes/s':>9} {'p50':>8} {'p95':>8} {'p99':>8} {'max':>8} "
+        f"{'wait avg':>9} {'wait max':>9} {'batch':>6} {'errors':>6}"
+    )
+    for mode, r in results.items():
+        print(
+            f"[Writer] {mode:7} {r['writes_per_s']:9.1f} {r['p50_ms']:8.2f} {r['p95_ms']:8.2f} "
+            f"{r['p99_ms']:8.2f} {r['max_ms']:8.2f} {r['lock_wait_avg_ms']:9.2f} "
+            f"{r['lock_wait_max_ms']:9.2f} {r['avg_batch']:6.2f} {len(r['errors']):6}"
+        )
+    for mode, r in results.items():
+        for error in r["errors"][:5]:
+            print(f"[Writer] {mode} error: {error}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))